@@ -8,268 +8,174 @@
 # status message indicating the result of the API call
 #
 # API methods not yet implemented are:
-# - Get POC Content
-# - Get Consolidated POC
 # - Device Configuration
 # - Update Failed Authorization Status
 #
 # Dependencies
 # - Python 3.x
 # - 'requests' module
+# - 'httpx' module (optional, for AsyncAccClient and the 'http2' transport; plus 'h2' for HTTP/2)
+# - 'orjson' module (optional, faster response parsing)
+#
+# Connections
+# All API calls go through an AccClient, which owns a single connection-pooled Requests Session with the ACC client
+# cert loaded once. The module level functions (verify_order, create_order, ...) are thin wrappers over a default
+# AccClient built from the ACC_* environment variables, so existing scripts keep working unchanged. AsyncAccClient
+# offers the same API methods as coroutines for asyncio applications. Set transport='http2' (or ACC_TRANSPORT=http2)
+# to multiplex concurrent calls over HTTP/2 instead of opening one HTTP/1.1 connection per call, or transport='stdlib'
+# (ACC_TRANSPORT=stdlib) for short-lived processes: it uses http.client only, so Requests is never imported. Heavy
+# modules are imported on first use, and clients share one SSLContext per cert so TLS sessions are resumed. API methods
+# return an AccResult, a named version of the (post_data, full_response, error_code, error_message, call_type) tuple.
+#
+# Batch Enrollment
+# enroll_orders() runs verify_order then create_order for a stream of order records over a thread pool, and
+# `python acc.py enroll orders.csv` does the same from the command line. With an EnrollmentJournal (--journal) a
+# crashed run can be resumed without re-creating orders that already reached ACC. Records failing validate_order() are
+# reported as 'invalid' without calling ACC. cancel_devices() (`python acc.py cancel`) does the same for cancellations.
+# run_sharded() (--processes) spreads either over several worker processes sharing one SharedRateLimiter budget.
+#
+# Proof of Coverage
+# poc_content() and consolidated_poc() can stream the base64 encoded POC document straight into a file or file-like
+# sink, decoding it chunk by chunk, and download_pocs() (`python acc.py poc serials.txt -d pocs/`) fetches POCs for
+# many devices concurrently.
+#
+# Reconciliation
+# reconcile_devices() streams serials through three_sixty_lookup with a bounded window and projects each response to
+# a flat row, and `python acc.py reconcile serials.txt -o report.csv` writes those rows as they arrive.
 #
 # Credits
 # Big thanks to the folks that wrote the Meraki 'dashboard-api-python' module. This module borrowed a lot of from them.
 #######################################################################################################################
 
+import binascii
+import collections
+import csv
+import importlib
+import importlib.util
+import itertools
 import json
 import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
 
-import requests
 
+class _LazyModule(object):
+    """
+    :usage: Stand-in for a module that is imported the first time one of its attributes is used. Keeps modules only
+            some code paths need out of the import time of acc.py, which dominates short-lived processes that make a
+            single call.
+    """
 
-def acc_credentials():
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_module'] = None
+
+    def __getattr__(self, attr):
+        module = self._lazy_module
+        if module is None:
+            module = self.__dict__['_lazy_module'] = importlib.import_module(self._lazy_name)
+        return getattr(module, attr)
+
+
+def _optional_module(name):
     """
-    :usage: Defines the AppleCare Settings for the API calls
-    :return: Requests Session w/ headers and ACC cert, ACC ShipTo, and endpoint base URL
+    :param name: Module name
+    :return: _LazyModule for the module, or None if it is not installed
     """
-    # Begin a Requests Session for all API Calls
-    session = requests.Session()
-    session.headers.update({'Content-Type': "application/json;charset=utf-8"})
+    return _LazyModule(name) if importlib.util.find_spec(name) is not None else None
 
-    # Get ACC Connection Details from Environment Variables
-    acc_ship_to = os.environ['ACC_SHIPTO']  # AppleCare Connect 10 Digit SHIPTO Number
-    acc_env = os.environ['ACC_ENV']  # AppleCare Connect Environment: UAT or PROD
 
-    # Set the base_url of the AppleCare Connect endpoint and SSL cert
-    # Default to ACC Application IPT Sandbox w/ UAT Cert
-    base_url = "https://acc-ipt.apple.com/order-service/1.0"
-    session.cert = (
-        os.environ['ACC_UAT_CERT'],  # Path to AppleCare Connect UAT Cert .PEM File
-        os.environ['ACC_UAT_PRIVATE_KEY']  # Path to AppleCare Connect UAT Private Key .PEM File
-    )
+# Imported on first use; see _LazyModule
+argparse = _LazyModule('argparse')
+asyncio = _LazyModule('asyncio')
+futures = _LazyModule('concurrent.futures')
+multiprocessing = _LazyModule('multiprocessing')
+requests = _LazyModule('requests')
+sqlite3 = _LazyModule('sqlite3')
+ssl = _LazyModule('ssl')
+urllib3 = _LazyModule('urllib3')
 
-    if acc_env == 'UAT':
-        # Joint UAT environment
-        session.cert = (
-            os.environ['ACC_UAT_CERT'],  # Path to AppleCare Connect UAT Cert .PEM File
-            os.environ['ACC_UAT_PRIVATE_KEY']  # Path to AppleCare Connect UAT Private Key .PEM File
-        )
-        if (int(acc_ship_to) % 2) == 0:
-            base_url = "https://api-applecareconnect-ept.apple.com/order-service/1.0"
-        else:
-            base_url = "https://api-applecareconnect-ept2.apple.com/order-service/1.0"
-    elif acc_env == 'PROD':
-        # Production environment
-        session.cert = (
-            os.environ['ACC_PROD_CERT'],  # Path to AppleCare Connect PROD Cert .PEM File
-            os.environ['ACC_PROD_PRIVATE_KEY']  # Path to AppleCare Connect PROD Private Key .PEM File
-        )
-        if (int(acc_ship_to) % 2) == 0:
-            base_url = "https://api-applecareconnect.apple.com/order-service/1.0"
-        else:
-            base_url = "https://api-applecareconnect2.apple.com/order-service/1.0"
+httpx = _optional_module('httpx')  # Optional, used by AsyncAccClient and HttpxTransport
+orjson = _optional_module('orjson')  # Optional, faster JSON decoding of responses
 
-    return session, acc_ship_to, base_url
+# AppleCare Connect endpoint base URLs as (even ShipTo, odd ShipTo) pairs
+ACC_BASE_URLS = {
+    'UAT': (
+        "https://api-applecareconnect-ept.apple.com/order-service/1.0",  # Joint UAT environment
+        "https://api-applecareconnect-ept2.apple.com/order-service/1.0"
+    ),
+    'PROD': (
+        "https://api-applecareconnect.apple.com/order-service/1.0",  # Production environment
+        "https://api-applecareconnect2.apple.com/order-service/1.0"
+    ),
+}
+# ACC Application IPT Sandbox, used when ACC_ENV is neither UAT nor PROD
+ACC_IPT_BASE_URL = "https://acc-ipt.apple.com/order-service/1.0"
 
 
-def is_json(json_array):
+def acc_base_url(acc_ship_to, acc_env):
     """
-    :param json_array: String variable to be validated if it is JSON
-    :return: True if json_array is valid, False if not
+    :param acc_ship_to: AppleCare Connect 10 Digit SHIPTO Number
+    :param acc_env: AppleCare Connect Environment: UAT or PROD
+    :return: Base URL of the AppleCare Connect endpoint serving the ShipTo
     """
-    try:
-        json_object = json.loads(json_array)
-    except ValueError:
-        return False
-    return True
+    if acc_env not in ACC_BASE_URLS:
+        return ACC_IPT_BASE_URL
+    # Even ShipTo numbers use the primary host, odd ones the secondary host
+    return ACC_BASE_URLS[acc_env][int(acc_ship_to) % 2]
 
 
-def response_handler(full_response, suppress_print):
+def acc_base_urls(acc_ship_to, acc_env):
     """
-    :param full_response: JSON response from the DEP API
-    :param suppress_print: Prints output when function is called
-    :return: Full API response and any API errors and their messages
+    :param acc_ship_to: AppleCare Connect 10 Digit SHIPTO Number
+    :param acc_env: AppleCare Connect Environment: UAT or PROD
+    :return: (primary, paired) base URLs for the ShipTo. The paired host serves as failover target; the IPT Sandbox
+             has no pair, so both are the same
     """
-    valid_return = is_json(full_response)
-
-    if valid_return:
-        json_response = json.loads(full_response)
-        error_code = []
-        error_message = []
-
-        # Verify/Create/Cancel Order Error
-        if "orderErrorResponse" in full_response:
-            api_errors = json_response["orderErrorResponse"]
-            if isinstance(api_errors, dict):
-                # Single Error
-                error_code.append(json_response["orderErrorResponse"]["errorCode"])
-                error_message.append(json_response["orderErrorResponse"]["errorMessage"])
-            else:
-                # Multiple Errors
-                for error in api_errors:
-                    error_code.append(error["errorCode"])
-                    error_message.append(error["errorMessage"])
-            if suppress_print is False:
-                print('API Error: {0}'.format(error_code))
-        # Device Enrollment Error
-        elif 'deviceErrorResponse' in full_response:
-            api_errors = json_response["orderDetailsResponses"]["deviceEligibility"]["deviceErrorResponse"]
-            if isinstance(api_errors, dict):
-                # Single Error
-                error_code.append(
-                    json_response["orderDetailsResponses"]["deviceEligibility"]["deviceErrorResponse"]["errorCode"]
-                )
-                error_message.append(
-                    json_response["orderDetailsResponses"]["deviceEligibility"]["deviceErrorResponse"]["errorMessage"]
-                )
-            else:
-                # Multiple Errors
-                for error in api_errors:
-                    error_code.append(error["errorCode"])
-                    error_message.append(error["errorMessage"])
-            if suppress_print is False:
-                print('API Error: {0}'.format(error_code))
-        # Order Lookup Error
-        elif "lookupErrorResponse" in full_response:
-            api_errors = json_response["lookupErrorResponse"]
-            if isinstance(api_errors, dict):
-                # Single Error
-                error_code.append(
-                    json_response["lookupErrorResponse"]["errorCode"]
-                )
-                error_message.append(
-                    json_response["lookupErrorResponse"]["errorMessage"]
-                )
-            else:
-                # Multiple Errors
-                for error in api_errors:
-                    error_code.append(error["errorCode"])
-                    error_message.append(error["errorMessage"])
-            if suppress_print is False:
-                print('API Error: {0}'.format(error_code))
-        # POC Content Error
-        elif "pocErrorResponse" in full_response:
-            api_errors = json_response["pocErrorResponse"]
-            if isinstance(api_errors, dict):
-                # Single Error
-                error_code.append(
-                    json_response["pocErrorResponse"]["errorCode"]
-                )
-                error_message.append(
-                    json_response["pocErrorResponse"]["errorMessage"]
-                )
-            else:
-                # Multiple Errors
-                for error in api_errors:
-                    error_code.append(error["errorCode"])
-                    error_message.append(error["errorMessage"])
-            if suppress_print is False:
-                print('API Error: {0}'.format(error_code))
-        # Device Configuration Error
-        elif "deviceConfigErrorResponse" in full_response:
-            api_errors = json_response["deviceConfigErrorResponse"]
-            if isinstance(api_errors, dict):
-                # Single Error
-                error_code.append(
-                    json_response["deviceConfigErrorResponse"]["errorCode"]
-                )
-                error_message.append(
-                    json_response["deviceConfigErrorResponse"]["errorMessage"]
-                )
-            else:
-                # Multiple Errors
-                for error in api_errors:
-                    error_code.append(error["errorCode"])
-                    error_message.append(error["errorMessage"])
-            if suppress_print is False:
-                print('API Error: {0}'.format(error_code))
-        # Failed Auth Error
-        elif "failedAuthErrorResponse" in full_response:
-            api_errors = json_response["failedAuthErrorResponse"]
-            if isinstance(api_errors, dict):
-                # Single Error
-                error_code.append(
-                    json_response["failedAuthErrorResponse"]["errorCode"]
-                )
-                error_message.append(
-                    json_response["failedAuthErrorResponse"]["errorMessage"]
-                )
-            else:
-                # Multiple Errors
-                for error in api_errors:
-                    error_code.append(error["errorCode"])
-                    error_message.append(error["errorMessage"])
-            if suppress_print is False:
-                print('API Error: {0}'.format(error_code))
-        # Consolidated POC Error
-        elif "errorResponse" in full_response:
-            api_errors = json_response["errorResponse"]
-            if isinstance(api_errors, dict):
-                # Single Error
-                error_code.append(
-                    json_response["errorResponse"]["errorCode"]
-                )
-                error_message.append(
-                    json_response["errorResponse"]["errorMessage"]
-                )
-            else:
-                # Multiple Errors
-                for error in api_errors:
-                    error_code.append(error["errorCode"])
-                    error_message.append(error["errorMessage"])
-            if suppress_print is False:
-                print('API Error: {0}'.format(error_code))
-        # Ship-to Error
-        elif "error_code" in full_response:
-            error_code.append(json_response["errorCode"])
-            error_message.append(json_response["errorMessage"])
-            if suppress_print is False:
-                print('API Error: {0}'.format(error_code))
-        # No Errors
-        else:
-            if suppress_print is False:
-                print('REST Operation Successful - See full response for details\n')
+    primary = acc_base_url(acc_ship_to, acc_env)
+    if acc_env not in ACC_BASE_URLS:
+        return primary, primary
+    return primary, ACC_BASE_URLS[acc_env][(int(acc_ship_to) + 1) % 2]
 
-    else:
-        error_code = "ACC_ERR_0001"
-        error_message = "JSON is invalid - Inspect full response for errors"
-        if suppress_print is False:
-            print('{}\n'.format(error_message))
-            print(full_response)
 
-    return json.loads(full_response), error_code, error_message
+def acc_cert_from_env(acc_env):
+    """
+    :param acc_env: AppleCare Connect Environment: UAT or PROD
+    :return: (cert, private key) paths for the environment, read from environment variables
+    """
+    if acc_env == 'PROD':
+        return (
+            os.environ['ACC_PROD_CERT'],  # Path to AppleCare Connect PROD Cert .PEM File
+            os.environ['ACC_PROD_PRIVATE_KEY']  # Path to AppleCare Connect PROD Private Key .PEM File
+        )
+    # UAT and the IPT Sandbox both use the UAT Cert
+    return (
+        os.environ['ACC_UAT_CERT'],  # Path to AppleCare Connect UAT Cert .PEM File
+        os.environ['ACC_UAT_PRIVATE_KEY']  # Path to AppleCare Connect UAT Private Key .PEM File
+    )
 
 
-def verify_order(invoice_number, first_name, last_name, company_name, email_address, address_line1, address_line2, city,
-                 state, zip_code, device_id, secondary_serial, purchase_date, suppress_print=False):
+def request_context(acc_ship_to):
     """
-    :usage: Designed to verify an order, to ensure that all criteria are met before placing the order. This API is
-            recommended to be used before using the createOrder API.
-    :param invoice_number: Invoice number from POS
-    :param first_name: Customer's first name as shown on invoice
-    :param last_name: Customer's last name as shown on invoice
-    :param company_name: Customer's company as shown on invoice (optional)
-    :param email_address: Customer's email address as shown on invoice
-    :param address_line1: First line of Customer's street address as shown on invoice (optional)
-    :param address_line2: Second line of Customer's street address as shown on invoice (optional)
-    :param city: City of Customer's street address as shown on invoice (optional)
-    :param state: State of Customer's street address as shown on invoice (optional)
-    :param zip_code: Zip Code of Customer's street address as shown on invoice (optional)
-    :param device_id: Serial number of the AppleCare eligible device sold
-    :param secondary_serial: Serial number the secondary AppleCare eligible device sold (Thunderbolt Display, optional)
-    :param purchase_date: Purchase date of the AppleCare eligible device
-    :param suppress_print: Suppress any print output from function (Default: False)
-    :return: JSON formatted strings of the complete API request, response, and any error codes
+    :param acc_ship_to: AppleCare Connect 10 Digit SHIPTO Number
+    :return: requestContext array sent with every API call
     """
-    # Establish request variables
-    session, acc_ship_to, base_url = acc_credentials()
-
-    post_url = '{0}/verify-order/'.format(str(base_url))
-    call_type = 'verify_order'
+    return dict(shipTo=acc_ship_to, timeZone="420", langCode="en")
 
-    # Create request array
-    request_array = dict(shipTo=acc_ship_to, timeZone="420", langCode="en")
 
+def order_post_data(acc_ship_to, invoice_number, first_name, last_name, company_name, email_address, address_line1,
+                    address_line2, city, state, zip_code, device_id, secondary_serial, purchase_date, context=None):
+    """
+    :usage: Builds the request body shared by verify_order and create_order
+    :param context: requestContext array to send, e.g. one shared by every call of a client
+                    (Default: request_context(acc_ship_to))
+    :return: post_data array for the verify-order and create-order endpoints
+    """
     # Customer Request array
     customer = dict(
         customerEmailId=email_address, address_line1=address_line1, address_line2=address_line2, city=city,
@@ -293,173 +199,3881 @@ def verify_order(invoice_number, first_name, last_name, company_name, email_addr
     )
 
     # Prepare data in array
-    post_data = dict(
-        requestContext=request_array, customerRequest=customer, deviceRequest=device,
+    return dict(
+        requestContext=context or request_context(acc_ship_to), customerRequest=customer, deviceRequest=device,
         appleCareSalesDate=purchase_date, pocLanguage="ENG", pocDeliveryPreference="E",
         purchaseOrderNumber=invoice_number, marketID="", overridePocFlag="", emailFlag="1"
     )
 
-    # Format post_data as JSON
-    full_request = json.dumps(post_data)
 
-    # Send data to API
-    response = session.post(post_url, data=full_request)
+def cancel_post_data(acc_ship_to, device_id, cancellation_date, cancel_reason_code, context=None):
+    """
+    :usage: Builds the request body for the cancel-order endpoint
+    :param context: requestContext array to send (Default: request_context(acc_ship_to))
+    :return: post_data array for the cancel-order endpoint
+    """
+    return dict(
+        requestContext=context or request_context(acc_ship_to), deviceId=device_id.upper(),
+        cancellationDate=cancellation_date, purchaseOrderNumber="", cancelReasonCode=cancel_reason_code
+    )
+
 
-    # Call return handler function to parse request response
-    full_response, error_code, error_message = response_handler(response.text, suppress_print)
+def lookup_post_data(acc_ship_to, invoice_number, device_id, email_address):
+    """
+    :usage: Builds the request body for the get-order endpoint
+    :return: post_data array for the get-order endpoint
+    """
+    post_data = dict(requestContext=request_context(acc_ship_to))
+
+    # Only one variable is needed. Only pass the one we get.
+    if device_id:
+        post_data['deviceId'] = device_id.upper()
+        post_data['purchaseOrderNumber'] = ""
+        post_data['customerEmailId'] = ""
+    elif not device_id and invoice_number:
+        post_data['purchaseOrderNumber'] = invoice_number
+        post_data['deviceId'] = ""
+        post_data['customerEmailId'] = ""
+    elif not device_id and not invoice_number and email_address:
+        post_data['customerEmailId'] = email_address
+        post_data['deviceId'] = ""
+        post_data['purchaseOrderNumber'] = ""
 
-    return post_data, full_response, error_code, error_message, call_type
+    return post_data
 
 
-def create_order(invoice_number, first_name, last_name, company_name, email_address, address_line1, address_line2, city,
-                 state, zip_code, device_id, secondary_serial, purchase_date, suppress_print=False):
+def poc_content_post_data(acc_ship_to, device_id, poc_language="ENG"):
     """
-    :usage: Allows users to create an order to enroll a unit for AppleCare (APP/AC+). It is recommended that this API
-            always be preceded by a verifyOrder API call, to increase the chances of a successful order creation.
-    :param invoice_number: Invoice number from POS
-    :param first_name: Customer's first name as shown on invoice
-    :param last_name: Customer's last name as shown on invoice
-    :param company_name: Customer's company as shown on invoice (optional)
-    :param email_address: Customer's email address as shown on invoice
-    :param address_line1: First line of Customer's street address as shown on invoice (optional)
-    :param address_line2: Second line of Customer's street address as shown on invoice (optional)
-    :param city: City of Customer's street address as shown on invoice (optional)
-    :param state: State of Customer's street address as shown on invoice (optional)
-    :param zip_code: Zip Code of Customer's street address as shown on invoice (optional)
-    :param device_id: Serial number of the AppleCare eligible device sold
-    :param secondary_serial: Serial number the secondary AppleCare eligible device sold (Thunderbolt Display, optional)
-    :param purchase_date: Purchase date of the AppleCare eligible device
-    :param suppress_print: Suppress any print output from function (Default: False)
-    :return: JSON formatted strings of the complete API request, response, and any error codes
+    :usage: Builds the request body for the get-poc-content endpoint
+    :return: post_data array for the get-poc-content endpoint
     """
-    # Establish request variables
-    session, acc_ship_to, base_url = acc_credentials()
-
-    post_url = '{0}/create-order/'.format(str(base_url))
-    call_type = 'create_order'
+    return dict(requestContext=request_context(acc_ship_to), deviceId=device_id.upper(), pocLanguage=poc_language)
 
-    # Create request array
-    request_array = dict(shipTo=acc_ship_to, timeZone="420", langCode="en")
 
-    # Customer Request array
-    customer = dict(
-        customerEmailId=email_address, address_line1=address_line1, address_line2=address_line2, city=city,
-        stateCode=state, countryCode="US", zipCode=zip_code
+def consolidated_poc_post_data(acc_ship_to, invoice_number, poc_language="ENG"):
+    """
+    :usage: Builds the request body for the consolidated-poc endpoint
+    :return: post_data array for the consolidated-poc endpoint
+    """
+    return dict(
+        requestContext=request_context(acc_ship_to), purchaseOrderNumber=invoice_number, pocLanguage=poc_language
     )
-    # Use 'company_name' if 'first_name' and 'last_name' combined is longer than 34 characters
-    full_name = '{0} {1}'.format(str(first_name), str(last_name))
-    if len(full_name) > 34:
-        customer['company_name'] = full_name
-        customer['customerFirstName'] = ""
-        customer['customerLastName'] = ""
-    else:
-        customer['company_name'] = company_name
-        customer['customerFirstName'] = first_name
-        customer['customerLastName'] = last_name
 
-    # deviceRequest
-    device = dict(
-        deviceId=device_id.upper(), secondarySerialNumber=secondary_serial,
-        hardwareDateOfPurchase=purchase_date, verifyMPN="", nsPart=""
-    )
 
-    # Prepare data in array
-    post_data = dict(
-        requestContext=request_array, customerRequest=customer, deviceRequest=device,
-        appleCareSalesDate=purchase_date, pocLanguage="ENG", pocDeliveryPreference="E",
-        purchaseOrderNumber=invoice_number, marketID="", overridePocFlag="", emailFlag="1"
-    )
+def json_loads(text):
+    """
+    :param text: JSON document as str or bytes
+    :return: Decoded JSON, using the optional 'orjson' module when it is installed
+    :raises ValueError: If text is not valid JSON
+    """
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
 
-    # Format post_data as JSON
-    full_request = json.dumps(post_data)
+def is_json(json_array):
+    """
+    :param json_array: String variable to be validated if it is JSON
+    :return: True if json_array is valid, False if not
+    """
+    try:
+        json_loads(json_array)
+    except ValueError:
+        return False
+    return True
 
-    # Send data to API
-    response = session.post(post_url, data=full_request)
 
-    # Call return handler function to parse request response
-    full_response, error_code, error_message = response_handler(response.text, suppress_print)
+# Error envelopes ACC can return, in the order they are checked, as (envelope name, key path to the error(s)). The
+# error(s) found at the path are a single {errorCode, errorMessage} dict or a list of them. An empty path is the flat
+# Ship-to error, where errorCode/errorMessage sit at the top level of the response. An envelope only matches when an
+# error in it has a non-empty errorCode.
+ERROR_ENVELOPES = [
+    ('orderErrorResponse', ('orderErrorResponse',)),  # Verify/Create/Cancel Order Error
+    ('deviceErrorResponse', ('orderDetailsResponses', 'deviceEligibility', 'deviceErrorResponse')),  # Enrollment
+    ('lookupErrorResponse', ('lookupErrorResponse',)),  # Order Lookup Error
+    ('pocErrorResponse', ('pocErrorResponse',)),  # POC Content Error
+    ('deviceConfigErrorResponse', ('deviceConfigErrorResponse',)),  # Device Configuration Error
+    ('failedAuthErrorResponse', ('failedAuthErrorResponse',)),  # Failed Auth Error
+    ('errorResponse', ('errorResponse',)),  # Consolidated POC Error
+    ('shipToError', ()),  # Ship-to Error
+]
 
-    return post_data, full_response, error_code, error_message, call_type
+# Structured result of parsing an ACC response. full_response is the decoded JSON (or the raw text if it was not
+# valid JSON), envelope is the name of the matched ERROR_ENVELOPES entry or None.
+AccResponse = collections.namedtuple('AccResponse', ['full_response', 'error_code', 'error_message', 'envelope'])
 
 
-def cancel_order(device_id, cancellation_date, cancel_reason_code, suppress_print=False):
+def register_error_envelope(name, path, index=None):
     """
-    :usage: Designed to cancel an Auto Enrollment (AE) Order for AppleCare (APP/AC+).
-    :param device_id: Serial number of the AppleCare eligible device sold
-    :param cancellation_date: Date the device and AppleCare were refunded as shown on the return invoice
-    :param cancel_reason_code: Cancellation code explaing why device was returned
-    :param suppress_print: Suppress any print output from function (Default: False)
-    :return: JSON formatted strings of the complete API request, response, and any error codes
+    :usage: Adds an error envelope to ERROR_ENVELOPES, e.g. for a newly implemented API method
+    :param name: Envelope name reported in AccResponse.envelope
+    :param path: Tuple of keys leading from the top of the response to the error(s)
+    :param index: Position in the lookup order (Default: before the Ship-to Error, which is checked last)
     """
-    # Establish request variables
-    session, acc_ship_to, base_url = acc_credentials()
+    if index is None:
+        index = len(ERROR_ENVELOPES) - 1
+    ERROR_ENVELOPES.insert(index, (name, tuple(path)))
 
-    post_url = '{0}/cancel-order/'.format(str(base_url))
-    call_type = 'cancel_order'
 
-    # Create request array
-    request_array = dict(shipTo=acc_ship_to, timeZone="420", langCode="en")
+def _has_error_code(api_errors):
+    """
+    :param api_errors: Error dict or list of error dicts
+    :return: True if an error has a non-empty errorCode; empty envelopes and "errorCode": "" or null are not errors
+    """
+    if isinstance(api_errors, dict):
+        return bool(api_errors.get('errorCode'))
+    if isinstance(api_errors, list):
+        return any(isinstance(error, dict) and error.get('errorCode') for error in api_errors)
+    return False
 
-    # Prepare data in array
-    post_data = dict(
-        requestContext=request_array, deviceId=device_id.upper(), cancellationDate=cancellation_date,
-        purchaseOrderNumber="", cancelReasonCode=cancel_reason_code
-    )
 
-    # Format post_data as JSON
-    full_request = json.dumps(post_data)
+def find_error_envelope(json_response):
+    """
+    :param json_response: Decoded JSON response
+    :return: (envelope name, error(s)) of the first matching ERROR_ENVELOPES entry, or (None, None)
+    """
+    if not isinstance(json_response, dict):
+        return None, None
+    for name, path in ERROR_ENVELOPES:
+        api_errors = json_response
+        for key in path:
+            api_errors = api_errors.get(key) if isinstance(api_errors, dict) else None
+            if api_errors is None:
+                break
+        if _has_error_code(api_errors):
+            return name, api_errors
+    return None, None
 
-    # Send data to API
-    response = session.post(post_url, data=full_request)
 
-    # Call return handler function to parse request response
-    full_response, error_code, error_message = response_handler(response.text, suppress_print)
+def parse_response(full_response, suppress_print=True):
+    """
+    :usage: Decodes an ACC response once and looks up its error envelope by key
+    :param full_response: Response body text from the ACC API
+    :param suppress_print: Suppress any print output from function (Default: True)
+    :return: AccResponse
+    """
+    try:
+        json_response = json_loads(full_response)
+    except ValueError:
+        error_message = "JSON is invalid - Inspect full response for errors"
+        if suppress_print is False:
+            print('{}\n'.format(error_message))
+            print(full_response)
+        return AccResponse(full_response, "ACC_ERR_0001", error_message, None)
+
+    envelope, api_errors = find_error_envelope(json_response)
+    error_code = []
+    error_message = []
+    if envelope is None:
+        # No Errors
+        if suppress_print is False:
+            print('REST Operation Successful - See full response for details\n')
+        return AccResponse(json_response, error_code, error_message, None)
 
-    return post_data, full_response, error_code, error_message, call_type
+    if isinstance(api_errors, dict):
+        # Single Error
+        api_errors = [api_errors]
+    for error in api_errors:
+        error_code.append(error.get("errorCode"))
+        error_message.append(error.get("errorMessage"))
+    if suppress_print is False:
+        print('API Error: {0}'.format(error_code))
+    return AccResponse(json_response, error_code, error_message, envelope)
 
 
-def three_sixty_lookup(invoice_number, device_id, email_address, suppress_print=False):
+def response_handler(full_response, suppress_print):
     """
-    :usage: Designed to search a details of the device based on various parameters.
-    :param invoice_number: Refund invoice number from POS
-    :param device_id: Serial number of the AppleCare eligible device sold
-    :param email_address: Registered email associated with AppleCare Enrollment
-    :param suppress_print: Suppress any print output from function (Default: False)
-    :return: JSON formatted strings of the complete API request, response, and any error codes
+    :param full_response: JSON response from the ACC API
+    :param suppress_print: Prints output when function is called
+    :return: Full API response and any API errors and their messages
     """
-    # Establish request variables
-    session, acc_ship_to, base_url = acc_credentials()
+    parsed = parse_response(full_response, suppress_print)
+    return parsed.full_response, parsed.error_code, parsed.error_message
 
-    post_url = '{0}/get-order/'.format(str(base_url))
-    call_type = 'three_sixty_lookup'
 
-    # Create request array
-    request_array = dict(shipTo=acc_ship_to, timeZone="420", langCode="en")
+#######################################################################################################################
+# Models
+#######################################################################################################################
 
-    # Prepare data in array
-    post_data = dict(requestContext=request_array)
+# Order record fields, named after the verify_order/create_order parameters
+ORDER_FIELDS = (
+    'invoice_number', 'first_name', 'last_name', 'company_name', 'email_address', 'address_line1', 'address_line2',
+    'city', 'state', 'zip_code', 'device_id', 'secondary_serial', 'purchase_date'
+)
 
-    # Only one variable is needed. Only pass the one we get.
-    if device_id:
-        post_data['deviceId'] = device_id.upper()
-        post_data['purchaseOrderNumber'] = ""
-        post_data['customerEmailId'] = ""
-    elif not device_id and invoice_number:
-        post_data['purchaseOrderNumber'] = invoice_number
-        post_data['deviceId'] = ""
-        post_data['customerEmailId'] = ""
-    elif not device_id and not invoice_number and email_address:
-        post_data['customerEmailId'] = email_address
-        post_data['deviceId'] = ""
-        post_data['purchaseOrderNumber'] = ""
+# Cancellation record fields, named after the cancel_order parameters
+CANCEL_FIELDS = ('device_id', 'cancellation_date', 'cancel_reason_code')
+
+
+class _RecordModel(tuple):
+    """
+    :usage: Methods shared by the Order and Cancellation record models
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        :param record: Record dict, e.g. from read_records(). Missing fields default to "" and other keys are ignored
+        :return: Model instance
+        """
+        get = record.get
+        return tuple.__new__(cls, [get(field) or "" for field in cls._fields])
+
+    def get(self, field, default=None):
+        """
+        :usage: dict.get() for model fields, so a model can be used wherever a record dict is expected
+        """
+        return getattr(self, field) if field in self._fields else default
+
+
+class Order(_RecordModel, collections.namedtuple('Order', ORDER_FIELDS)):
+    """
+    :usage: Compact, immutable order record: a tuple with one slot per ORDER_FIELDS field and no per-instance dict.
+            Accepted wherever an order record dict is, e.g. by enroll_orders() and validate_order().
+    """
+
+    __slots__ = ()
+
+
+class Cancellation(_RecordModel, collections.namedtuple('Cancellation', CANCEL_FIELDS)):
+    """
+    :usage: Compact, immutable cancellation record with one slot per CANCEL_FIELDS field. Accepted wherever a
+            cancellation record dict is, e.g. by cancel_devices() and validate_cancel().
+    """
+
+    __slots__ = ()
+
+
+class AccResult(collections.namedtuple(
+        'AccResult', ['post_data', 'full_response', 'error_code', 'error_message', 'call_type'])):
+    """
+    :usage: Return value of every API method: the (post_data, full_response, error_code, error_message, call_type)
+            tuple, so existing unpacking and indexing keep working, with named fields and views computed on access.
+            Adds no per-instance storage to the tuple.
+    """
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        """
+        :return: True if the call returned no error code
+        """
+        return not self.error_code
+
+    def section(self, *path):
+        """
+        :param path: Keys leading from the top of the response, e.g. ('orderDetailsResponses', 'deviceEligibility')
+        :return: Part of full_response at path, or None if it is missing
+        """
+        node = self.full_response
+        for key in path:
+            node = node.get(key) if isinstance(node, dict) else None
+            if node is None:
+                break
+        return node
+
+    def find(self, key):
+        """
+        :param key: Key to search for at any depth of full_response
+        :return: Generator of every value stored under key, walking the response only as far as it is consumed
+        """
+        return find_values(self.full_response, key)
+
+
+_json_string = json.encoder.encode_basestring_ascii
+
+
+def _json_value(value):
+    """
+    :return: value encoded as by json.dumps()
+    """
+    return _json_string(value) if value.__class__ is str else json.dumps(value)
+
+
+class OrderSerializer(object):
+    """
+    :usage: Request body writer of one client. The requestContext is built once, and order and cancellation bodies are
+            written from precompiled templates in a single pass, instead of building nested dicts and walking them
+            again with json.dumps(). The JSON is the same as json.dumps() of order_post_data()/cancel_post_data().
+    """
+
+    def __init__(self, ship_to):
+        """
+        :param ship_to: AppleCare Connect 10 Digit SHIPTO Number
+        """
+        self.ship_to = ship_to
+        # Copied into each call's post_data; the templates do not read it, so changes never reach the wire
+        self.request_context = request_context(ship_to)
+        context = json.dumps(self.request_context).replace('%', '%%')
+        self._order_template = (
+            '{"requestContext": ' + context + ', "customerRequest": {"customerEmailId": %s, "address_line1": %s, '
+            '"address_line2": %s, "city": %s, "stateCode": %s, "countryCode": "US", "zipCode": %s, '
+            '"company_name": %s, "customerFirstName": %s, "customerLastName": %s}, "deviceRequest": {"deviceId": %s, '
+            '"secondarySerialNumber": %s, "hardwareDateOfPurchase": %s, "verifyMPN": "", "nsPart": ""}, '
+            '"appleCareSalesDate": %s, "pocLanguage": "ENG", "pocDeliveryPreference": "E", '
+            '"purchaseOrderNumber": %s, "marketID": "", "overridePocFlag": "", "emailFlag": "1"}'
+        )
+        self._cancel_template = (
+            '{"requestContext": ' + context + ', "deviceId": %s, "cancellationDate": %s, "purchaseOrderNumber": "", '
+            '"cancelReasonCode": %s}'
+        )
+
+    def order(self, order):
+        """
+        :param order: Order
+        :return: (post_data, full_request) for the verify-order and create-order endpoints
+        """
+        (invoice_number, first_name, last_name, company_name, email_address, address_line1, address_line2, city,
+         state, zip_code, device_id, secondary_serial, purchase_date) = order
+        post_data = order_post_data(
+            self.ship_to, invoice_number, first_name, last_name, company_name, email_address, address_line1,
+            address_line2, city, state, zip_code, device_id, secondary_serial, purchase_date,
+            dict(self.request_context)
+        )
+        customer = post_data['customerRequest']
+        value = _json_value
+        full_request = self._order_template % (
+            value(email_address), value(address_line1), value(address_line2), value(city), value(state),
+            value(zip_code), value(customer['company_name']), value(customer['customerFirstName']),
+            value(customer['customerLastName']), value(post_data['deviceRequest']['deviceId']),
+            value(secondary_serial), value(purchase_date), value(purchase_date), value(invoice_number)
+        )
+        return post_data, full_request
+
+    def cancel(self, cancellation):
+        """
+        :param cancellation: Cancellation
+        :return: (post_data, full_request) for the cancel-order endpoint
+        """
+        device_id, cancellation_date, cancel_reason_code = cancellation
+        post_data = cancel_post_data(
+            self.ship_to, device_id, cancellation_date, cancel_reason_code, dict(self.request_context)
+        )
+        full_request = self._cancel_template % (
+            _json_value(post_data['deviceId']), _json_value(cancellation_date), _json_value(cancel_reason_code)
+        )
+        return post_data, full_request
+
+
+#######################################################################################################################
+# Pre-flight Validation
+#######################################################################################################################
+
+# A problem found in one field of a record by pre-flight validation. code is 'required' or 'format'
+FieldError = collections.namedtuple('FieldError', ['field', 'code', 'message'])
+
+# Error code returned instead of an API response when a record fails pre-flight validation
+PREFLIGHT_ERROR_CODE = "ACC_ERR_0003"
+
+# Field formats
+# Apple serial numbers are 8-14 upper case alphanumerics (MEIDs are 14 hex digits); IMEIs are 15 digits, decimal MEIDs
+# 18 digits
+SERIAL_PATTERN = re.compile(r'[A-Z0-9]{8,14}|[0-9]{15}|[0-9]{18}')
+DATE_PATTERN = re.compile(r'(?:0[1-9]|1[0-2])/(?:0[1-9]|[12][0-9]|3[01])/[0-9]{2}')  # MM/DD/YY
+EMAIL_PATTERN = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
+STATE_PATTERN = re.compile(r'[A-Z]{2}')
+ZIP_PATTERN = re.compile(r'[0-9]{5}(?:-[0-9]{4})?')
+CANCEL_REASON_PATTERN = re.compile(r'[A-Z0-9]{1,10}')
+
+# Field rules as (field, required, pattern, normalize, message). normalize is applied before matching when the API
+# method applies it too; e.g. device_id is upper cased by the request builders, but secondary_serial is sent as given.
+ORDER_RULES = (
+    ('invoice_number', True, None, None, None),
+    ('email_address', True, EMAIL_PATTERN, None, "must be an email address"),
+    ('device_id', True, SERIAL_PATTERN, str.upper, "must be a serial number (8-14 alphanumerics), IMEI or MEID"),
+    ('secondary_serial', False, SERIAL_PATTERN, None, "must be an upper case serial number, IMEI or MEID"),
+    ('purchase_date', True, DATE_PATTERN, None, "must be a MM/DD/YY date"),
+    ('state', False, STATE_PATTERN, None, "must be a 2 letter upper case state code"),
+    ('zip_code', False, ZIP_PATTERN, None, "must be a 5 digit or ZIP+4 code"),
+)
+CANCEL_RULES = (
+    ('device_id', True, SERIAL_PATTERN, str.upper, "must be a serial number (8-14 alphanumerics), IMEI or MEID"),
+    ('cancellation_date', True, DATE_PATTERN, None, "must be a MM/DD/YY date"),
+    ('cancel_reason_code', True, CANCEL_REASON_PATTERN, None, "must be an upper case cancellation reason code"),
+)
+
+
+def _check_customer_name(record):
+    """
+    :usage: verify_order/create_order send first and last name, or the full name as company_name when the two combined
+            are longer than 34 characters. Either way a name is needed.
+    :return: FieldError or None
+    """
+    first_name = record.get('first_name')
+    last_name = record.get('last_name')
+    if first_name and last_name:
+        return None
+    if record.get('company_name') and not first_name and not last_name:
+        return None
+    return FieldError('first_name', 'required', "first_name and last_name (or only company_name) are required")
+
+
+class RecordValidator(object):
+    """
+    :usage: Table-driven validator for order/cancellation records, built once from a rule table and reused for every
+            record. Runs before any request is built, so invalid records never use network capacity or rate budget.
+    """
+
+    def __init__(self, rules, checks=(), cancel_reason_codes=None):
+        """
+        :param rules: Tuple of (field, required, pattern, normalize, message) rules, e.g. ORDER_RULES
+        :param checks: Callables taking a record and returning a FieldError or None, for cross-field rules
+        :param cancel_reason_codes: Allowed cancel_reason_code values, if known (Default: None, format check only)
+        """
+        compiled = []
+        for field, required, pattern, normalize, message in rules:
+            required_error = FieldError(field, 'required', "{0} is required".format(field)) if required else None
+            format_error = FieldError(field, 'format', "{0} {1}".format(field, message)) if pattern else None
+            match = pattern.fullmatch if pattern is not None else None
+            compiled.append((field, required_error, match, normalize, format_error))
+        self._rules = tuple(compiled)
+        self._checks = tuple(checks)
+        self.cancel_reason_codes = frozenset(cancel_reason_codes) if cancel_reason_codes is not None else None
+
+    def validate(self, record):
+        """
+        :param record: Record dict keyed by API method parameter names
+        :return: List of FieldError, empty if the record is valid
+        """
+        errors = []
+        get = record.get
+        for field, required_error, match, normalize, format_error in self._rules:
+            value = get(field)
+            if not value:
+                if required_error is not None:
+                    errors.append(required_error)
+                continue
+            if match is not None:
+                if value.__class__ is not str:
+                    value = str(value)
+                if normalize is not None:
+                    value = normalize(value)
+                if match(value) is None:
+                    errors.append(format_error)
+        for check in self._checks:
+            error = check(record)
+            if error is not None:
+                errors.append(error)
+        # An empty cancel_reason_code is already reported as required
+        if self.cancel_reason_codes is not None and get('cancel_reason_code') \
+                and get('cancel_reason_code') not in self.cancel_reason_codes:
+            errors.append(FieldError('cancel_reason_code', 'format', "cancel_reason_code is not a known reason code"))
+        return errors
+
+    __call__ = validate
+
+
+# Validators used by the clients and batch functions
+validate_order = RecordValidator(ORDER_RULES, checks=(_check_customer_name,))
+validate_cancel = RecordValidator(CANCEL_RULES)
+
+
+def preflight_result(errors, call_type, suppress_print=True):
+    """
+    :param errors: List of FieldError from a validator
+    :param call_type: Name of the API method that was not called
+    :param suppress_print: Suppress any print output from function (Default: True)
+    :return: AccResult for a rejected record; post_data and full_response are None as no request was made
+    """
+    error_message = [error.message for error in errors]
+    if suppress_print is False:
+        print('Pre-flight validation failed: {0}'.format(error_message))
+    return AccResult(None, None, PREFLIGHT_ERROR_CODE, error_message, call_type)
+
+
+def find_values(json_response, key):
+    """
+    :param json_response: Decoded JSON response
+    :param key: Key to search for at any depth
+    :return: Generator of every value stored under key
+    """
+    stack = [json_response]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for node_key, value in node.items():
+                if node_key == key:
+                    yield value
+                if isinstance(value, (dict, list)):
+                    stack.append(value)
+        elif isinstance(node, list):
+            stack.extend(node)
+
+
+def lookup_cache_key(post_data, env):
+    """
+    :param post_data: get-order request array
+    :param env: AppleCare Connect Environment: UAT or PROD
+    :return: Normalized (deviceId, purchaseOrderNumber, customerEmailId, shipTo, env) cache key
+    """
+    return (
+        (post_data.get('deviceId') or "").strip().upper(),
+        (post_data.get('purchaseOrderNumber') or "").strip(),
+        (post_data.get('customerEmailId') or "").strip().lower(),
+        post_data['requestContext']['shipTo'],
+        env
+    )
+
+
+class LookupCache(object):
+    """
+    :usage: Base class for three_sixty_lookup caches. Entries expire after ttl seconds and the least recently used
+            entries are evicted beyond max_entries. Cached responses are shared between callers and must be treated as
+            read-only.
+    """
+
+    def __init__(self, ttl=300, max_entries=10000):
+        """
+        :param ttl: Seconds a cached response stays valid (Default: 300)
+        :param max_entries: Maximum number of cached responses (Default: 10000)
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: Key from lookup_cache_key()
+        :return: Cached full_response, or None on a miss
+        """
+        with self._lock:
+            full_response = self._get(key, time.time())
+            if full_response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return full_response
+
+    def set(self, key, full_response):
+        """
+        :param key: Key from lookup_cache_key()
+        :param full_response: Decoded get-order response to cache
+        """
+        device_ids = set(value.upper() for value in find_values(full_response, 'deviceId') if value)
+        if key[0]:
+            device_ids.add(key[0])
+        with self._lock:
+            self._set(key, full_response, device_ids, time.time() + self.ttl)
+
+    def invalidate_device(self, device_id, ship_to, env):
+        """
+        :usage: Drops every cached lookup for ship_to/env whose request or response mentions device_id
+        :param device_id: Serial number of the device
+        :param ship_to: AppleCare Connect 10 Digit SHIPTO Number
+        :param env: AppleCare Connect Environment: UAT or PROD
+        """
+        with self._lock:
+            self._invalidate_device(device_id.upper(), ship_to, env)
+
+    def stats(self):
+        """
+        :return: Dict of hits, misses and current number of entries
+        """
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, entries=self._size())
+
+    def clear(self):
+        """
+        :usage: Drops every cached lookup
+        """
+        raise NotImplementedError
+
+    def _get(self, key, now):
+        raise NotImplementedError
+
+    def _set(self, key, full_response, device_ids, expires):
+        raise NotImplementedError
+
+    def _invalidate_device(self, device_id, ship_to, env):
+        raise NotImplementedError
+
+    def _size(self):
+        raise NotImplementedError
+
+
+class MemoryLookupCache(LookupCache):
+    """
+    :usage: In-process three_sixty_lookup cache
+    """
+
+    def __init__(self, ttl=300, max_entries=10000):
+        super(MemoryLookupCache, self).__init__(ttl=ttl, max_entries=max_entries)
+        self._entries = collections.OrderedDict()  # key -> (expires, full_response, device_ids)
+        self._device_keys = collections.defaultdict(set)  # (device_id, shipTo, env) -> keys
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._device_keys.clear()
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            self._delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _set(self, key, full_response, device_ids, expires):
+        self._delete(key)
+        self._entries[key] = (expires, full_response, device_ids)
+        for device_id in device_ids:
+            self._device_keys[(device_id, key[3], key[4])].add(key)
+        while len(self._entries) > self.max_entries:
+            self._delete(next(iter(self._entries)))
+
+    def _delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for device_id in entry[2]:
+            device_key = (device_id, key[3], key[4])
+            keys = self._device_keys.get(device_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._device_keys[device_key]
+
+    def _invalidate_device(self, device_id, ship_to, env):
+        for key in list(self._device_keys.get((device_id, ship_to, env), ())):
+            self._delete(key)
+
+    def _size(self):
+        return len(self._entries)
+
+
+class SqliteLookupCache(LookupCache):
+    """
+    :usage: On-disk three_sixty_lookup cache backed by sqlite, shared across runs and processes
+    """
+
+    def __init__(self, path, ttl=300, max_entries=100000):
+        """
+        :param path: Path to the sqlite database file
+        :param ttl: Seconds a cached response stays valid (Default: 300)
+        :param max_entries: Maximum number of cached responses (Default: 100000)
+        """
+        super(SqliteLookupCache, self).__init__(ttl=ttl, max_entries=max_entries)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS lookups "
+            "(key TEXT PRIMARY KEY, response TEXT, expires REAL, accessed REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS lookup_devices "
+            "(device_key TEXT, key TEXT, PRIMARY KEY (device_key, key))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS lookups_accessed ON lookups (accessed)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS lookup_devices_key ON lookup_devices (key)")
+
+    def close(self):
+        """
+        :usage: Closes the database connection
+        """
+        self._db.close()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM lookups")
+            self._db.execute("DELETE FROM lookup_devices")
+
+    def _get(self, key, now):
+        db_key = json.dumps(key)
+        row = self._db.execute("SELECT response, expires FROM lookups WHERE key = ?", (db_key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            self._delete(db_key)
+            return None
+        self._db.execute("UPDATE lookups SET accessed = ? WHERE key = ?", (now, db_key))
+        return json_loads(row[0])
+
+    def _set(self, key, full_response, device_ids, expires):
+        db_key = json.dumps(key)
+        with self._db:
+            self._db.execute("BEGIN")
+            self._delete(db_key)
+            self._db.execute(
+                "INSERT INTO lookups (key, response, expires, accessed) VALUES (?, ?, ?, ?)",
+                (db_key, json.dumps(full_response), expires, time.time())
+            )
+            self._db.executemany(
+                "INSERT OR IGNORE INTO lookup_devices (device_key, key) VALUES (?, ?)",
+                [(json.dumps([device_id, key[3], key[4]]), db_key) for device_id in device_ids]
+            )
+            overflow = self._size() - self.max_entries
+            if overflow > 0:
+                for row in self._db.execute(
+                        "SELECT key FROM lookups ORDER BY accessed LIMIT ?", (overflow,)).fetchall():
+                    self._delete(row[0])
+
+    def _delete(self, db_key):
+        self._db.execute("DELETE FROM lookups WHERE key = ?", (db_key,))
+        self._db.execute("DELETE FROM lookup_devices WHERE key = ?", (db_key,))
+
+    def _invalidate_device(self, device_id, ship_to, env):
+        device_key = json.dumps([device_id, ship_to, env])
+        with self._db:
+            self._db.execute("BEGIN")
+            for row in self._db.execute(
+                    "SELECT key FROM lookup_devices WHERE device_key = ?", (device_key,)).fetchall():
+                self._delete(row[0])
+
+    def _size(self):
+        return self._db.execute("SELECT COUNT(*) FROM lookups").fetchone()[0]
+
+
+class TokenBucket(object):
+    """
+    :usage: Thread-safe token bucket allowing `rate` calls per second with bursts of up to `burst` calls
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: Tokens added per second
+        :param burst: Maximum number of stored tokens (Default: max(1, rate))
+        """
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self, tokens=1):
+        """
+        :usage: Takes tokens from the bucket, borrowing against future refills if it is empty
+        :param tokens: Number of tokens to take (Default: 1)
+        :return: Seconds the caller must wait before using the tokens
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        """
+        :usage: Takes tokens from the bucket, sleeping until they are available
+        :param tokens: Number of tokens to take (Default: 1)
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    def set_rate(self, rate):
+        """
+        :param rate: New number of tokens added per second
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+
+
+def _shared_slot(index):
+    """
+    :return: Property reading and writing one slot of a SharedTokenBucket's shared state array
+    """
+    return property(lambda self: self._state[index], lambda self, value: self._state.__setitem__(index, value))
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    :usage: TokenBucket kept in shared memory, so that every worker process given the bucket when it is started (e.g.
+            as a multiprocessing Pool initializer argument) draws from one budget. time.monotonic() is system-wide, so
+            refills are consistent across processes.
+    """
+
+    # Slots of the shared state array
+    rate = _shared_slot(0)
+    burst = _shared_slot(1)
+    _tokens = _shared_slot(2)
+    _last = _shared_slot(3)
+    _last_decrease = _shared_slot(4)
+
+    def __init__(self, rate, burst=None, context=None):
+        """
+        :param rate: Tokens added per second
+        :param burst: Maximum number of stored tokens (Default: max(1, rate))
+        :param context: multiprocessing context the worker processes are started with (Default: the default context)
+        """
+        context = context or multiprocessing.get_context()
+        burst = float(burst if burst is not None else max(1.0, rate))
+        self._state = context.RawArray('d', [float(rate), burst, burst, time.monotonic(), 0.0])
+        self._lock = context.Lock()
+
+    def claim_decrease(self, cooldown):
+        """
+        :param cooldown: Minimum seconds between two rate decreases
+        :return: True if the rate may be decreased now, in which case the decrease is recorded for every process
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_decrease < cooldown:
+                return False
+            self._last_decrease = now
+            return True
+
+
+# HTTP status codes treated as ACC asking us to slow down
+THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+
+# ACC order-service endpoint names
+ACC_ENDPOINTS = ('verify-order', 'create-order', 'cancel-order', 'get-order', 'get-poc-content', 'consolidated-poc')
+
+
+class RateLimiter(object):
+    """
+    :usage: Per-endpoint token bucket rate limiter. When adaptive, an endpoint's rate is halved (at most once per
+            cooldown) on throttling responses or connection failures and grows back gradually with each success, so
+            sustained throughput stays just under what ACC accepts.
+    """
+
+    def __init__(self, rates, default_rate=None, burst=None, adaptive=True, min_rate=0.5, increase=0.02,
+                 decrease=0.5, cooldown=1.0):
+        """
+        :param rates: Dict of endpoint name (e.g. 'create-order') to maximum calls per second
+        :param default_rate: Maximum calls per second for endpoints not in rates (Default: None, unlimited)
+        :param burst: Bucket size for every endpoint (Default: max(1, rate))
+        :param adaptive: Adjust rates from call outcomes (Default: True)
+        :param min_rate: Lowest rate an adaptive endpoint is slowed down to (Default: 0.5)
+        :param increase: Fraction of the maximum rate added back after each success (Default: 0.02)
+        :param decrease: Factor the rate is multiplied by when throttled (Default: 0.5)
+        :param cooldown: Minimum seconds between two rate decreases of an endpoint (Default: 1.0)
+        """
+        self.max_rates = dict(rates)
+        self.default_rate = default_rate
+        self.burst = burst
+        self.adaptive = adaptive
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._buckets = {}
+        self._last_decrease = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, endpoint):
+        """
+        :return: TokenBucket of the endpoint, or None if it is not rate limited
+        """
+        bucket = self._buckets.get(endpoint)
+        if bucket is None:
+            max_rate = self.max_rates.get(endpoint, self.default_rate)
+            if max_rate is None:
+                return None
+            with self._lock:
+                bucket = self._buckets.setdefault(endpoint, TokenBucket(max_rate, self.burst))
+        return bucket
+
+    def reserve(self, endpoint):
+        """
+        :param endpoint: ACC order-service endpoint name
+        :return: Seconds the caller must wait before calling the endpoint
+        """
+        bucket = self._bucket(endpoint)
+        return bucket.reserve() if bucket is not None else 0.0
+
+    def acquire(self, endpoint):
+        """
+        :usage: Sleeps until a call to the endpoint is allowed
+        :param endpoint: ACC order-service endpoint name
+        """
+        delay = self.reserve(endpoint)
+        if delay > 0:
+            time.sleep(delay)
+
+    def record(self, endpoint, status_code):
+        """
+        :usage: Adapts the endpoint's rate to the outcome of a call
+        :param endpoint: ACC order-service endpoint name
+        :param status_code: HTTP status code, or None if the request failed without a response
+        """
+        bucket = self._bucket(endpoint)
+        if not self.adaptive or bucket is None:
+            return
+        max_rate = self.max_rates.get(endpoint, self.default_rate)
+        if status_code is None or status_code in THROTTLE_STATUSES:
+            if self._claim_decrease(endpoint, bucket):
+                bucket.set_rate(max(self.min_rate, bucket.rate * self.decrease))
+        elif bucket.rate < max_rate:
+            bucket.set_rate(min(max_rate, bucket.rate + max_rate * self.increase))
+
+    def _claim_decrease(self, endpoint, bucket):
+        """
+        :return: True if the endpoint's rate may be decreased now (at most once per cooldown), recording the decrease
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_decrease.get(endpoint, 0.0) < self.cooldown:
+                return False
+            self._last_decrease[endpoint] = now
+            return True
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    :usage: RateLimiter shared by worker processes, e.g. those of run_sharded(). Every endpoint's bucket is a
+            SharedTokenBucket, so the rates are limits on the combined calls of all processes, and an adaptive
+            slow-down seen by one process applies to all. Buckets are created up front, as shared memory cannot be
+            handed to workers once they are running.
+    """
+
+    def __init__(self, rates, default_rate=None, start_method=None, **kwargs):
+        """
+        :param rates: Dict of endpoint name (e.g. 'create-order') to maximum calls per second, across all processes
+        :param default_rate: Maximum calls per second for the other ACC_ENDPOINTS (Default: None, unlimited)
+        :param start_method: multiprocessing start method of the worker processes (Default: the platform default)
+        :param kwargs: Other RateLimiter options (burst, adaptive, min_rate, increase, decrease, cooldown)
+        """
+        super(SharedRateLimiter, self).__init__(rates, default_rate, **kwargs)
+        self.start_method = start_method
+        context = multiprocessing.get_context(start_method)
+        endpoints = set(self.max_rates)
+        if default_rate is not None:
+            endpoints.update(ACC_ENDPOINTS)
+        for endpoint in endpoints:
+            self._buckets[endpoint] = SharedTokenBucket(
+                self.max_rates.get(endpoint, default_rate), self.burst, context
+            )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _bucket(self, endpoint):
+        return self._buckets.get(endpoint)
+
+    def _claim_decrease(self, endpoint, bucket):
+        return bucket.claim_decrease(self.cooldown)
+
+    def rates(self):
+        """
+        :return: Dict of endpoint name to current calls per second
+        """
+        return {endpoint: bucket.rate for endpoint, bucket in self._buckets.items()}
+
+
+class RetryPolicy(object):
+    """
+    :usage: Retry policy with jittered exponential backoff. Idempotent endpoints are retried on any connection failure
+            and on retry_statuses. Non-idempotent endpoints (create-order, cancel-order) are only retried when ACC
+            cannot have processed the request: the connection could not be opened, or ACC answered with one of
+            guarded_statuses.
+    """
+
+    def __init__(self, max_attempts=3, backoff_base=0.5, backoff_max=10.0, idempotent=True,
+                 retry_statuses=THROTTLE_STATUSES, guarded_statuses=(429,)):
+        """
+        :param max_attempts: Maximum number of attempts including the first one (Default: 3)
+        :param backoff_base: Upper bound in seconds of the first backoff, doubled for each retry (Default: 0.5)
+        :param backoff_max: Upper bound in seconds of any backoff (Default: 10.0)
+        :param idempotent: Whether repeating the request is harmless (Default: True)
+        :param retry_statuses: HTTP status codes retried for idempotent endpoints
+        :param guarded_statuses: HTTP status codes retried for non-idempotent endpoints (Default: 429)
+        """
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.idempotent = idempotent
+        self.retry_statuses = frozenset(retry_statuses)
+        self.guarded_statuses = frozenset(guarded_statuses)
+
+    def should_retry(self, attempt, status_code=None, failure=None):
+        """
+        :param attempt: Number of attempts made so far
+        :param status_code: HTTP status code of the last attempt, if it got a response
+        :param failure: 'connect' if the connection could not be opened, 'transport' if the request failed after it
+                        may have been sent
+        :return: True if the request should be sent again
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if failure == 'connect':
+            return True
+        if failure == 'transport':
+            return self.idempotent
+        if self.idempotent:
+            return status_code in self.retry_statuses
+        return status_code in self.guarded_statuses
+
+    def backoff(self, attempt, retry_after_seconds=None):
+        """
+        :param attempt: Number of attempts made so far
+        :param retry_after_seconds: Delay requested by the server's Retry-After header, if any
+        :return: Seconds to wait before the next attempt ("full jitter" exponential backoff)
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        if retry_after_seconds is not None:
+            delay = max(delay, min(self.backoff_max, retry_after_seconds))
+        return delay
+
+
+# Retry policies applied by default: verify-order, get-order and the POC endpoints are read-only and safe to repeat,
+# create-order and cancel-order are only retried when the request cannot have reached ACC
+DEFAULT_RETRY_POLICIES = {
+    'verify-order': RetryPolicy(),
+    'get-order': RetryPolicy(),
+    'get-poc-content': RetryPolicy(),
+    'consolidated-poc': RetryPolicy(),
+    'create-order': RetryPolicy(idempotent=False),
+    'cancel-order': RetryPolicy(idempotent=False),
+}
+
+
+def retry_after(headers):
+    """
+    :param headers: HTTP response headers
+    :return: Seconds requested by a numeric Retry-After header, or None
+    """
+    value = headers.get('Retry-After')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _connect_failed(exc):
+    """
+    :param exc: Requests exception raised by Transport.post
+    :return: True if the connection to ACC could not be opened, so the request was never sent
+    """
+    _define_requests_classes()
+    if isinstance(exc, (requests.exceptions.ConnectTimeout, requests.exceptions.SSLError, TransportConnectError)):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError) and exc.args:
+        return isinstance(getattr(exc.args[0], 'reason', None), urllib3.exceptions.NewConnectionError)
+    return False
+
+
+def _httpx_connect_failed(exc):
+    """
+    :param exc: httpx exception
+    :return: True if no connection to ACC was obtained (including a pool timeout), so the request was never sent
+    """
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+# One instrumented API call, passed to every hook registered on a client. Timings are in seconds: connect_time is the
+# time spent opening new connections (TCP + TLS, 0.0 when a pooled connection was reused, None if unknown), ttfb runs
+# from sending the request to receiving the response headers, total_time covers the whole call including rate limiter
+# waits and retries, and parse_time is spent in response_handler. exception is set, and the response fields are None,
+# when the call raised.
+CallEvent = collections.namedtuple('CallEvent', [
+    'call_type', 'endpoint', 'host', 'status_code', 'attempts', 'connect_time', 'ttfb', 'total_time',
+    'request_bytes', 'response_bytes', 'parse_time', 'error_code', 'exception'
+])
+
+# Time spent opening connections (TCP + TLS handshake) by the current thread
+_connect_timer = threading.local()
+
+# Classes subclassing requests/urllib3 ones, defined by _define_requests_classes() on first use; None until then
+AccHTTPAdapter = None
+TransportConnectError = None
+_requests_classes_lock = threading.Lock()
+
+
+def _define_requests_classes():
+    """
+    :usage: Defines AccHTTPAdapter and TransportConnectError, which subclass requests/urllib3 classes, the first time
+            they are needed, so that importing acc.py does not import requests
+    """
+    global AccHTTPAdapter, TransportConnectError
+    if TransportConnectError is not None:
+        return
+    with _requests_classes_lock:
+        if TransportConnectError is not None:
+            return
+        import urllib3.connection
+        from requests.adapters import HTTPAdapter
+
+        class _TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+            """
+            :usage: urllib3 HTTPS connection that adds the time spent opening it to _connect_timer
+            """
+
+            def connect(self):
+                start = time.perf_counter()
+                try:
+                    super(_TimedHTTPSConnection, self).connect()
+                finally:
+                    _connect_timer.seconds = getattr(_connect_timer, 'seconds', 0.0) + time.perf_counter() - start
+
+        class _TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+            ConnectionCls = _TimedHTTPSConnection
+
+        class AccHTTPAdapter(HTTPAdapter):
+            """
+            :usage: Requests HTTPAdapter whose HTTPS connections report their connect time for
+                    CallEvent.connect_time. Given an ssl_context, every connection uses it as is, instead of loading
+                    the client cert and CA bundle files again for each new connection.
+            """
+
+            def __init__(self, ssl_context=None, **kwargs):
+                """
+                :param ssl_context: SSLContext with the client cert and CA loaded, from _ssl_context() (optional)
+                :param kwargs: HTTPAdapter options (pool_connections, pool_maxsize, pool_block, ...)
+                """
+                self.ssl_context = ssl_context
+                super(AccHTTPAdapter, self).__init__(**kwargs)
+
+            def init_poolmanager(self, *args, **kwargs):
+                if self.ssl_context is not None:
+                    kwargs['ssl_context'] = self.ssl_context
+                super(AccHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+                self.poolmanager.pool_classes_by_scheme = dict(
+                    self.poolmanager.pool_classes_by_scheme, https=_TimedHTTPSConnectionPool
+                )
+
+            def cert_verify(self, conn, url, verify, cert):
+                if self.ssl_context is None:
+                    super(AccHTTPAdapter, self).cert_verify(conn, url, verify, cert)
+
+            def build_connection_pool_key_attributes(self, request, verify, cert=None):
+                host_params, pool_kwargs = super(AccHTTPAdapter, self).build_connection_pool_key_attributes(
+                    request, verify, cert
+                )
+                if self.ssl_context is not None:
+                    for key in ('ca_certs', 'ca_cert_dir', 'cert_file', 'key_file'):
+                        pool_kwargs.pop(key, None)
+                    pool_kwargs['cert_reqs'] = 'CERT_NONE' if self.ssl_context.verify_mode == ssl.CERT_NONE \
+                        else 'CERT_REQUIRED'
+                return host_params, pool_kwargs
+
+        # Defined last: once it is set, both classes are
+        class TransportConnectError(requests.exceptions.ConnectionError):
+            """
+            :usage: Raised by a Transport when the connection to ACC could not be opened, so the request was never
+                    sent
+            """
+
+            def __reduce__(self):
+                # Unpickled through a module level function, as the receiving process (e.g. the parent of a worker
+                # pool) may not have defined the class yet
+                return _transport_connect_error, self.args, self.__dict__
+
+
+def _transport_connect_error(*args):
+    """
+    :usage: Unpickles a TransportConnectError
+    """
+    _define_requests_classes()
+    return TransportConnectError(*args)
+
+
+class _HttpxTrace(object):
+    """
+    :usage: httpx 'trace' extension callback collecting connect time and time to first byte of a request
+    """
+
+    def __init__(self):
+        self.connect_time = 0.0
+        self._connect_start = None
+        self._send_start = None
+        self.ttfb = None
+
+    async def __call__(self, event_name, info):
+        now = time.perf_counter()
+        if event_name == 'connection.connect_tcp.started':
+            self._connect_start = now
+        elif event_name == 'connection.start_tls.complete' and self._connect_start is not None:
+            self.connect_time += now - self._connect_start
+        elif event_name.endswith('.send_request_headers.started'):
+            self._send_start = now
+        elif event_name.endswith('.receive_response_headers.complete') and self._send_start is not None:
+            self.ttfb = now - self._send_start
+
+
+def _httpx_connect_trace(event_name, info):
+    """
+    :usage: httpx 'trace' extension callback for sync clients, adding the time spent opening connections (TCP + TLS
+            handshake) to _connect_timer like _TimedHTTPSConnection
+    """
+    if event_name == 'connection.connect_tcp.started':
+        _connect_timer.connect_start = time.perf_counter()
+    elif event_name == 'connection.start_tls.complete' and getattr(_connect_timer, 'connect_start', None) is not None:
+        _connect_timer.seconds = getattr(_connect_timer, 'seconds', 0.0) + time.perf_counter() - \
+            _connect_timer.connect_start
+        _connect_timer.connect_start = None
+
+
+# SSLContexts built by _ssl_context(), by cert, key and CA file paths and modification times, and ALPN protocols
+_ssl_contexts = {}
+
+# ALPN protocols offered by HTTP/1.1 transports, and by the httpx ones when they negotiate HTTP/2
+HTTP1_ALPN = ('http/1.1',)
+HTTP2_ALPN = ('http/1.1', 'h2')
+_ssl_contexts_lock = threading.Lock()
+
+
+def _file_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _ssl_context(cert, verify=True, alpn_protocols=HTTP1_ALPN):
+    """
+    :usage: Builds an SSLContext with the client cert loaded once per process and cert, and shares it between every
+            client and connection using that cert and ALPN protocols. A cert, key or CA file replaced on disk gets a
+            new context. httpx sets the ALPN protocols of the context it is given, so HTTP/2 transports must not share
+            a context with HTTP/1.1 ones.
+    :param cert: (cert, private_key) .PEM file paths
+    :param verify: Verify the server certificate: True, False or path to a CA bundle (Default: True)
+    :param alpn_protocols: Protocols offered with ALPN (Default: HTTP1_ALPN)
+    :return: SSLContext with the client cert loaded
+    """
+    paths = tuple(cert) + ((verify,) if isinstance(verify, str) else ())
+    key = (tuple(cert), verify, tuple(_file_mtime(path) for path in paths), tuple(alpn_protocols))
+    ssl_context = _ssl_contexts.get(key)
+    if ssl_context is not None:
+        return ssl_context
+    with _ssl_contexts_lock:
+        if key not in _ssl_contexts:
+            _ssl_contexts[key] = _build_ssl_context(cert, verify, alpn_protocols)
+        return _ssl_contexts[key]
+
+
+def _build_ssl_context(cert, verify, alpn_protocols):
+    """
+    :return: New SSLContext, see _ssl_context()
+    """
+    if isinstance(verify, str):
+        ssl_context = ssl.create_default_context(cafile=verify)
+    else:
+        ssl_context = ssl.create_default_context()
+        if not verify:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+    ssl_context.load_cert_chain(*cert)
+    ssl_context.set_alpn_protocols(list(alpn_protocols))
+    return ssl_context
+
+
+# Response returned by Transport.post(). content is the raw body and elapsed the seconds until the response arrived.
+TransportResponse = collections.namedtuple(
+    'TransportResponse', ['status_code', 'headers', 'text', 'content', 'elapsed']
+)
+
+# Streamed response returned by Transport.post_stream(). chunks is an iterator of body bytes; close() must be called
+# once the body has been read, or to abandon it.
+TransportStream = collections.namedtuple('TransportStream', ['status_code', 'headers', 'chunks', 'elapsed', 'close'])
+
+
+class Transport(object):
+    """
+    :usage: HTTP backend used by AccClient to send API calls. post() returns a TransportResponse and raises Requests
+            exceptions on network failures (TransportConnectError if the request was never sent), whatever the
+            underlying HTTP library, so callers handle errors the same way for every transport. Implementations must
+            be safe to share across threads and add connect time to _connect_timer for CallEvent.connect_time.
+    """
+    name = None
+
+    def post(self, url, body, timeout=None):
+        """
+        :param url: Endpoint URL
+        :param body: JSON request body
+        :param timeout: Timeout in seconds, or a (connect, read) tuple (Default: None)
+        :return: TransportResponse
+        """
+        raise NotImplementedError
+
+    def post_stream(self, url, body, timeout=None, chunk_size=65536):
+        """
+        :usage: Like post(), but returns as soon as the response headers arrive and reads the body on demand
+        :param chunk_size: Bytes per body chunk (Default: 65536)
+        :return: TransportStream
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        :usage: Closes all pooled connections
+        """
+
+
+class RequestsTransport(Transport):
+    """
+    :usage: Default transport. HTTP/1.1 over a connection-pooled Requests Session with the ACC client cert loaded once;
+            each concurrent call uses its own pooled TLS connection.
+    """
+    name = 'requests'
+
+    def __init__(self, cert, verify=True, pool_connections=4, pool_maxsize=10, pool_block=False):
+        """
+        :param cert: (cert, private_key) .PEM file paths
+        :param verify: Verify the server certificate: True, False or path to a CA bundle (Default: True)
+        :param pool_connections: Number of per-host connection pools to cache (Default: 4)
+        :param pool_maxsize: Maximum number of kept-alive connections per host (Default: 10)
+        :param pool_block: Block when all pooled connections are in use instead of opening extra ones (Default: False)
+        """
+        _define_requests_classes()
+        self.verify = verify
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': "application/json;charset=utf-8", 'Connection': "keep-alive"})
+        self.session.cert = cert
+        adapter = AccHTTPAdapter(
+            ssl_context=_ssl_context(cert, verify), pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            pool_block=pool_block
+        )
+        self.session.mount('https://', adapter)
+
+    def post(self, url, body, timeout=None):
+        response = self.session.post(url, data=body, timeout=timeout, verify=self.verify)
+        return TransportResponse(
+            response.status_code, response.headers, response.text, response.content, response.elapsed.total_seconds()
+        )
+
+    def post_stream(self, url, body, timeout=None, chunk_size=65536):
+        response = self.session.post(url, data=body, timeout=timeout, verify=self.verify, stream=True)
+        return TransportStream(
+            response.status_code, response.headers, response.iter_content(chunk_size), response.elapsed.total_seconds(),
+            response.close
+        )
+
+    def close(self):
+        self.session.close()
+
+
+class HttpxTransport(Transport):
+    """
+    :usage: httpx transport. With http2 (the default) concurrent calls to a host are multiplexed as streams over one
+            or a few TLS connections instead of one connection per call, falling back to HTTP/1.1 if the server does
+            not offer HTTP/2. Requires the optional 'httpx' module, and the 'h2' module for HTTP/2.
+    """
+    name = 'http2'
+
+    def __init__(self, cert, verify=True, http2=True, max_connections=10):
+        """
+        :param cert: (cert, private_key) .PEM file paths
+        :param verify: Verify the server certificate: True, False or path to a CA bundle (Default: True)
+        :param http2: Negotiate HTTP/2 (Default: True)
+        :param max_connections: Maximum number of open connections (Default: 10)
+        """
+        if httpx is None:
+            raise ImportError("HttpxTransport requires the 'httpx' module")
+        self.client = httpx.Client(
+            http2=http2, verify=_ssl_context(cert, verify, HTTP2_ALPN if http2 else HTTP1_ALPN),
+            headers={'Content-Type': "application/json;charset=utf-8"},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self._extensions = {'trace': _httpx_connect_trace}
+
+    def post(self, url, body, timeout=None):
+        response = self._send(url, body, timeout, stream=False)
+        return TransportResponse(
+            response.status_code, response.headers, response.text, response.content, response.elapsed.total_seconds()
+        )
+
+    def post_stream(self, url, body, timeout=None, chunk_size=65536):
+        start = time.perf_counter()
+        response = self._send(url, body, timeout, stream=True)
+        # httpx only sets response.elapsed once the body is read, so time the headers here
+        return TransportStream(
+            response.status_code, response.headers, self._iter_bytes(response, chunk_size),
+            time.perf_counter() - start, response.close
+        )
+
+    def _send(self, url, body, timeout, stream):
+        """
+        :return: httpx Response, with httpx errors raised as the matching Requests exceptions
+        """
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        request = self.client.build_request('POST', url, content=body, timeout=timeout, extensions=self._extensions)
+        try:
+            return self.client.send(request, stream=stream)
+        except httpx.HTTPError as e:
+            raise self._requests_exception(e) from e
+
+    def _iter_bytes(self, response, chunk_size):
+        try:
+            for chunk in response.iter_bytes(chunk_size):
+                yield chunk
+        except httpx.HTTPError as e:
+            raise self._requests_exception(e) from e
+
+    @staticmethod
+    def _requests_exception(exc):
+        """
+        :param exc: httpx exception
+        :return: Equivalent Requests exception
+        """
+        _define_requests_classes()
+        if _httpx_connect_failed(exc):
+            return TransportConnectError(str(exc))
+        if isinstance(exc, httpx.TimeoutException):
+            return requests.exceptions.ReadTimeout(str(exc))
+        return requests.exceptions.ConnectionError(str(exc))
+
+    def close(self):
+        self.client.close()
+
+
+# Last TLS session per (SSLContext id, host, port), resumed by HTTPClientTransport's next connection to the host
+_tls_sessions = {}
+
+
+class HTTPClientTransport(Transport):
+    """
+    :usage: Lightweight transport on the standard library's http.client, for short-lived processes (cron jobs, POS
+            hooks, serverless handlers) making a few calls. It never imports requests, the bulk of a cold start's
+            import time, and uses the shared SSLContext from _ssl_context(). Connections are kept alive per host, and
+            new connections resume the process's last TLS session with the host, so only the first handshake in a
+            process is a full one.
+    """
+    name = 'stdlib'
+
+    def __init__(self, cert, verify=True, max_connections=10):
+        """
+        :param cert: (cert, private_key) .PEM file paths
+        :param verify: Verify the server certificate: True, False or path to a CA bundle (Default: True)
+        :param max_connections: Maximum number of idle connections kept open per host (Default: 10)
+        """
+        self.ssl_context = _ssl_context(cert, verify)
+        self.max_connections = max_connections
+        self._idle = {}  # (host, port) -> list of idle HTTPSConnection
+        self._lock = threading.Lock()
+
+    def post(self, url, body, timeout=None):
+        import http.client
+        response, connection, key, elapsed = self._request(url, body, timeout)
+        try:
+            content = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise self._requests_exception(e, connected=True) from e
+        self._release(key, connection, response)
+        return TransportResponse(
+            response.status, response.headers, content.decode('utf-8', 'replace'), content, elapsed
+        )
+
+    def post_stream(self, url, body, timeout=None, chunk_size=65536):
+        import http.client
+        response, connection, key, elapsed = self._request(url, body, timeout)
+        closed = []
+
+        def chunks():
+            try:
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+            except (OSError, http.client.HTTPException) as e:
+                raise self._requests_exception(e, connected=True) from e
+
+        def close():
+            if closed:
+                return
+            closed.append(True)
+            if response.isclosed():
+                self._release(key, connection, response)
+            else:
+                connection.close()
+
+        return TransportStream(response.status, response.headers, chunks(), elapsed, close)
+
+    def _request(self, url, body, timeout):
+        """
+        :return: (http.client response with the body unread, its connection, (host, port), seconds to the headers)
+        """
+        import http.client
+        parts = urlsplit(url)
+        key = (parts.hostname, parts.port or 443)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        headers = {'Content-Type': "application/json;charset=utf-8", 'Content-Length': str(len(data))}
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+
+        connection = self._checkout(key) or self._connect(key, connect_timeout)
+        connection.sock.settimeout(read_timeout)
+        start = time.perf_counter()
+        try:
+            connection.request('POST', path, body=data, headers=headers)
+            response = connection.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise self._requests_exception(e, connected=True) from e
+        return response, connection, key, time.perf_counter() - start
+
+    def _connect(self, key, timeout):
+        """
+        :return: New HTTPSConnection to key's host and port, resuming the last TLS session with it if there is one
+        """
+        import http.client
+        host, port = key
+        start = time.perf_counter()
+        sock = None
+        try:
+            sock = socket.create_connection((host, port), timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock = self.ssl_context.wrap_socket(
+                sock, server_hostname=host, session=_tls_sessions.get((id(self.ssl_context), host, port))
+            )
+            protocol = sock.selected_alpn_protocol()
+            if protocol not in (None, 'http/1.1'):
+                raise ssl.SSLError("Server selected ALPN protocol {0!r}, expected 'http/1.1'".format(protocol))
+        except OSError as e:
+            if sock is not None:
+                sock.close()
+            raise self._requests_exception(e, connected=False) from e
+        finally:
+            _connect_timer.seconds = getattr(_connect_timer, 'seconds', 0.0) + time.perf_counter() - start
+        connection = http.client.HTTPSConnection(host, port, context=self.ssl_context)
+        connection.sock = sock
+        return connection
+
+    def _checkout(self, key):
+        """
+        :return: Idle connection to key's host and port, or None
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                connection = idle.pop()
+                # A readable idle connection was closed by the server (or has unexpected data); don't reuse it
+                if not _readable(connection.sock):
+                    return connection
+                connection.close()
+        return None
+
+    def _release(self, key, connection, response):
+        """
+        :usage: Keeps a connection whose response was fully read for reuse, and remembers its TLS session
+        """
+        if response.will_close or connection.sock is None:
+            connection.close()
+            return
+        if connection.sock.session is not None:
+            _tls_sessions[(id(self.ssl_context), key[0], key[1])] = connection.sock.session
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_connections:
+                idle.append(connection)
+                return
+        connection.close()
+
+    @staticmethod
+    def _requests_exception(exc, connected):
+        """
+        :param exc: Exception raised by socket, ssl or http.client
+        :param connected: False if the connection could not be opened
+        :return: Equivalent Requests exception
+        """
+        _define_requests_classes()
+        if not connected:
+            if isinstance(exc, socket.timeout):
+                return requests.exceptions.ConnectTimeout(str(exc))
+            return TransportConnectError(str(exc))
+        if isinstance(exc, socket.timeout):
+            return requests.exceptions.ReadTimeout(str(exc))
+        return requests.exceptions.ConnectionError(str(exc))
+
+    def close(self):
+        with self._lock:
+            connections = [connection for idle in self._idle.values() for connection in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+
+def _readable(sock):
+    """
+    :return: True if sock has data (or EOF) waiting to be read
+    """
+    import select
+    return bool(select.select([sock], [], [], 0)[0])
+
+
+class _Histogram(object):
+    """
+    :usage: Cumulative histogram in the Prometheus style
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+def _prometheus_labels(names, values, extra=''):
+    """
+    :return: Prometheus label set, e.g. {call_type="verify_order",host="..."}
+    """
+    labels = ['{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+              for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}'
+
+
+class MetricsCollector(object):
+    """
+    :usage: In-process metrics hook. Aggregates CallEvents into latency/size histograms and call/error counters by
+            call_type and host, and renders them in the Prometheus text exposition format.
+            Register with client.add_hook(collector).
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+    # (metric name, CallEvent field, buckets, help text)
+    HISTOGRAMS = (
+        ('acc_call_duration_seconds', 'total_time', LATENCY_BUCKETS, 'Total ACC API call latency'),
+        ('acc_call_ttfb_seconds', 'ttfb', LATENCY_BUCKETS, 'Time from sending the request to the response headers'),
+        ('acc_call_connect_seconds', 'connect_time', LATENCY_BUCKETS, 'Time spent opening new TCP/TLS connections'),
+        ('acc_response_parse_seconds', 'parse_time', LATENCY_BUCKETS, 'Time spent parsing ACC responses'),
+        ('acc_request_bytes', 'request_bytes', SIZE_BUCKETS, 'Size of ACC request bodies'),
+        ('acc_response_bytes', 'response_bytes', SIZE_BUCKETS, 'Size of ACC response bodies'),
+    )
+
+    def __init__(self):
+        self._histograms = {}  # (metric name, call_type, host) -> _Histogram
+        self._calls = collections.Counter()  # (call_type, host, status) -> count
+        self._errors = collections.Counter()  # (call_type, error_code) -> count
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        """
+        :param event: CallEvent
+        """
+        with self._lock:
+            status = event.status_code if event.exception is None else type(event.exception).__name__
+            self._calls[(event.call_type, event.host, status)] += 1
+            if isinstance(event.error_code, list):
+                for error_code in event.error_code:
+                    self._errors[(event.call_type, error_code)] += 1
+            elif event.error_code:
+                self._errors[(event.call_type, event.error_code)] += 1
+            for name, field, buckets, _ in self.HISTOGRAMS:
+                value = getattr(event, field)
+                # Only calls that opened a connection count towards the connect histogram
+                if value is None or (field == 'connect_time' and not value):
+                    continue
+                key = (name, event.call_type, event.host)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = _Histogram(buckets)
+                histogram.observe(value)
+
+    def reset(self):
+        """
+        :usage: Drops all collected metrics
+        """
+        with self._lock:
+            self._histograms.clear()
+            self._calls.clear()
+            self._errors.clear()
+
+    def to_prometheus(self):
+        """
+        :return: Collected metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            lines.append('# HELP acc_calls_total ACC API calls by HTTP status or exception')
+            lines.append('# TYPE acc_calls_total counter')
+            for (call_type, host, status), count in sorted(self._calls.items(), key=str):
+                labels = _prometheus_labels(('call_type', 'host', 'status'), (call_type, host, status))
+                lines.append('acc_calls_total{0} {1}'.format(labels, count))
+            lines.append('# HELP acc_errors_total ACC API error codes')
+            lines.append('# TYPE acc_errors_total counter')
+            for (call_type, error_code), count in sorted(self._errors.items(), key=str):
+                labels = _prometheus_labels(('call_type', 'error_code'), (call_type, error_code))
+                lines.append('acc_errors_total{0} {1}'.format(labels, count))
+            for name, _, _, help_text in self.HISTOGRAMS:
+                lines.append('# HELP {0} {1}'.format(name, help_text))
+                lines.append('# TYPE {0} histogram'.format(name))
+                for (metric, call_type, host), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    names, values = ('call_type', 'host'), (call_type, host)
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        labels = _prometheus_labels(names, values, 'le="{0}"'.format(bound))
+                        lines.append('{0}_bucket{1} {2}'.format(name, labels, count))
+                    labels = _prometheus_labels(names, values, 'le="+Inf"')
+                    lines.append('{0}_bucket{1} {2}'.format(name, labels, histogram.count))
+                    labels = _prometheus_labels(names, values)
+                    lines.append('{0}_sum{1} {2}'.format(name, labels, histogram.sum))
+                    lines.append('{0}_count{1} {2}'.format(name, labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+# Endpoints whose concurrent identical calls a SingleFlight may merge: read-only calls, safe to answer once for all
+COALESCED_ENDPOINTS = frozenset(['verify-order', 'get-order', 'get-poc-content', 'consolidated-poc'])
+
+
+def single_flight_key(endpoint, post_data, env):
+    """
+    :param endpoint: ACC order-service endpoint name
+    :param post_data: Request array
+    :param env: AppleCare Connect Environment: UAT or PROD
+    :return: Key identifying identical calls: the endpoint, environment and post_data serialized with sorted keys
+    """
+    return endpoint, env, json.dumps(post_data, sort_keys=True, separators=(',', ':'))
+
+
+class SingleFlight(object):
+    """
+    :usage: Thread-safe in-flight call deduplication. While a call for a key is running, other callers with the same
+            key wait for it and get its result (or exception) instead of making their own call. Nothing is kept once
+            the call finishes, so later callers make a fresh call. Shared results must be treated as read-only.
+    """
+
+    def __init__(self):
+        self.calls = 0  # Calls made
+        self.shared = 0  # Callers answered by another caller's call
+        self._in_flight = {}  # key -> [threading.Event, result, exception]
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """
+        :param key: Hashable key identifying the call, e.g. from single_flight_key()
+        :param func: Function making the call
+        :param args: Arguments for func
+        :return: Result of func(*args), from this caller's call or a concurrent one with the same key
+        """
+        with self._lock:
+            call = self._in_flight.get(key)
+            if call is None:
+                call = self._in_flight[key] = [threading.Event(), None, None]
+                self.calls += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+        try:
+            call[1] = func(*args)
+        except BaseException as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call[0].set()
+        return call[1]
+
+
+class AsyncSingleFlight(object):
+    """
+    :usage: asyncio version of SingleFlight, for use from a single event loop. The call runs as its own task, so it
+            carries on for the other callers if the caller that started it is cancelled.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._in_flight = {}  # key -> asyncio.Task
+
+    async def do(self, key, func, *args):
+        """
+        :param key: Hashable key identifying the call, e.g. from single_flight_key()
+        :param func: Coroutine function making the call
+        :param args: Arguments for func
+        :return: Result of await func(*args), from this caller's call or a concurrent one with the same key
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(func(*args))
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            self.calls += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+
+class HostHealth(object):
+    """
+    :usage: Thread-safe health tracker for ACC hosts, shared by every client of an AccClientRegistry. Keeps an
+            exponentially weighted moving average of latency and error rate per host. A host is degraded after
+            failure_threshold consecutive failures, or when its error rate or latency average crosses the thresholds,
+            and stays degraded for `cooldown` seconds before calls are routed to it again.
+    """
+
+    def __init__(self, alpha=0.2, failure_threshold=3, error_threshold=0.5, latency_threshold=10.0, cooldown=30.0,
+                 min_samples=5):
+        """
+        :param alpha: Weight of the newest sample in the moving averages (Default: 0.2)
+        :param failure_threshold: Consecutive failures that degrade a host (Default: 3)
+        :param error_threshold: Average error rate that degrades a host (Default: 0.5)
+        :param latency_threshold: Average latency in seconds that degrades a host (Default: 10.0)
+        :param cooldown: Seconds a degraded host is avoided (Default: 30.0)
+        :param min_samples: Samples needed before the averages can degrade a host (Default: 5)
+        """
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.error_threshold = error_threshold
+        self.latency_threshold = latency_threshold
+        self.cooldown = cooldown
+        self.min_samples = min_samples
+        self._hosts = {}  # host -> dict of latency, error_rate, failures, samples, degraded_until
+        self._lock = threading.Lock()
+
+    def record(self, host, latency, ok):
+        """
+        :param host: Host name or base URL
+        :param latency: Seconds the attempt took
+        :param ok: False if the attempt failed without a response, or with a throttling/server error status
+        """
+        with self._lock:
+            stats = self._hosts.get(host)
+            if stats is None:
+                stats = self._hosts[host] = dict(
+                    latency=latency, error_rate=0.0 if ok else 1.0, failures=0, samples=0, degraded_until=0.0
+                )
+            stats['samples'] += 1
+            stats['latency'] += self.alpha * (latency - stats['latency'])
+            stats['error_rate'] += self.alpha * ((0.0 if ok else 1.0) - stats['error_rate'])
+            stats['failures'] = 0 if ok else stats['failures'] + 1
+            averages_bad = stats['samples'] >= self.min_samples and (
+                stats['error_rate'] > self.error_threshold or stats['latency'] > self.latency_threshold
+            )
+            if stats['failures'] >= self.failure_threshold or averages_bad:
+                stats['degraded_until'] = time.monotonic() + self.cooldown
+                # Start from a clean slate once the cooldown is over
+                stats['failures'] = 0
+                stats['samples'] = 0
+                stats['error_rate'] = 0.0
+                stats['latency'] = 0.0
+
+    def is_degraded(self, host):
+        """
+        :param host: Host name or base URL
+        :return: True if calls should avoid the host
+        """
+        stats = self._hosts.get(host)
+        return stats is not None and stats['degraded_until'] > time.monotonic()
+
+    def choose(self, primary, paired):
+        """
+        :param primary: Preferred host or base URL
+        :param paired: Failover host or base URL
+        :return: primary, unless it is degraded and paired is not
+        """
+        if primary != paired and self.is_degraded(primary) and not self.is_degraded(paired):
+            return paired
+        return primary
+
+    def snapshot(self):
+        """
+        :return: Dict of host -> dict of latency, error_rate, degraded
+        """
+        now = time.monotonic()
+        with self._lock:
+            return dict(
+                (host, dict(latency=stats['latency'], error_rate=stats['error_rate'],
+                            degraded=stats['degraded_until'] > now))
+                for host, stats in self._hosts.items()
+            )
+
+
+class BaseAccClient(object):
+    """
+    :usage: Connection settings shared by AccClient and AsyncAccClient
+    """
+
+    def __init__(self, ship_to, env, cert, private_key, timeout=None, lookup_cache=None, rate_limiter=None,
+                 retry_policies=DEFAULT_RETRY_POLICIES, hooks=None, base_url=None, verify=True, health=None,
+                 validate=False, single_flight=None):
+        """
+        :param ship_to: AppleCare Connect 10 Digit SHIPTO Number
+        :param env: AppleCare Connect Environment: UAT or PROD
+        :param cert: Path to AppleCare Connect Cert .PEM File
+        :param private_key: Path to AppleCare Connect Private Key .PEM File
+        :param timeout: Timeout in seconds for each API call (Default: None)
+        :param lookup_cache: LookupCache for three_sixty_lookup results (Default: None, no caching)
+        :param rate_limiter: RateLimiter applied to every API call (Default: None, no rate limit)
+        :param retry_policies: Dict of endpoint name to RetryPolicy (Default: DEFAULT_RETRY_POLICIES). Endpoints
+                               without a policy are not retried
+        :param hooks: List of callables invoked with a CallEvent after every API call (Default: None)
+        :param base_url: Endpoint base URL overriding the ShipTo based selection, e.g. a local mock server
+                         (Default: None)
+        :param verify: Verify the server certificate: True, False or path to a CA bundle (Default: True)
+        :param health: HostHealth used to fail over to the paired ACC host when the ShipTo's host degrades
+                       (Default: None, always use the ShipTo's host)
+        :param validate: Check arguments with validate_order/validate_cancel before sending; invalid calls return
+                         PREFLIGHT_ERROR_CODE without a request being made (Default: False)
+        :param single_flight: SingleFlight (AsyncSingleFlight for AsyncAccClient) merging concurrent identical calls to
+                              COALESCED_ENDPOINTS into one request; may be shared by several clients
+                              (Default: None, no coalescing)
+        """
+        self.ship_to = ship_to
+        self.env = env
+        self.cert = (cert, private_key)
+        if base_url:
+            self.base_urls = (base_url, base_url)
+        else:
+            self.base_urls = acc_base_urls(ship_to, env)
+        self.base_url = self.base_urls[0]
+        self.health = health
+        self.validate = validate
+        self.verify = verify
+        self.timeout = timeout
+        self.lookup_cache = lookup_cache
+        self.single_flight = single_flight
+        self.serializer = OrderSerializer(ship_to)
+        self.rate_limiter = rate_limiter
+        self.retry_policies = retry_policies or {}
+        self.hooks = list(hooks or [])
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """
+        :usage: Builds a client from the ACC_SHIPTO, ACC_ENV and ACC_<ENV>_CERT/PRIVATE_KEY environment variables
+        :param kwargs: Any other client keyword arguments (pool sizes, timeout)
+        :return: Client instance
+        """
+        acc_ship_to = os.environ['ACC_SHIPTO']  # AppleCare Connect 10 Digit SHIPTO Number
+        acc_env = os.environ['ACC_ENV']  # AppleCare Connect Environment: UAT or PROD
+        cert, private_key = acc_cert_from_env(acc_env)
+        return cls(acc_ship_to, acc_env, cert, private_key, **kwargs)
+
+    def add_hook(self, hook):
+        """
+        :usage: Registers an instrumentation hook, e.g. a MetricsCollector. Timings are only taken while at least one
+                hook is registered.
+        :param hook: Callable invoked with a CallEvent after every API call
+        """
+        self.hooks.append(hook)
+
+    def _emit(self, event):
+        """
+        :param event: CallEvent passed to every registered hook
+        """
+        for hook in self.hooks:
+            hook(event)
+
+    def _route(self, avoid=None):
+        """
+        :param avoid: Base URL the previous attempt failed on, if any; its paired host is tried first
+        :return: Base URL for the next attempt: the ShipTo's host, or its paired host while the first is degraded
+        """
+        if self.health is None:
+            return self.base_url
+        primary, paired = self.base_urls
+        if avoid == primary:
+            primary, paired = paired, primary
+        return self.health.choose(primary, paired)
+
+    def _record_outcome(self, endpoint, status_code, base_url=None, latency=None):
+        """
+        :usage: Reports the outcome of an HTTP attempt to the rate limiter, so it can adapt its rate, and to the host
+                health tracker
+        :param endpoint: ACC order-service endpoint name
+        :param status_code: HTTP status code, or None if the request failed without a response
+        :param base_url: Base URL the attempt was sent to
+        :param latency: Seconds the attempt took
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.record(endpoint, status_code)
+        if self.health is not None and base_url is not None:
+            self.health.record(base_url, latency, status_code is not None and status_code not in THROTTLE_STATUSES)
+
+    def _cached_lookup(self, post_data, suppress_print):
+        """
+        :param post_data: get-order request array
+        :param suppress_print: Suppress any print output from function
+        :return: three_sixty_lookup return values from lookup_cache, or None on a miss
+        """
+        if self.lookup_cache is None:
+            return None
+        full_response = self.lookup_cache.get(lookup_cache_key(post_data, self.env))
+        if full_response is None:
+            return None
+        if suppress_print is False:
+            print('REST Operation Successful - See full response for details\n')
+        return AccResult(post_data, full_response, [], [], 'three_sixty_lookup')
+
+    def _update_lookup_cache(self, result):
+        """
+        :usage: Caches successful lookups, and invalidates cached lookups of a device after it was successfully enrolled
+                or cancelled
+        :param result: Return values of an API call
+        """
+        if self.lookup_cache is None:
+            return
+        post_data, full_response, error_code, error_message, call_type = result
+        if error_code:
+            return
+        if call_type == 'three_sixty_lookup':
+            self.lookup_cache.set(lookup_cache_key(post_data, self.env), full_response)
+        elif call_type == 'create_order':
+            self.lookup_cache.invalidate_device(post_data['deviceRequest']['deviceId'], self.ship_to, self.env)
+        elif call_type == 'cancel_order':
+            self.lookup_cache.invalidate_device(post_data['deviceId'], self.ship_to, self.env)
+
+
+class AccClient(BaseAccClient):
+    """
+    :usage: Long-lived AppleCare Connect client. Owns one connection-pooled Transport with the ACC client cert loaded
+            once, so repeated calls reuse open TLS connections instead of paying a new mutual-TLS handshake every time.
+            A single instance is safe to share across threads.
+    """
+
+    def __init__(self, ship_to, env, cert, private_key, pool_connections=4, pool_maxsize=10, pool_block=False,
+                 transport=None, **kwargs):
+        """
+        :param ship_to: AppleCare Connect 10 Digit SHIPTO Number
+        :param env: AppleCare Connect Environment: UAT or PROD
+        :param cert: Path to AppleCare Connect Cert .PEM File
+        :param private_key: Path to AppleCare Connect Private Key .PEM File
+        :param pool_connections: Number of per-host connection pools to cache (Default: 4)
+        :param pool_maxsize: Maximum number of kept-alive connections per host (Default: 10)
+        :param pool_block: Block when all pooled connections are in use instead of opening extra ones (Default: False)
+        :param transport: Transport instance, or transport name: 'requests', 'http2' or 'stdlib' (Default: the
+                          ACC_TRANSPORT environment variable, else 'requests')
+        :param kwargs: BaseAccClient options (timeout, lookup_cache, rate_limiter, retry_policies, hooks, ...).
+                       timeout may also be a (connect, read) tuple
+        """
+        super(AccClient, self).__init__(ship_to, env, cert, private_key, **kwargs)
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.transport = self._build_transport(transport or os.environ.get('ACC_TRANSPORT') or 'requests')
+        # Requests Session of the 'requests' transport, None for other transports
+        self.session = getattr(self.transport, 'session', None)
+
+    def _build_transport(self, transport):
+        """
+        :param transport: Transport instance, or transport name: 'requests', 'http2' or 'stdlib'
+        :return: Transport
+        """
+        if isinstance(transport, Transport):
+            return transport
+        if transport == 'requests':
+            return RequestsTransport(
+                self.cert, self.verify, pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize,
+                pool_block=self.pool_block
+            )
+        if transport == 'http2':
+            return HttpxTransport(self.cert, self.verify, max_connections=self.pool_maxsize)
+        if transport == 'stdlib':
+            return HTTPClientTransport(self.cert, self.verify, max_connections=self.pool_maxsize)
+        raise ValueError("Unknown transport {0!r}, expected 'requests', 'http2' or 'stdlib'".format(transport))
+
+    def close(self):
+        """
+        :usage: Closes all pooled connections
+        """
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _post(self, endpoint, post_data, call_type, suppress_print, full_request=None):
+        """
+        :param endpoint: ACC order-service endpoint name, e.g. 'verify-order'
+        :param post_data: Request array to send
+        :param call_type: Name of the API method, returned to the caller
+        :param suppress_print: Suppress any print output from function. Callers sharing a coalesced call get the
+                               output of the caller that made it
+        :param full_request: post_data already encoded as JSON, e.g. by the OrderSerializer (Default: None, encoded
+                             with json.dumps())
+        :return: AccResult with the complete API request, response, and any error codes
+        """
+        if self.single_flight is not None and endpoint in COALESCED_ENDPOINTS:
+            return self.single_flight.do(
+                single_flight_key(endpoint, post_data, self.env), self._request, endpoint, post_data, call_type,
+                suppress_print, full_request
+            )
+        return self._request(endpoint, post_data, call_type, suppress_print, full_request)
+
+    def _request(self, endpoint, post_data, call_type, suppress_print, full_request=None):
+        """
+        :usage: Makes one API call for _post()
+        """
+        # Format post_data as JSON
+        if full_request is None:
+            full_request = json.dumps(post_data)
+
+        # Only take timings when someone is listening
+        instrumented = bool(self.hooks)
+        start = None
+        if instrumented:
+            start = time.perf_counter()
+            _connect_timer.seconds = 0.0
+
+        response, attempt, post_url = self._send(endpoint, full_request, call_type, start)
+
+        # Call return handler function to parse request response
+        if instrumented:
+            parse_start = time.perf_counter()
+        full_response, error_code, error_message = response_handler(response.text, suppress_print)
+        if instrumented:
+            end = time.perf_counter()
+            self._emit(CallEvent(
+                call_type, endpoint, urlsplit(post_url).hostname, response.status_code, attempt,
+                _connect_timer.seconds, response.elapsed, end - start, len(full_request),
+                len(response.content), end - parse_start, error_code, None
+            ))
+
+        result = AccResult(post_data, full_response, error_code, error_message, call_type)
+        self._update_lookup_cache(result)
+        return result
+
+    def _send(self, endpoint, full_request, call_type, start=None, stream=False):
+        """
+        :usage: Sends a request over the pooled transport, retrying as allowed by the endpoint's RetryPolicy
+        :param endpoint: ACC order-service endpoint name, e.g. 'verify-order'
+        :param full_request: JSON request body
+        :param call_type: Name of the API method, for CallEvents
+        :param start: perf_counter() at the start of the call when instrumented, else None (Default: None)
+        :param stream: Return a TransportStream instead of reading the whole response (Default: False)
+        :return: (TransportResponse or TransportStream, attempts, post_url)
+        """
+        retry_policy = self.retry_policies.get(endpoint)
+        send = self.transport.post_stream if stream else self.transport.post
+        attempt = 0
+        base_url = None
+        while True:
+            attempt += 1
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(endpoint)
+            base_url = self._route(avoid=base_url if attempt > 1 else None)
+            post_url = '{0}/{1}/'.format(base_url, endpoint)
+            attempt_start = time.perf_counter()
+            try:
+                response = send(post_url, full_request, self.timeout)
+            except requests.RequestException as e:
+                self._record_outcome(endpoint, None, base_url, time.perf_counter() - attempt_start)
+                failure = 'connect' if _connect_failed(e) else 'transport'
+                if retry_policy is None or not retry_policy.should_retry(attempt, failure=failure):
+                    if start is not None:
+                        self._emit(CallEvent(
+                            call_type, endpoint, urlsplit(post_url).hostname, None, attempt, _connect_timer.seconds,
+                            None, time.perf_counter() - start, len(full_request), None, None, None, e
+                        ))
+                    raise
+                time.sleep(retry_policy.backoff(attempt))
+                continue
+            self._record_outcome(endpoint, response.status_code, base_url, time.perf_counter() - attempt_start)
+            if retry_policy is None or not retry_policy.should_retry(attempt, status_code=response.status_code):
+                return response, attempt, post_url
+            if stream:
+                response.close()
+            time.sleep(retry_policy.backoff(attempt, retry_after(response.headers)))
+
+    def _post_stream(self, endpoint, post_data, call_type, sink, suppress_print):
+        """
+        :usage: Like _post(), for responses carrying a POC document. The document is decoded into sink while the
+                response streams in, so neither the response body nor the document is held in memory.
+        :param sink: Path or binary file-like object the decoded POC document is written to. A path is only created
+                     once the whole document was received without an error code
+        :return: JSON formatted strings of the complete API request, response (with the POC_CONTENT_KEY value left
+                 empty), and any error codes
+        """
+        full_request = json.dumps(post_data)
+        instrumented = bool(self.hooks)
+        start = None
+        if instrumented:
+            start = time.perf_counter()
+            _connect_timer.seconds = 0.0
+
+        response, attempt, post_url = self._send(endpoint, full_request, call_type, start, stream=True)
+
+        # Decode the document as it arrives, then parse what is left of the response
+        if instrumented:
+            parse_start = time.perf_counter()
+        output = open(sink + '.part', 'wb') if isinstance(sink, str) else sink
+        completed = False
+        try:
+            decoder = PocStreamDecoder(output)
+            for chunk in response.chunks:
+                decoder.feed(chunk)
+            full_response, error_code, error_message = response_handler(decoder.close(), suppress_print)
+            completed = not error_code
+        finally:
+            response.close()
+            if output is not sink:
+                output.close()
+                if completed:
+                    os.replace(sink + '.part', sink)
+                else:
+                    os.remove(sink + '.part')
+        if instrumented:
+            end = time.perf_counter()
+            self._emit(CallEvent(
+                call_type, endpoint, urlsplit(post_url).hostname, response.status_code, attempt,
+                _connect_timer.seconds, response.elapsed, end - start, len(full_request), decoder.bytes_read,
+                end - parse_start, error_code, None
+            ))
+        return AccResult(post_data, full_response, error_code, error_message, call_type)
+
+    def verify_order(self, invoice_number, first_name, last_name, company_name, email_address, address_line1,
+                     address_line2, city, state, zip_code, device_id, secondary_serial, purchase_date,
+                     suppress_print=False):
+        """
+        :usage: See verify_order()
+        """
+        order = Order(
+            invoice_number, first_name, last_name, company_name, email_address, address_line1, address_line2, city,
+            state, zip_code, device_id, secondary_serial, purchase_date
+        )
+        if self.validate:
+            errors = validate_order(order)
+            if errors:
+                return preflight_result(errors, 'verify_order', suppress_print)
+        post_data, full_request = self.serializer.order(order)
+        return self._post('verify-order', post_data, 'verify_order', suppress_print, full_request)
+
+    def create_order(self, invoice_number, first_name, last_name, company_name, email_address, address_line1,
+                     address_line2, city, state, zip_code, device_id, secondary_serial, purchase_date,
+                     suppress_print=False):
+        """
+        :usage: See create_order()
+        """
+        order = Order(
+            invoice_number, first_name, last_name, company_name, email_address, address_line1, address_line2, city,
+            state, zip_code, device_id, secondary_serial, purchase_date
+        )
+        if self.validate:
+            errors = validate_order(order)
+            if errors:
+                return preflight_result(errors, 'create_order', suppress_print)
+        post_data, full_request = self.serializer.order(order)
+        return self._post('create-order', post_data, 'create_order', suppress_print, full_request)
+
+    def cancel_order(self, device_id, cancellation_date, cancel_reason_code, suppress_print=False):
+        """
+        :usage: See cancel_order()
+        """
+        cancellation = Cancellation(device_id, cancellation_date, cancel_reason_code)
+        if self.validate:
+            errors = validate_cancel(cancellation)
+            if errors:
+                return preflight_result(errors, 'cancel_order', suppress_print)
+        post_data, full_request = self.serializer.cancel(cancellation)
+        return self._post('cancel-order', post_data, 'cancel_order', suppress_print, full_request)
+
+    def three_sixty_lookup(self, invoice_number, device_id, email_address, suppress_print=False):
+        """
+        :usage: See three_sixty_lookup()
+        """
+        post_data = lookup_post_data(self.ship_to, invoice_number, device_id, email_address)
+        return self._cached_lookup(post_data, suppress_print) or self._post(
+            'get-order', post_data, 'three_sixty_lookup', suppress_print
+        )
+
+    def poc_content(self, device_id, poc_language="ENG", sink=None, suppress_print=False):
+        """
+        :usage: See poc_content()
+        """
+        post_data = poc_content_post_data(self.ship_to, device_id, poc_language)
+        if sink is None:
+            return self._post('get-poc-content', post_data, 'poc_content', suppress_print)
+        return self._post_stream('get-poc-content', post_data, 'poc_content', sink, suppress_print)
+
+    def consolidated_poc(self, invoice_number, poc_language="ENG", sink=None, suppress_print=False):
+        """
+        :usage: See consolidated_poc()
+        """
+        post_data = consolidated_poc_post_data(self.ship_to, invoice_number, poc_language)
+        if sink is None:
+            return self._post('consolidated-poc', post_data, 'consolidated_poc', suppress_print)
+        return self._post_stream('consolidated-poc', post_data, 'consolidated_poc', sink, suppress_print)
+
+
+class AsyncAccClient(BaseAccClient):
+    """
+    :usage: asyncio AppleCare Connect client. Exposes awaitable versions of the API methods with the same return values,
+            sent over one shared httpx connection pool with at most max_in_flight requests outstanding.
+            Requires the optional 'httpx' module.
+    """
+
+    def __init__(self, ship_to, env, cert, private_key, max_in_flight=20, max_keepalive=10, http2=False, **kwargs):
+        """
+        :param ship_to: AppleCare Connect 10 Digit SHIPTO Number
+        :param env: AppleCare Connect Environment: UAT or PROD
+        :param cert: Path to AppleCare Connect Cert .PEM File
+        :param private_key: Path to AppleCare Connect Private Key .PEM File
+        :param max_in_flight: Maximum number of concurrent API calls (Default: 20)
+        :param max_keepalive: Maximum number of idle connections kept open (Default: 10)
+        :param http2: Multiplex concurrent calls over HTTP/2 connections; requires the 'h2' module (Default: False)
+        :param kwargs: BaseAccClient options (timeout, lookup_cache, rate_limiter, retry_policies, hooks, ...)
+        """
+        if httpx is None:
+            raise ImportError("AsyncAccClient requires the 'httpx' module")
+        super(AsyncAccClient, self).__init__(ship_to, env, cert, private_key, **kwargs)
+        self.max_in_flight = max_in_flight
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        # Load the client cert into an SSL context once for the whole pool
+        self.http = httpx.AsyncClient(
+            http2=http2, verify=_ssl_context(self.cert, self.verify, HTTP2_ALPN if http2 else HTTP1_ALPN),
+            timeout=self.timeout,
+            headers={'Content-Type': "application/json;charset=utf-8"},
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_keepalive)
+        )
+
+    async def aclose(self):
+        """
+        :usage: Closes all pooled connections
+        """
+        await self.http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def _post(self, endpoint, post_data, call_type, suppress_print, full_request=None):
+        """
+        :param endpoint: ACC order-service endpoint name, e.g. 'verify-order'
+        :param post_data: Request array to send
+        :param call_type: Name of the API method, returned to the caller
+        :param suppress_print: Suppress any print output from function. Callers sharing a coalesced call get the
+                               output of the caller that made it
+        :param full_request: post_data already encoded as JSON, e.g. by the OrderSerializer (Default: None, encoded
+                             with json.dumps())
+        :return: AccResult with the complete API request, response, and any error codes
+        """
+        if self.single_flight is not None and endpoint in COALESCED_ENDPOINTS:
+            return await self.single_flight.do(
+                single_flight_key(endpoint, post_data, self.env), self._request, endpoint, post_data, call_type,
+                suppress_print, full_request
+            )
+        return await self._request(endpoint, post_data, call_type, suppress_print, full_request)
+
+    async def _request(self, endpoint, post_data, call_type, suppress_print, full_request=None):
+        """
+        :usage: Makes one API call for _post()
+        """
+        # Format post_data as JSON
+        if full_request is None:
+            full_request = json.dumps(post_data)
+
+        # Send data to API, waiting for a free slot if max_in_flight calls are outstanding, and retrying as allowed by
+        # the endpoint's RetryPolicy
+        instrumented = bool(self.hooks)
+        extensions = None
+        if instrumented:
+            start = time.perf_counter()
+            trace = _HttpxTrace()
+            extensions = {'trace': trace}
+
+        retry_policy = self.retry_policies.get(endpoint)
+        attempt = 0
+        base_url = None
+        while True:
+            attempt += 1
+            if self.rate_limiter is not None:
+                delay = self.rate_limiter.reserve(endpoint)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            base_url = self._route(avoid=base_url if attempt > 1 else None)
+            post_url = '{0}/{1}/'.format(base_url, endpoint)
+            try:
+                async with self._semaphore:
+                    attempt_start = time.perf_counter()
+                    response = await self.http.post(post_url, content=full_request, extensions=extensions)
+            except httpx.HTTPError as e:
+                self._record_outcome(endpoint, None, base_url, time.perf_counter() - attempt_start)
+                failure = 'connect' if _httpx_connect_failed(e) else 'transport'
+                if retry_policy is None or not retry_policy.should_retry(attempt, failure=failure):
+                    if instrumented:
+                        self._emit(CallEvent(
+                            call_type, endpoint, urlsplit(post_url).hostname, None, attempt, trace.connect_time,
+                            trace.ttfb, time.perf_counter() - start, len(full_request), None, None, None, e
+                        ))
+                    raise
+                await asyncio.sleep(retry_policy.backoff(attempt))
+                continue
+            self._record_outcome(endpoint, response.status_code, base_url, time.perf_counter() - attempt_start)
+            if retry_policy is None or not retry_policy.should_retry(attempt, status_code=response.status_code):
+                break
+            await asyncio.sleep(retry_policy.backoff(attempt, retry_after(response.headers)))
+
+        # Call return handler function to parse request response
+        if instrumented:
+            parse_start = time.perf_counter()
+        full_response, error_code, error_message = response_handler(response.text, suppress_print)
+        if instrumented:
+            end = time.perf_counter()
+            self._emit(CallEvent(
+                call_type, endpoint, urlsplit(post_url).hostname, response.status_code, attempt, trace.connect_time,
+                trace.ttfb, end - start, len(full_request), len(response.content), end - parse_start, error_code, None
+            ))
+
+        result = AccResult(post_data, full_response, error_code, error_message, call_type)
+        self._update_lookup_cache(result)
+        return result
+
+    async def verify_order(self, invoice_number, first_name, last_name, company_name, email_address, address_line1,
+                           address_line2, city, state, zip_code, device_id, secondary_serial, purchase_date,
+                           suppress_print=False):
+        """
+        :usage: See verify_order()
+        """
+        order = Order(
+            invoice_number, first_name, last_name, company_name, email_address, address_line1, address_line2, city,
+            state, zip_code, device_id, secondary_serial, purchase_date
+        )
+        if self.validate:
+            errors = validate_order(order)
+            if errors:
+                return preflight_result(errors, 'verify_order', suppress_print)
+        post_data, full_request = self.serializer.order(order)
+        return await self._post('verify-order', post_data, 'verify_order', suppress_print, full_request)
+
+    async def create_order(self, invoice_number, first_name, last_name, company_name, email_address, address_line1,
+                           address_line2, city, state, zip_code, device_id, secondary_serial, purchase_date,
+                           suppress_print=False):
+        """
+        :usage: See create_order()
+        """
+        order = Order(
+            invoice_number, first_name, last_name, company_name, email_address, address_line1, address_line2, city,
+            state, zip_code, device_id, secondary_serial, purchase_date
+        )
+        if self.validate:
+            errors = validate_order(order)
+            if errors:
+                return preflight_result(errors, 'create_order', suppress_print)
+        post_data, full_request = self.serializer.order(order)
+        return await self._post('create-order', post_data, 'create_order', suppress_print, full_request)
+
+    async def cancel_order(self, device_id, cancellation_date, cancel_reason_code, suppress_print=False):
+        """
+        :usage: See cancel_order()
+        """
+        cancellation = Cancellation(device_id, cancellation_date, cancel_reason_code)
+        if self.validate:
+            errors = validate_cancel(cancellation)
+            if errors:
+                return preflight_result(errors, 'cancel_order', suppress_print)
+        post_data, full_request = self.serializer.cancel(cancellation)
+        return await self._post('cancel-order', post_data, 'cancel_order', suppress_print, full_request)
+
+    async def three_sixty_lookup(self, invoice_number, device_id, email_address, suppress_print=False):
+        """
+        :usage: See three_sixty_lookup()
+        """
+        post_data = lookup_post_data(self.ship_to, invoice_number, device_id, email_address)
+        return self._cached_lookup(post_data, suppress_print) or await self._post(
+            'get-order', post_data, 'three_sixty_lookup', suppress_print
+        )
+
+    async def poc_content(self, device_id, poc_language="ENG", suppress_print=False):
+        """
+        :usage: See poc_content(). Returns the whole response; use AccClient to stream POCs to a file
+        """
+        post_data = poc_content_post_data(self.ship_to, device_id, poc_language)
+        return await self._post('get-poc-content', post_data, 'poc_content', suppress_print)
+
+    async def consolidated_poc(self, invoice_number, poc_language="ENG", suppress_print=False):
+        """
+        :usage: See consolidated_poc(). Returns the whole response; use AccClient to stream POCs to a file
+        """
+        post_data = consolidated_poc_post_data(self.ship_to, invoice_number, poc_language)
+        return await self._post('consolidated-poc', post_data, 'consolidated_poc', suppress_print)
+
+
+class AccClientRegistry(object):
+    """
+    :usage: Registry of AccClients for many ShipTos in one process. Each ShipTo gets its own client, with an isolated
+            connection pool and its own credentials, and calls are routed by ShipTo. All clients share one HostHealth,
+            so when an ACC host degrades every ShipTo on it fails over to the paired host.
+    """
+
+    def __init__(self, env=None, cert=None, private_key=None, health=None, client_class=None, **client_kwargs):
+        """
+        :param env: Default AppleCare Connect Environment for ShipTos registered without one
+        :param cert: Default path to the ACC Cert .PEM File
+        :param private_key: Default path to the ACC Private Key .PEM File
+        :param health: Shared HostHealth (Default: a new HostHealth)
+        :param client_class: Client class to build (Default: AccClient)
+        :param client_kwargs: Default keyword arguments for every client (pool sizes, rate_limiter, hooks, ...)
+        """
+        self.env = env
+        self.cert = cert
+        self.private_key = private_key
+        self.health = health or HostHealth()
+        self.client_class = client_class or AccClient
+        self.client_kwargs = client_kwargs
+        self._clients = {}
+        self._replaced = []  # Clients replaced by register(), closed by close() as callers may still be using them
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """
+        :param config: Dict of ShipTo -> dict of AccClient arguments (env, cert, private_key, ...) for that ShipTo
+        :param kwargs: AccClientRegistry defaults
+        :return: AccClientRegistry with every ShipTo in config registered
+        """
+        registry = cls(**kwargs)
+        for ship_to, settings in config.items():
+            registry.register(ship_to, **settings)
+        return registry
+
+    def _build(self, ship_to, env=None, cert=None, private_key=None, **kwargs):
+        """
+        :return: New client of the ShipTo, see register()
+        """
+        client_kwargs = dict(self.client_kwargs, health=self.health)
+        client_kwargs.update(kwargs)
+        return self.client_class(
+            ship_to, env or self.env, cert or self.cert, private_key or self.private_key, **client_kwargs
+        )
+
+    def register(self, ship_to, env=None, cert=None, private_key=None, **kwargs):
+        """
+        :usage: Builds and registers the client of a ShipTo, replacing any existing one. A replaced client is not
+                closed, as callers may still be using it; close() closes it with the others.
+        :param ship_to: AppleCare Connect 10 Digit SHIPTO Number
+        :param env: AppleCare Connect Environment (Default: the registry's env)
+        :param cert: Path to the ACC Cert .PEM File (Default: the registry's cert)
+        :param private_key: Path to the ACC Private Key .PEM File (Default: the registry's private_key)
+        :param kwargs: Client keyword arguments overriding the registry's client_kwargs
+        :return: The new client
+        """
+        client = self._build(ship_to, env, cert, private_key, **kwargs)
+        with self._lock:
+            previous = self._clients.get(ship_to)
+            self._clients[ship_to] = client
+            if previous is not None:
+                self._replaced.append(previous)
+        return client
+
+    def client(self, ship_to):
+        """
+        :param ship_to: AppleCare Connect 10 Digit SHIPTO Number
+        :return: Client of the ShipTo, registered with the registry defaults on first use
+        """
+        client = self._clients.get(ship_to)
+        if client is None:
+            # Built under the lock, so concurrent first calls for a ShipTo all get the same client
+            with self._lock:
+                client = self._clients.get(ship_to)
+                if client is None:
+                    if self.env is None or self.cert is None:
+                        raise KeyError("ShipTo {0} is not registered".format(ship_to))
+                    client = self._clients[ship_to] = self._build(ship_to)
+        return client
+
+    def ship_tos(self):
+        """
+        :return: List of registered ShipTos
+        """
+        return list(self._clients)
+
+    def verify_order(self, ship_to, *args, **kwargs):
+        """
+        :usage: verify_order() for the ShipTo
+        """
+        return self.client(ship_to).verify_order(*args, **kwargs)
+
+    def create_order(self, ship_to, *args, **kwargs):
+        """
+        :usage: create_order() for the ShipTo
+        """
+        return self.client(ship_to).create_order(*args, **kwargs)
+
+    def cancel_order(self, ship_to, *args, **kwargs):
+        """
+        :usage: cancel_order() for the ShipTo
+        """
+        return self.client(ship_to).cancel_order(*args, **kwargs)
+
+    def three_sixty_lookup(self, ship_to, *args, **kwargs):
+        """
+        :usage: three_sixty_lookup() for the ShipTo
+        """
+        return self.client(ship_to).three_sixty_lookup(*args, **kwargs)
+
+    def poc_content(self, ship_to, *args, **kwargs):
+        """
+        :usage: poc_content() for the ShipTo
+        """
+        return self.client(ship_to).poc_content(*args, **kwargs)
+
+    def consolidated_poc(self, ship_to, *args, **kwargs):
+        """
+        :usage: consolidated_poc() for the ShipTo
+        """
+        return self.client(ship_to).consolidated_poc(*args, **kwargs)
+
+    def _take_clients(self):
+        """
+        :return: List of every registered and replaced client, which are removed from the registry
+        """
+        with self._lock:
+            clients = list(self._clients.values()) + self._replaced
+            self._clients.clear()
+            self._replaced = []
+        return clients
+
+    def close(self):
+        """
+        :usage: Closes every client's connections, including clients replaced by register()
+        :raises TypeError: If the registry holds AsyncAccClients, which must be closed with aclose()
+        """
+        with self._lock:
+            if any(not hasattr(client, 'close') for client in list(self._clients.values()) + self._replaced):
+                raise TypeError("Registry holds clients without close(); use 'await registry.aclose()'")
+        for client in self._take_clients():
+            client.close()
+
+    async def aclose(self):
+        """
+        :usage: Closes every client's connections, awaiting aclose() for AsyncAccClients
+        """
+        for client in self._take_clients():
+            if hasattr(client, 'aclose'):
+                await client.aclose()
+            else:
+                client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+# Default client used by the module level functions
+_default_client = None
+_default_client_settings = None
+_default_client_lock = threading.Lock()
+
+
+def _env_settings():
+    """
+    :return: Tuple of the ACC_* environment variables the default client is built from
+    """
+    acc_env = os.environ['ACC_ENV']
+    return (os.environ['ACC_SHIPTO'], acc_env) + acc_cert_from_env(acc_env) + (os.environ.get('ACC_TRANSPORT'),)
+
+
+def default_client():
+    """
+    :usage: Returns the shared AccClient built from the ACC_* environment variables. The client is built on first use
+            and rebuilt only if those variables change, so connections are reused across calls. A replaced client is
+            not closed, as other threads may still be using it; its connections are released once it is no longer
+            referenced.
+    :return: AccClient
+    """
+    global _default_client, _default_client_settings
+
+    settings = _env_settings()
+    with _default_client_lock:
+        if _default_client is None or settings != _default_client_settings:
+            acc_ship_to, acc_env, cert, private_key, transport = settings
+            _default_client = AccClient(acc_ship_to, acc_env, cert, private_key, transport=transport)
+            _default_client_settings = settings
+        return _default_client
+
+
+def acc_credentials():
+    """
+    :usage: Defines the AppleCare Settings for the API calls
+    :return: Pooled Requests Session w/ headers and ACC cert (None with a non-'requests' transport), ACC ShipTo, and
+             endpoint base URL of the default client
+    """
+    client = default_client()
+    return client.session, client.ship_to, client.base_url
+
+
+def verify_order(invoice_number, first_name, last_name, company_name, email_address, address_line1, address_line2, city,
+                 state, zip_code, device_id, secondary_serial, purchase_date, suppress_print=False):
+    """
+    :usage: Designed to verify an order, to ensure that all criteria are met before placing the order. This API is
+            recommended to be used before using the createOrder API.
+    :param invoice_number: Invoice number from POS
+    :param first_name: Customer's first name as shown on invoice
+    :param last_name: Customer's last name as shown on invoice
+    :param company_name: Customer's company as shown on invoice (optional)
+    :param email_address: Customer's email address as shown on invoice
+    :param address_line1: First line of Customer's street address as shown on invoice (optional)
+    :param address_line2: Second line of Customer's street address as shown on invoice (optional)
+    :param city: City of Customer's street address as shown on invoice (optional)
+    :param state: State of Customer's street address as shown on invoice (optional)
+    :param zip_code: Zip Code of Customer's street address as shown on invoice (optional)
+    :param device_id: Serial number of the AppleCare eligible device sold
+    :param secondary_serial: Serial number the secondary AppleCare eligible device sold (Thunderbolt Display, optional)
+    :param purchase_date: Purchase date of the AppleCare eligible device
+    :param suppress_print: Suppress any print output from function (Default: False)
+    :return: JSON formatted strings of the complete API request, response, and any error codes
+    """
+    return default_client().verify_order(
+        invoice_number, first_name, last_name, company_name, email_address, address_line1, address_line2, city,
+        state, zip_code, device_id, secondary_serial, purchase_date, suppress_print=suppress_print
+    )
+
+
+def create_order(invoice_number, first_name, last_name, company_name, email_address, address_line1, address_line2, city,
+                 state, zip_code, device_id, secondary_serial, purchase_date, suppress_print=False):
+    """
+    :usage: Allows users to create an order to enroll a unit for AppleCare (APP/AC+). It is recommended that this API
+            always be preceded by a verifyOrder API call, to increase the chances of a successful order creation.
+    :param invoice_number: Invoice number from POS
+    :param first_name: Customer's first name as shown on invoice
+    :param last_name: Customer's last name as shown on invoice
+    :param company_name: Customer's company as shown on invoice (optional)
+    :param email_address: Customer's email address as shown on invoice
+    :param address_line1: First line of Customer's street address as shown on invoice (optional)
+    :param address_line2: Second line of Customer's street address as shown on invoice (optional)
+    :param city: City of Customer's street address as shown on invoice (optional)
+    :param state: State of Customer's street address as shown on invoice (optional)
+    :param zip_code: Zip Code of Customer's street address as shown on invoice (optional)
+    :param device_id: Serial number of the AppleCare eligible device sold
+    :param secondary_serial: Serial number the secondary AppleCare eligible device sold (Thunderbolt Display, optional)
+    :param purchase_date: Purchase date of the AppleCare eligible device
+    :param suppress_print: Suppress any print output from function (Default: False)
+    :return: JSON formatted strings of the complete API request, response, and any error codes
+    """
+    return default_client().create_order(
+        invoice_number, first_name, last_name, company_name, email_address, address_line1, address_line2, city,
+        state, zip_code, device_id, secondary_serial, purchase_date, suppress_print=suppress_print
+    )
+
+
+def cancel_order(device_id, cancellation_date, cancel_reason_code, suppress_print=False):
+    """
+    :usage: Designed to cancel an Auto Enrollment (AE) Order for AppleCare (APP/AC+).
+    :param device_id: Serial number of the AppleCare eligible device sold
+    :param cancellation_date: Date the device and AppleCare were refunded as shown on the return invoice
+    :param cancel_reason_code: Cancellation code explaing why device was returned
+    :param suppress_print: Suppress any print output from function (Default: False)
+    :return: JSON formatted strings of the complete API request, response, and any error codes
+    """
+    return default_client().cancel_order(
+        device_id, cancellation_date, cancel_reason_code, suppress_print=suppress_print
+    )
+
+
+def three_sixty_lookup(invoice_number, device_id, email_address, suppress_print=False):
+    """
+    :usage: Designed to search a details of the device based on various parameters.
+    :param invoice_number: Refund invoice number from POS
+    :param device_id: Serial number of the AppleCare eligible device sold
+    :param email_address: Registered email associated with AppleCare Enrollment
+    :param suppress_print: Suppress any print output from function (Default: False)
+    :return: JSON formatted strings of the complete API request, response, and any error codes
+    """
+    return default_client().three_sixty_lookup(
+        invoice_number, device_id, email_address, suppress_print=suppress_print
+    )
+
+
+def poc_content(device_id, poc_language="ENG", sink=None, suppress_print=False):
+    """
+    :usage: Designed to retrieve the Proof of Coverage document of an enrolled device.
+    :param device_id: Serial number of the enrolled device
+    :param poc_language: Language of the POC document (Default: ENG)
+    :param sink: Path or binary file-like object to stream the decoded POC document to (Default: None, return the
+                 base64 encoded document in the response)
+    :param suppress_print: Suppress any print output from function (Default: False)
+    :return: JSON formatted strings of the complete API request, response, and any error codes. With a sink, the
+             response's POC_CONTENT_KEY value is left empty
+    """
+    return default_client().poc_content(device_id, poc_language, sink=sink, suppress_print=suppress_print)
+
+
+def consolidated_poc(invoice_number, poc_language="ENG", sink=None, suppress_print=False):
+    """
+    :usage: Designed to retrieve one consolidated Proof of Coverage document for all devices of an order.
+    :param invoice_number: Invoice number (purchase order number) the devices were enrolled with
+    :param poc_language: Language of the POC document (Default: ENG)
+    :param sink: Path or binary file-like object to stream the decoded POC document to (Default: None, return the
+                 base64 encoded document in the response)
+    :param suppress_print: Suppress any print output from function (Default: False)
+    :return: JSON formatted strings of the complete API request, response, and any error codes. With a sink, the
+             response's POC_CONTENT_KEY value is left empty
+    """
+    return default_client().consolidated_poc(invoice_number, poc_language, sink=sink, suppress_print=suppress_print)
+
+
+#######################################################################################################################
+# Batch Enrollment
+#######################################################################################################################
+
+# Result of enrolling one order record. status is 'ok', 'invalid' (rejected by pre-flight validation, see verify),
+# 'verify_failed' or 'create_failed'; verify and create hold the
+# (post_data, full_response, error_code, error_message, call_type) tuples of each call, or None if it was not made.
+EnrollmentResult = collections.namedtuple(
+    'EnrollmentResult', ['index', 'record', 'status', 'verify', 'create', 'exception']
+)
+
+
+def read_records(path, model=None):
+    """
+    :usage: Lazily reads records from a CSV file with a header row, or a JSONL file with one JSON object per line
+    :param path: Path to a .csv or .jsonl file. '-' reads JSONL from stdin
+    :param model: Order or Cancellation to yield compact model instances instead of dicts, which takes a fraction of the
+                  memory for records held in flight or sent to worker processes (Default: None, dicts)
+    :return: Generator of record dicts, or of model instances
+    """
+    records = _read_records(path)
+    if model is None:
+        return records
+    return (model.from_record(record) for record in records)
+
+
+def _read_records(path):
+    """
+    :return: Generator of the record dicts in path, see read_records()
+    """
+    if path == '-':
+        for line in sys.stdin:
+            if line.strip():
+                yield json.loads(line)
+        return
+
+    with open(path, newline='') as records_file:
+        if path.lower().endswith('.csv'):
+            for row in csv.DictReader(records_file):
+                yield row
+        else:
+            for line in records_file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def order_kwargs(record):
+    """
+    :param record: Order record dict keyed by ORDER_FIELDS; missing optional fields default to ""
+    :return: Keyword arguments for verify_order/create_order
+    """
+    return {field: record.get(field) or "" for field in ORDER_FIELDS}
+
+
+def bounded_map(func, items, max_workers):
+    """
+    :usage: Runs func over items on a thread pool, keeping at most 2 * max_workers items in flight so that large inputs
+            are never read into memory all at once
+    :param func: Function called with each item
+    :param items: Iterable of items, consumed lazily
+    :param max_workers: Number of worker threads
+    :return: Generator of func results in completion order
+    """
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for item in items:
+            pending.add(executor.submit(func, item))
+            if len(pending) >= max_workers * 2:
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in futures.as_completed(pending):
+            yield future.result()
+
+
+class EnrollmentJournal(object):
+    """
+    :usage: Append-only sqlite (WAL mode) journal of a bulk enrollment run. Each order record's state is written before
+            and after its create_order call, so a crashed run can be resumed: completed records are skipped, and
+            records whose create_order was sent without a recorded answer ('create_sent') are reconciled with a single
+            three_sixty_lookup instead of being created twice.
+
+            States: 'verify_failed', 'create_sent' (verified, with the verify_order response), 'created',
+            'create_failed'
+    """
+
+    def __init__(self, path, durable=False):
+        """
+        :param path: Path to the sqlite journal file, created if missing
+        :param durable: fsync every state change so the journal also survives power loss, not just a crash of this
+                        process (Default: False)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous={0}".format('FULL' if durable else 'NORMAL'))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS enrollments "
+            "(key TEXT PRIMARY KEY, record_index INTEGER, state TEXT, post_data TEXT, response TEXT, error_code TEXT, "
+            "updated REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS events (key TEXT, state TEXT, response TEXT, error_code TEXT, created REAL)"
+        )
+
+    @staticmethod
+    def record_key(record):
+        """
+        :param record: Order record dict keyed by ORDER_FIELDS
+        :return: Journal key of the record: invoice number and device serial
+        """
+        return '{0}|{1}'.format(record.get('invoice_number') or "", (record.get('device_id') or "").upper())
+
+    def state(self, record):
+        """
+        :param record: Order record dict
+        :return: Last journaled state of the record, or None if it was never journaled
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM enrollments WHERE key = ?", (self.record_key(record),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def record(self, record, state, index=None, result=None):
+        """
+        :usage: Journals a state change of a record
+        :param record: Order record dict
+        :param state: New state
+        :param index: Position of the record in its batch (optional)
+        :param result: (post_data, full_response, error_code, error_message, call_type) of the call that led to the
+                       state, or None
+        """
+        key = self.record_key(record)
+        post_data = response = error_code = None
+        if result is not None:
+            post_data = json.dumps(result[0])
+            response = json.dumps(result[1])
+            error_code = json.dumps(result[2])
+        now = time.time()
+        with self._lock:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.execute(
+                    "INSERT INTO enrollments (key, record_index, state, post_data, response, error_code, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                    "record_index = COALESCE(excluded.record_index, record_index), state = excluded.state, "
+                    "post_data = COALESCE(excluded.post_data, post_data), "
+                    "response = excluded.response, error_code = excluded.error_code, updated = excluded.updated",
+                    (key, index, state, post_data, response, error_code, now)
+                )
+                self._db.execute(
+                    "INSERT INTO events (key, state, response, error_code, created) VALUES (?, ?, ?, ?, ?)",
+                    (key, state, response, error_code, now)
+                )
+
+    def summary(self):
+        """
+        :return: Dict of state to number of records
+        """
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM enrollments GROUP BY state").fetchall())
+
+    def close(self):
+        """
+        :usage: Closes the journal database
+        """
+        with self._lock:
+            self._db.close()
+
+
+# lookupErrorResponse error codes meaning ACC has no order for the device. Only these (or a clean lookup without the
+# invoice) let a record left in doubt by a crash be created again; any other lookup error keeps it in doubt.
+LOOKUP_NOT_FOUND_CODES = set()
+
+
+def lookup_confirms_order(full_response, invoice_number):
+    """
+    :param full_response: Decoded three_sixty_lookup response for a device
+    :param invoice_number: Invoice number the device should be enrolled under
+    :return: True if the lookup shows an order with the invoice number
+    """
+    return any(value == invoice_number for value in find_values(full_response, 'purchaseOrderNumber'))
+
+
+def _reconcile_in_doubt(client, record, index, journal, suppress_print):
+    """
+    :usage: Looks up a record whose create_order was sent without a journaled answer
+    :return: EnrollmentResult if the order exists at ACC or the lookup failed (the record stays 'create_sent'), None
+             if ACC definitely has no such order and it still has to be created
+    """
+    lookup = client.three_sixty_lookup("", record.get('device_id'), "", suppress_print=suppress_print)
+    error_code = lookup[2]
+    if not error_code:
+        if not lookup_confirms_order(lookup[1], record.get('invoice_number')):
+            return None
+        journal.record(record, 'created', index, lookup)
+        return EnrollmentResult(index, record, 'ok', None, None, None)
+    envelope, _ = find_error_envelope(lookup[1])
+    if envelope == 'lookupErrorResponse' and isinstance(error_code, list) and \
+            all(code in LOOKUP_NOT_FOUND_CODES for code in error_code):
+        return None
+    # Invalid JSON (e.g. a 503 page), throttling or any other error: still in doubt, leave it for the next resume
+    return EnrollmentResult(index, record, 'create_failed', None, None, None)
+
+
+def enroll_order(client, record, index=None, suppress_print=True, journal=None, validate=True):
+    """
+    :usage: Verifies an order record and, if verification passed, creates the order
+    :param client: AccClient used for both calls
+    :param record: Order record dict keyed by ORDER_FIELDS
+    :param index: Position of the record in its batch (optional)
+    :param suppress_print: Suppress any print output from the API calls (Default: True)
+    :param journal: EnrollmentJournal to record progress in and resume from (optional)
+    :param validate: Reject records failing validate_order without calling ACC (Default: True)
+    :return: EnrollmentResult, or None if the journal shows the record was already created
+    """
+    if validate:
+        errors = validate_order(record)
+        if errors:
+            return EnrollmentResult(
+                index, record, 'invalid', preflight_result(errors, 'verify_order', suppress_print), None, None
+            )
+
+    if journal is not None:
+        state = journal.state(record)
+        if state == 'created':
+            return None
+        if state == 'create_sent':
+            try:
+                reconciled = _reconcile_in_doubt(client, record, index, journal, suppress_print)
+            except requests.RequestException as e:
+                # Still in doubt; leave it for the next resume rather than risk a duplicate enrollment
+                return EnrollmentResult(index, record, 'create_failed', None, None, e)
+            if reconciled is not None:
+                return reconciled
+
+    kwargs = order_kwargs(record)
+    try:
+        verify = client.verify_order(suppress_print=suppress_print, **kwargs)
+    except requests.RequestException as e:
+        return EnrollmentResult(index, record, 'verify_failed', None, None, e)
+    if verify[2]:
+        if journal is not None:
+            journal.record(record, 'verify_failed', index, verify)
+        return EnrollmentResult(index, record, 'verify_failed', verify, None, None)
+
+    if journal is not None:
+        # Journaled before sending: a crash from here on leaves the record in doubt until it is reconciled
+        journal.record(record, 'create_sent', index, verify)
+    try:
+        create = client.create_order(suppress_print=suppress_print, **kwargs)
+    except requests.RequestException as e:
+        if journal is not None and _connect_failed(e):
+            journal.record(record, 'create_failed', index)
+        return EnrollmentResult(index, record, 'create_failed', verify, None, e)
+    if create[2]:
+        if journal is not None:
+            journal.record(record, 'create_failed', index, create)
+        return EnrollmentResult(index, record, 'create_failed', verify, create, None)
+
+    if journal is not None:
+        journal.record(record, 'created', index, create)
+    return EnrollmentResult(index, record, 'ok', verify, create, None)
+
+
+def enroll_orders(records, client=None, max_workers=8, suppress_print=True, journal=None, validate=True):
+    """
+    :usage: Bulk enrollment. Runs verify_order then create_order for each order record with at most max_workers
+            records in flight, streaming results back as each one finishes.
+    :param records: Iterable of order record dicts keyed by ORDER_FIELDS, e.g. from read_records()
+    :param client: AccClient to use (Default: the default client). Its pool_maxsize should be at least max_workers
+    :param max_workers: Number of orders processed concurrently (Default: 8)
+    :param suppress_print: Suppress any print output from the API calls (Default: True)
+    :param journal: EnrollmentJournal to record progress in. Re-running the same records with the same journal
+                    resumes the run: records already created are skipped (and not yielded) and records left in doubt
+                    are reconciled with one three_sixty_lookup each (optional)
+    :param validate: Reject records failing validate_order, with status 'invalid', without calling ACC
+                     (Default: True)
+    :return: Generator of EnrollmentResult in completion order; index gives the position in records
+    """
+    client = client or default_client()
+
+    def run(indexed_record):
+        index, record = indexed_record
+        return enroll_order(
+            client, record, index=index, suppress_print=suppress_print, journal=journal, validate=validate
+        )
+
+    return (result for result in bounded_map(run, enumerate(records), max_workers) if result is not None)
+
+
+# Result of cancelling one device. status is 'ok', 'invalid' (rejected by pre-flight validation) or 'cancel_failed';
+# cancel holds the (post_data, full_response, error_code, error_message, call_type) tuple of the call
+CancellationResult = collections.namedtuple('CancellationResult', ['index', 'record', 'status', 'cancel', 'exception'])
+
+
+def cancel_device(client, record, index=None, suppress_print=True, validate=True):
+    """
+    :usage: Cancels the enrollment of one device
+    :param client: AccClient used for the call
+    :param record: Cancellation record dict keyed by CANCEL_FIELDS
+    :param index: Position of the record in its batch (optional)
+    :param suppress_print: Suppress any print output from the API call (Default: True)
+    :param validate: Reject records failing validate_cancel without calling ACC (Default: True)
+    :return: CancellationResult
+    """
+    if validate:
+        errors = validate_cancel(record)
+        if errors:
+            return CancellationResult(
+                index, record, 'invalid', preflight_result(errors, 'cancel_order', suppress_print), None
+            )
+    try:
+        cancel = client.cancel_order(
+            suppress_print=suppress_print, **{field: record.get(field) or "" for field in CANCEL_FIELDS}
+        )
+    except requests.RequestException as e:
+        return CancellationResult(index, record, 'cancel_failed', None, e)
+    return CancellationResult(index, record, 'cancel_failed' if cancel[2] else 'ok', cancel, None)
+
+
+def cancel_devices(records, client=None, max_workers=8, suppress_print=True, validate=True):
+    """
+    :usage: Bulk cancellation. Runs cancel_order for each cancellation record with at most max_workers records in
+            flight, streaming results back as each one finishes.
+    :param records: Iterable of cancellation record dicts keyed by CANCEL_FIELDS, e.g. from read_records()
+    :param client: AccClient to use (Default: the default client). Its pool_maxsize should be at least max_workers
+    :param max_workers: Number of cancellations processed concurrently (Default: 8)
+    :param suppress_print: Suppress any print output from the API calls (Default: True)
+    :param validate: Reject records failing validate_cancel, with status 'invalid', without calling ACC
+                     (Default: True)
+    :return: Generator of CancellationResult in completion order; index gives the position in records
+    """
+    client = client or default_client()
+
+    def run(indexed_record):
+        index, record = indexed_record
+        return cancel_device(client, record, index=index, suppress_print=suppress_print, validate=validate)
+
+    return bounded_map(run, enumerate(records), max_workers)
+
+
+def result_row(result):
+    """
+    :param result: EnrollmentResult or CancellationResult
+    :return: Flat dict summarizing the result, for writing to CSV/JSONL
+    """
+    if isinstance(result, CancellationResult):
+        last_call = result.cancel
+    else:
+        last_call = result.create or result.verify
+    if result.exception is not None:
+        error_code, error_message = 'ACC_ERR_0002', str(result.exception)
+    elif last_call is not None:
+        error_code, error_message = last_call[2], last_call[3]
+    else:
+        error_code, error_message = [], []
+    return dict(
+        index=result.index, invoice_number=result.record.get('invoice_number'),
+        device_id=result.record.get('device_id'), status=result.status, error_code=error_code,
+        error_message=error_message
+    )
+
+
+#######################################################################################################################
+# Sharded Runs
+#######################################################################################################################
+
+# (AccClient, EnrollmentJournal or None) of a run_sharded() worker process, or the exception raised building them
+_shard_worker = None
+
+
+def _shard_worker_init(client_settings, journal_path):
+    """
+    :usage: Worker process initializer of run_sharded(). Errors are kept and raised by the first chunk, as a failing
+            Pool initializer would only make the pool restart the worker forever.
+    :param client_settings: AccClient keyword arguments, or None to build the client from the environment
+    :param journal_path: EnrollmentJournal file, or None
+    """
+    global _shard_worker
+    client_settings = dict(client_settings)
+    try:
+        if 'ship_to' in client_settings:
+            client = AccClient(**client_settings)
+        else:
+            client = AccClient.from_env(**client_settings)
+        _shard_worker = client, EnrollmentJournal(journal_path) if journal_path else None
+    except Exception as e:
+        _shard_worker = e
+
+
+def _shard_run(task):
+    """
+    :usage: Runs one chunk of a run_sharded() batch in a worker process
+    :param task: (operation, list of (index, record), max_workers, validate)
+    :return: List of result_row() dicts ordered by index
+    """
+    if isinstance(_shard_worker, Exception):
+        raise _shard_worker
+    client, journal = _shard_worker
+    operation, chunk, max_workers, validate = task
+
+    if operation == 'enroll':
+        def run(indexed_record):
+            return enroll_order(client, indexed_record[1], index=indexed_record[0], journal=journal, validate=validate)
+    else:
+        def run(indexed_record):
+            return cancel_device(client, indexed_record[1], index=indexed_record[0], validate=validate)
+
+    rows = [result_row(result) for result in bounded_map(run, chunk, max_workers) if result is not None]
+    rows.sort(key=lambda row: row['index'])
+    return rows
+
+
+def run_sharded(records, operation='enroll', processes=None, max_workers=8, chunk_size=100, rate_limiter=None,
+                client_settings=None, journal=None, validate=True):
+    """
+    :usage: Runs a large enrollment or cancellation batch on several worker processes, for batches a single process
+            cannot keep up with: each worker has its own AccClient and connection pool, so JSON and TLS work scale
+            with the number of processes, while a SharedRateLimiter keeps their combined call rate within ACC's limits.
+            Records are handed out in chunks with at most 2 * processes chunks in flight, so large inputs are never
+            read into memory all at once, and results come back in input order.
+    :param records: Iterable of order records ('enroll') or cancellation records keyed by CANCEL_FIELDS ('cancel'),
+                    e.g. from read_records()
+    :param operation: 'enroll' to run enroll_order, 'cancel' to run cancel_device for each record (Default: 'enroll')
+    :param processes: Number of worker processes (Default: os.cpu_count())
+    :param max_workers: Records in flight in each worker process (Default: 8)
+    :param chunk_size: Records per chunk handed to a worker (Default: 100)
+    :param rate_limiter: SharedRateLimiter applied to the calls of all workers (Default: None, no rate limit)
+    :param client_settings: Dict of AccClient keyword arguments for the workers' clients, e.g. ship_to, env, cert,
+                            private_key and transport. Without ship_to the clients are built with
+                            AccClient.from_env(**client_settings) (Default: None, AccClient.from_env())
+    :param journal: Path of an EnrollmentJournal file shared by the workers, for 'enroll' (optional). As with
+                    enroll_orders(), records already created are skipped when a run is resumed
+    :param validate: Reject records failing pre-flight validation, with status 'invalid', without calling ACC
+                     (Default: True)
+    :return: Generator of result_row() dicts in input order
+    """
+    if operation not in ('enroll', 'cancel'):
+        raise ValueError("Unknown operation {0!r}, expected 'enroll' or 'cancel'".format(operation))
+    processes = processes or os.cpu_count() or 1
+    settings = dict(client_settings or {})
+    settings.setdefault('pool_maxsize', max_workers)
+    settings['rate_limiter'] = rate_limiter
+    start_method = rate_limiter.start_method if isinstance(rate_limiter, SharedRateLimiter) else None
+
+    pool = multiprocessing.get_context(start_method).Pool(
+        processes, initializer=_shard_worker_init, initargs=(settings, journal)
+    )
+    indexed_records = enumerate(records)
+    chunks = iter(lambda: list(itertools.islice(indexed_records, chunk_size)), [])
+    completed = False
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_shard_run, ((operation, chunk, max_workers, validate),)))
+            if len(pending) >= processes * 2:
+                for row in pending.popleft().get():
+                    yield row
+        while pending:
+            for row in pending.popleft().get():
+                yield row
+        completed = True
+    finally:
+        if completed:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+
+#######################################################################################################################
+# Reconciliation
+#######################################################################################################################
+
+# Columns projected from each three_sixty_lookup response by reconcile_devices(), as column name -> response key. Keys
+# are looked up in the part of the response describing the device first, then anywhere in the response.
+RECONCILE_FIELDS = collections.OrderedDict([
+    ('purchase_order_number', 'purchaseOrderNumber'),
+    ('agreement_number', 'agreementNumber'),
+    ('coverage_status', 'coverageStatus'),
+    ('enrollment_date', 'enrollmentDate'),
+    ('coverage_end_date', 'coverageEndDate'),
+])
+
+
+def read_serials(path):
+    """
+    :usage: Lazily reads device serials from a text file (one per line), a CSV file with a device_id column, or a JSONL
+            file of records with a device_id field
+    :param path: Path to the file. '-' reads one serial per line from stdin
+    :return: Generator of serial numbers
+    """
+    if path.lower().endswith(('.csv', '.jsonl', '.json')):
+        for record in read_records(path):
+            if record.get('device_id'):
+                yield record['device_id'].strip()
+        return
+
+    lines = sys.stdin if path == '-' else open(path)
+    try:
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield line
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+
+def ordered_bounded_map(func, items, window):
+    """
+    :usage: Like bounded_map(), but yields results in input order. At most 2 * window items are in flight, so memory
+            stays flat however long items is.
+    :param func: Function called with each item
+    :param items: Iterable of items, consumed lazily
+    :param window: Number of worker threads
+    :return: Generator of func results in input order
+    """
+    with futures.ThreadPoolExecutor(max_workers=window) as executor:
+        pending = collections.deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _device_node(full_response, device_id):
+    """
+    :return: First object in the response whose deviceId is device_id, or the whole response
+    """
+    stack = [full_response]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if str(node.get('deviceId', "")).upper() == device_id:
+                return node
+            stack.extend(value for value in node.values() if isinstance(value, (dict, list)))
+        elif isinstance(node, list):
+            stack.extend(node)
+    return full_response
+
+
+def project_lookup(device_id, result, fields=RECONCILE_FIELDS):
+    """
+    :param device_id: Serial number that was looked up
+    :param result: three_sixty_lookup return values
+    :param fields: Dict of column name -> response key (Default: RECONCILE_FIELDS)
+    :return: Flat row dict with device_id, status ('ok' or 'error'), error_code, error_message and the fields
+    """
+    full_response, error_code, error_message = result[1], result[2], result[3]
+    row = collections.OrderedDict(device_id=device_id)
+    if isinstance(error_code, list):
+        row['status'] = 'error' if error_code else 'ok'
+        row['error_code'] = ';'.join(str(code) for code in error_code)
+        row['error_message'] = ';'.join(str(message) for message in error_message)
+    else:
+        row['status'] = 'error'
+        row['error_code'] = error_code
+        row['error_message'] = error_message
+    node = _device_node(full_response, device_id.upper()) if row['status'] == 'ok' else None
+    for column, key in fields.items():
+        value = None
+        if node is not None:
+            value = next(find_values(node, key), None)
+            if value is None and node is not full_response:
+                value = next(find_values(full_response, key), None)
+        row[column] = value
+    return row
+
+
+def reconcile_devices(serials, client=None, window=16, fields=RECONCILE_FIELDS, suppress_print=True):
+    """
+    :usage: Streaming reconciliation. Runs three_sixty_lookup for each serial with at most 2 * window lookups in
+            flight and projects each response down to a flat row as soon as it arrives, so memory use does not grow
+            with the number of devices.
+    :param serials: Iterable of device serials, e.g. from read_serials(), consumed lazily
+    :param client: AccClient to use (Default: the default client). Its pool_maxsize should be at least window
+    :param window: Number of concurrent lookups (Default: 16)
+    :param fields: Dict of column name -> response key to project (Default: RECONCILE_FIELDS)
+    :param suppress_print: Suppress any print output from the API calls (Default: True)
+    :return: Generator of row dicts (see project_lookup()) in input order
+    """
+    client = client or default_client()
+
+    def run(device_id):
+        try:
+            result = client.three_sixty_lookup("", device_id, "", suppress_print=suppress_print)
+        except requests.RequestException as e:
+            result = (None, None, 'ACC_ERR_0002', str(e), 'three_sixty_lookup')
+        return project_lookup(device_id, result, fields)
+
+    return ordered_bounded_map(run, serials, window)
+
+
+def write_rows(rows, output, output_format='jsonl', flush_every=100):
+    """
+    :usage: Writes rows to a file object incrementally as CSV or JSONL
+    :param rows: Iterable of row dicts, all with the same keys
+    :param output: Writable text file object
+    :param output_format: 'csv' or 'jsonl' (Default: 'jsonl')
+    :param flush_every: Rows between flushes (Default: 100)
+    :return: Number of rows written
+    """
+    writer = None
+    count = 0
+    for row in rows:
+        if output_format == 'csv':
+            if writer is None:
+                writer = csv.DictWriter(output, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow(row)
+        else:
+            output.write(json.dumps(row) + '\n')
+        count += 1
+        if count % flush_every == 0:
+            output.flush()
+    output.flush()
+    return count
+
+
+#######################################################################################################################
+# Proof of Coverage
+#######################################################################################################################
+
+# Response key holding the base64 encoded POC document, in get-poc-content and consolidated-poc responses
+POC_CONTENT_KEY = 'pocContent'
+
+# Result of downloading one device's POC. path is None and bytes 0 when no document was written; error_code and
+# error_message are those of the poc_content call, exception is set if it raised.
+PocResult = collections.namedtuple(
+    'PocResult', ['device_id', 'path', 'bytes', 'error_code', 'error_message', 'exception']
+)
+
+_STRING_SPECIAL = re.compile(rb'["\\]')
+
+# Characters a JSON escape in the POC content may stand for: base64 characters are decoded, line breaks dropped
+_BASE64_CHARACTERS = frozenset(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=')
+_LINE_BREAK_CHARACTERS = frozenset(b'\r\n\t ')
+_HEX_DIGITS = re.compile(rb'[0-9A-Fa-f]{4}')
+
+
+class PocDecodeError(ValueError):
+    """
+    :usage: Raised by PocStreamDecoder when the POC content is not valid base64
+    """
+
+
+class PocStreamDecoder(object):
+    """
+    :usage: Incremental scanner for a JSON response carrying a base64 encoded POC document. Fed the response in
+            chunks, it base64 decodes the value of the first POC_CONTENT_KEY straight into sink, and keeps the rest of
+            the response (with that value left empty) to be parsed once the response is complete. Memory use is
+            bounded by the chunk size plus the size of the response without the document.
+    """
+
+    def __init__(self, sink, key=POC_CONTENT_KEY):
+        """
+        :param sink: Binary file-like object the decoded document is written to
+        :param key: Response key holding the document (Default: POC_CONTENT_KEY)
+        """
+        self.sink = sink
+        self.key = key.encode()
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._skeleton = bytearray()
+        self._in_string = False
+        self._string = None  # Current string while it could still be the key, else None
+        self._escape = False
+        self._unicode = None  # Hex digits of a \\uXXXX escape in the document, while they are being read
+        self._key_pending = False  # The last string was the key, waiting for ':' and the value
+        self._between = bytearray()
+        self._capturing = False
+        self._captured = False
+        self._remainder = b''
+
+    def feed(self, chunk):
+        """
+        :param chunk: Next bytes of the response
+        """
+        self.bytes_read += len(chunk)
+        position = 0
+        end = len(chunk)
+        while position < end:
+            if self._unicode is not None:
+                digits = chunk[position:position + 4 - len(self._unicode)]
+                self._unicode += digits
+                position += len(digits)
+                if len(self._unicode) == 4:
+                    self._decode(self._unescape(self._unicode))
+                    self._unicode = None
+            elif self._escape:
+                self._escape = False
+                if self._capturing:
+                    escape = chunk[position]
+                    if escape == 0x75:  # \uXXXX, e.g. '=' escaped as \u003d; the digits may span chunks
+                        self._unicode = bytearray()
+                    elif escape == 0x2f:  # Escaped '/'
+                        self._decode(b'/')
+                    elif escape not in b'nrt':  # Escaped line breaks are dropped, anything else is not base64
+                        raise PocDecodeError("Invalid escape '\\{0}' in POC content".format(chr(escape)))
+                else:
+                    self._skeleton += chunk[position:position + 1]
+                    self._string = None
+                position += 1
+            elif self._capturing or self._in_string:
+                match = _STRING_SPECIAL.search(chunk, position)
+                stop = match.start() if match else end
+                if self._capturing:
+                    self._decode(chunk[position:stop])
+                else:
+                    self._skeleton += chunk[position:stop]
+                    if self._string is not None:
+                        self._string += chunk[position:stop]
+                        if len(self._string) > len(self.key):
+                            self._string = None
+                position = stop
+                if match is None:
+                    continue
+                if chunk[stop] == 0x22:  # Closing quote
+                    if self._capturing:
+                        self._finish_decode()
+                    else:
+                        self._key_pending = not self._captured and self._string == self.key
+                        self._between = bytearray()
+                    self._capturing = self._in_string = False
+                    self._skeleton += b'"'
+                else:
+                    self._escape = True
+                    if not self._capturing:
+                        self._skeleton += b'\\'
+                position += 1
+            else:
+                stop = chunk.find(b'"', position)
+                if stop < 0:
+                    stop = end
+                self._skeleton += chunk[position:stop]
+                if self._key_pending:
+                    self._between += chunk[position:stop]
+                    if len(self._between) > 64:
+                        self._key_pending = False
+                position = stop
+                if stop == end:
+                    continue
+                if self._key_pending and self._between.strip() == b':':
+                    self._capturing = True
+                else:
+                    self._in_string = True
+                    self._string = bytearray()
+                self._key_pending = False
+                self._skeleton += b'"'
+                position += 1
+
+    @staticmethod
+    def _unescape(digits):
+        """
+        :param digits: The 4 hex digits of a \\uXXXX escape in the document
+        :return: The base64 character it stands for, or b'' for a line break
+        """
+        if _HEX_DIGITS.fullmatch(digits) is None:
+            raise PocDecodeError("Invalid escape '\\u{0}' in POC content".format(digits.decode('ascii', 'replace')))
+        code = int(digits, 16)
+        if code in _BASE64_CHARACTERS:
+            return bytes((code,))
+        if code in _LINE_BREAK_CHARACTERS:
+            return b''
+        raise PocDecodeError("Escaped character U+{0:04X} in POC content is not base64".format(code))
+
+    def _decode(self, data):
+        """
+        :param data: Next base64 characters of the document
+        """
+        data = self._remainder + data
+        cut = len(data) & ~3
+        if cut:
+            self._write(self._a2b(data[:cut]))
+        self._remainder = data[cut:]
+
+    def _finish_decode(self):
+        if self._remainder:
+            self._write(self._a2b(self._remainder + b'=' * (-len(self._remainder) % 4)))
+            self._remainder = b''
+        self._captured = True
+
+    @staticmethod
+    def _a2b(data):
+        try:
+            return binascii.a2b_base64(data)
+        except binascii.Error as e:
+            raise PocDecodeError("POC content is not valid base64: {0}".format(e)) from e
+
+    def _write(self, data):
+        self.sink.write(data)
+        self.bytes_written += len(data)
+
+    def close(self):
+        """
+        :return: The response without the document, as text for response_handler()
+        """
+        return self._skeleton.decode('utf-8', 'replace')
+
+
+def poc_path(directory, device_id, extension='.pdf'):
+    """
+    :param directory: Directory POCs are written to
+    :param device_id: Serial number of the device
+    :param extension: File extension (Default: .pdf)
+    :return: Path of the device's POC file
+    :raises ValueError: If device_id is not a serial number, IMEI or MEID, e.g. a path such as '../x'
+    """
+    device_id = device_id.upper()
+    if SERIAL_PATTERN.fullmatch(device_id) is None:
+        raise ValueError("device_id {0!r} is not a serial number, IMEI or MEID".format(device_id))
+    return os.path.join(directory, device_id + extension)
+
+
+def download_pocs(device_ids, directory, client=None, max_workers=8, poc_language="ENG", suppress_print=True):
+    """
+    :usage: Streams the POC of every device to its own file in directory, over a thread pool. Each document is decoded
+            to disk as it arrives, so memory use does not grow with document size or the number of devices.
+    :param device_ids: Iterable of serial numbers, consumed lazily
+    :param directory: Directory to write <device_id>.pdf files to; created if missing
+    :param client: AccClient to use (Default: the default client from the ACC_* environment variables)
+    :param max_workers: Number of concurrent downloads (Default: 8)
+    :param poc_language: Language of the POC documents (Default: ENG)
+    :param suppress_print: Suppress any print output from function (Default: True)
+    :return: Generator of PocResult in completion order. Device IDs that are not serial numbers, and repeats of a
+             device ID, are not downloaded and get error code ACC_ERR_0003.
+    """
+    client = client or default_client()
+    os.makedirs(directory, exist_ok=True)
+    seen = set()
+    seen_lock = threading.Lock()
+
+    def download(device_id):
+        try:
+            path = poc_path(directory, device_id)
+        except ValueError as e:
+            return PocResult(device_id, None, 0, [PREFLIGHT_ERROR_CODE], [str(e)], None)
+        with seen_lock:
+            duplicate = path in seen
+            seen.add(path)
+        if duplicate:
+            # A second download would write the same file
+            message = "device_id {0!r} is a duplicate".format(device_id)
+            return PocResult(device_id, None, 0, [PREFLIGHT_ERROR_CODE], [message], None)
+        try:
+            _, _, error_code, error_message, _ = client.poc_content(
+                device_id, poc_language, sink=path, suppress_print=suppress_print
+            )
+        except (requests.RequestException, OSError, ValueError) as e:
+            return PocResult(device_id, None, 0, [], [], e)
+        if error_code:
+            return PocResult(device_id, None, 0, error_code, error_message, None)
+        return PocResult(device_id, path, os.path.getsize(path), error_code, error_message, None)
+
+    return bounded_map(download, device_ids, max_workers)
+
+
+#######################################################################################################################
+# Command Line
+#######################################################################################################################
+
+def _open_output(path):
+    """
+    :param path: Output file path, or '-' or None for stdout
+    :return: Writable text file object
+    """
+    if path in (None, '-'):
+        return sys.stdout
+    return open(path, 'w', newline='')
+
+
+def _rate_limiter(args):
+    """
+    :return: RateLimiter for the --rate option (a SharedRateLimiter with --processes), or None without --rate
+    """
+    if not args.rate:
+        return None
+    if args.processes > 1:
+        return SharedRateLimiter({}, default_rate=args.rate)
+    return RateLimiter({}, default_rate=args.rate)
+
+
+def _sharded_command(args, operation):
+    """
+    :usage: Command line handler for `acc.py enroll` and `acc.py cancel` with --processes
+    :return: Process exit code, 1 if any record failed
+    """
+    records = read_records(args.input, Order if operation == 'enroll' else Cancellation)
+    output = _open_output(args.output)
+    failed = 0
+    try:
+        for row in run_sharded(records, operation, processes=args.processes, max_workers=args.workers,
+                               rate_limiter=_rate_limiter(args), journal=getattr(args, 'journal', None)):
+            if row['status'] != 'ok':
+                failed += 1
+            output.write(json.dumps(row) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failed else 0
+
+
+def _enroll_command(args):
+    """
+    :usage: Command line handler for `acc.py enroll`
+    :return: Process exit code, 1 if any record failed
+    """
+    if args.processes > 1:
+        return _sharded_command(args, 'enroll')
+    client = AccClient.from_env(pool_maxsize=args.workers, rate_limiter=_rate_limiter(args))
+    journal = EnrollmentJournal(args.journal) if args.journal else None
+    output = _open_output(args.output)
+    failed = 0
+    try:
+        for result in enroll_orders(read_records(args.input, Order), client=client, max_workers=args.workers,
+                                    journal=journal):
+            if result.status != 'ok':
+                failed += 1
+            output.write(json.dumps(result_row(result)) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if journal is not None:
+            journal.close()
+        client.close()
+    return 1 if failed else 0
+
+
+def _cancel_command(args):
+    """
+    :usage: Command line handler for `acc.py cancel`
+    :return: Process exit code, 1 if any record failed
+    """
+    if args.processes > 1:
+        return _sharded_command(args, 'cancel')
+    client = AccClient.from_env(pool_maxsize=args.workers, rate_limiter=_rate_limiter(args))
+    output = _open_output(args.output)
+    failed = 0
+    try:
+        for result in cancel_devices(read_records(args.input, Cancellation), client=client, max_workers=args.workers):
+            if result.status != 'ok':
+                failed += 1
+            output.write(json.dumps(result_row(result)) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        client.close()
+    return 1 if failed else 0
+
+
+def _reconcile_command(args):
+    """
+    :usage: Command line handler for `acc.py reconcile`
+    :return: Process exit code
+    """
+    client = AccClient.from_env(pool_maxsize=args.window)
+    output = _open_output(args.output)
+    output_format = args.format or ('csv' if (args.output or "").lower().endswith('.csv') else 'jsonl')
+    try:
+        rows = reconcile_devices(read_serials(args.input), client=client, window=args.window)
+        write_rows(rows, output, output_format)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        client.close()
+    return 0
+
+
+def _poc_command(args):
+    """
+    :usage: Command line handler for `acc.py poc`
+    :return: Process exit code, 1 if any POC could not be downloaded
+    """
+    client = AccClient.from_env(pool_maxsize=args.workers)
+    output = _open_output(args.output)
+    failed = 0
+    try:
+        for result in download_pocs(read_serials(args.input), args.directory, client=client,
+                                    max_workers=args.workers, poc_language=args.language):
+            if result.path is None:
+                failed += 1
+            row = result._asdict()
+            row['exception'] = str(result.exception) if result.exception is not None else None
+            output.write(json.dumps(row) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        client.close()
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    """
+    :usage: Command line entry point. Connection details are read from the ACC_* environment variables.
+    :param argv: Command line arguments (Default: sys.argv[1:])
+    :return: Process exit code
+    """
+    parser = argparse.ArgumentParser(prog='acc.py', description='AppleCare Connect API tools')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    enroll_parser = subparsers.add_parser('enroll', help='Verify and create orders from a CSV/JSONL file')
+    enroll_parser.add_argument('input', help='CSV (with header row) or JSONL file of order records, or - for stdin')
+    enroll_parser.add_argument('-o', '--output', help='JSONL results file (Default: stdout)')
+    enroll_parser.add_argument('-w', '--workers', type=int, default=8, help='Concurrent orders (Default: 8)')
+    enroll_parser.add_argument('-j', '--journal', help='sqlite journal file; re-run with the same journal to resume')
+    enroll_parser.set_defaults(handler=_enroll_command)
+
+    cancel_parser = subparsers.add_parser('cancel', help='Cancel the enrollment of devices from a CSV/JSONL file')
+    cancel_parser.add_argument('input', help='CSV (with header row) or JSONL file of cancellation records, or -')
+    cancel_parser.add_argument('-o', '--output', help='JSONL results file (Default: stdout)')
+    cancel_parser.add_argument('-w', '--workers', type=int, default=8, help='Concurrent cancellations (Default: 8)')
+    cancel_parser.set_defaults(handler=_cancel_command)
+
+    for batch_parser in (enroll_parser, cancel_parser):
+        batch_parser.add_argument('-p', '--processes', type=int, default=1,
+                                  help='Worker processes, each running --workers records; results are written in '
+                                       'input order (Default: 1)')
+        batch_parser.add_argument('-r', '--rate', type=float,
+                                  help='Maximum calls per second to each endpoint, across all processes')
+
+    reconcile_parser = subparsers.add_parser('reconcile', help='Look up a list of devices and write a flat report')
+    reconcile_parser.add_argument('input', help='Text file of serials (one per line), CSV/JSONL with device_id, or -')
+    reconcile_parser.add_argument('-o', '--output', help='CSV or JSONL report file (Default: stdout)')
+    reconcile_parser.add_argument('-f', '--format', choices=('csv', 'jsonl'), help='Report format (Default: from -o)')
+    reconcile_parser.add_argument('-w', '--window', type=int, default=16, help='Concurrent lookups (Default: 16)')
+    reconcile_parser.set_defaults(handler=_reconcile_command)
 
-    # Prepare the post_data for the API
-    full_request = json.dumps(post_data)
+    poc_parser = subparsers.add_parser('poc', help='Download the POC document of a list of devices')
+    poc_parser.add_argument('input', help='Text file of serials (one per line), CSV/JSONL with device_id, or -')
+    poc_parser.add_argument('-d', '--directory', default='.', help='Directory for <serial>.pdf files (Default: .)')
+    poc_parser.add_argument('-o', '--output', help='JSONL results file (Default: stdout)')
+    poc_parser.add_argument('-w', '--workers', type=int, default=8, help='Concurrent downloads (Default: 8)')
+    poc_parser.add_argument('-l', '--language', default='ENG', help='POC language (Default: ENG)')
+    poc_parser.set_defaults(handler=_poc_command)
 
-    # Send data to API
-    response = session.post(post_url, data=full_request)
+    args = parser.parse_args(argv)
+    return args.handler(args)
 
-    # Call return handler function to parse request response
-    full_response, error_code, error_message = response_handler(response.text, suppress_print)
 
-    return post_data, full_response, error_code, error_message, call_type
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+#######################################################################################################################
+#
+#  acc.py Benchmarks
+#
+# Overview
+# Measures calls per second and p50/p99 latency of acc.py against a local mock ACC server (mock_acc_server.py) running
+# in a separate process, for sequential, threaded, asyncio and batch enrollment usage, plus response parsing on its
+# own. 'sequential_new_client' builds a client per call, like acc.py did before AccClient, to show the gain from
+# connection reuse. --transport runs the client scenarios once per acc.py transport, e.g. 'requests,http2' to compare
+# HTTP/1.1 connection pooling with HTTP/2 multiplexing on the same workload. 'sharded' runs the batch enrollment on
+# --processes worker processes with run_sharded().
+#
+# Usage
+# python benchmarks/bench_acc.py --calls 500 --workers 16 --latency 0.005
+# python benchmarks/bench_acc.py --scenarios sequential,threaded --json bench_output.json
+# python benchmarks/bench_acc.py --scenarios threaded,async --transport requests,http2
+# python benchmarks/bench_acc.py --scenarios batch,sharded --calls 4000 --processes 4
+#######################################################################################################################
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import acc  # noqa: E402
+import mock_acc_server  # noqa: E402
+
+SHIP_TO = '0000123456'
+CERT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.certs')
+
+
+def percentile(sorted_values, fraction):
+    """
+    :param sorted_values: Sorted list of numbers
+    :param fraction: Percentile as a fraction, e.g. 0.99
+    :return: Value at the percentile (nearest rank)
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[int(round(fraction * (len(sorted_values) - 1)))]
+
+
+def summarize(scenario, latencies, elapsed, calls_per_item=1):
+    """
+    :param scenario: Scenario name
+    :param latencies: Per item latencies in seconds
+    :param elapsed: Wall clock seconds for the whole scenario
+    :param calls_per_item: API calls made per item (2 for batch enrollment)
+    :return: Result dict
+    """
+    latencies = sorted(latencies)
+    calls = len(latencies) * calls_per_item
+    return dict(
+        scenario=scenario, calls=calls, seconds=round(elapsed, 3), calls_per_second=round(calls / elapsed, 1),
+        p50_ms=round(percentile(latencies, 0.50) * 1000, 2), p99_ms=round(percentile(latencies, 0.99) * 1000, 2)
+    )
+
+
+def timed(func, *args, **kwargs):
+    """
+    :return: Seconds taken by func(*args, **kwargs)
+    """
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def lookup(client, index):
+    return client.three_sixty_lookup('', 'C02BENCH{0:04d}'.format(index), '', suppress_print=True)
+
+
+def order_record(index):
+    return dict(
+        invoice_number='BENCH{0:06d}'.format(index), first_name='Bench', last_name='Customer',
+        email_address='bench@example.com', device_id='C02BENCH{0:04d}'.format(index), purchase_date='01/02/20'
+    )
+
+
+def bench_sequential_new_client(options, client_kwargs):
+    calls = min(options.calls, 100)
+    latencies = []
+    start = time.perf_counter()
+    for index in range(calls):
+        call_start = time.perf_counter()
+        with acc.AccClient(transport=options.transport, **client_kwargs) as client:
+            lookup(client, index)
+        latencies.append(time.perf_counter() - call_start)
+    return summarize('sequential_new_client', latencies, time.perf_counter() - start)
+
+
+def bench_sequential(options, client_kwargs):
+    with acc.AccClient(transport=options.transport, **client_kwargs) as client:
+        lookup(client, -1)  # Warm up the connection pool
+        start = time.perf_counter()
+        latencies = [timed(lookup, client, index) for index in range(options.calls)]
+        return summarize('sequential', latencies, time.perf_counter() - start)
+
+
+def bench_threaded(options, client_kwargs):
+    with acc.AccClient(pool_maxsize=options.workers, transport=options.transport, **client_kwargs) as client:
+        with ThreadPoolExecutor(max_workers=options.workers) as executor:
+            list(executor.map(lambda index: lookup(client, index), range(options.workers)))  # Warm up
+            start = time.perf_counter()
+            latencies = list(executor.map(lambda index: timed(lookup, client, index), range(options.calls)))
+            return summarize('threaded', latencies, time.perf_counter() - start)
+
+
+def bench_async(options, client_kwargs):
+    if acc.httpx is None:
+        return None
+
+    async def run():
+        http2 = options.transport == 'http2'
+        async with acc.AsyncAccClient(max_in_flight=options.workers, http2=http2, **client_kwargs) as client:
+            # Queue the calls here rather than in the client, so latency excludes time spent waiting for a slot, as
+            # in the threaded scenario
+            slots = asyncio.Semaphore(options.workers)
+
+            async def timed_lookup(index):
+                async with slots:
+                    start = time.perf_counter()
+                    await client.three_sixty_lookup('', 'C02BENCH{0:04d}'.format(index), '', suppress_print=True)
+                    return time.perf_counter() - start
+
+            await asyncio.gather(*[timed_lookup(index) for index in range(options.workers)])  # Warm up
+            start = time.perf_counter()
+            latencies = await asyncio.gather(*[timed_lookup(index) for index in range(options.calls)])
+            return summarize('async', latencies, time.perf_counter() - start)
+
+    return asyncio.run(run())
+
+
+def bench_batch(options, client_kwargs):
+    with acc.AccClient(pool_maxsize=options.workers, transport=options.transport, **client_kwargs) as client:
+        records = (order_record(index) for index in range(options.calls // 2))
+        latencies = []
+        start = time.perf_counter()
+        last = start
+        for result in acc.enroll_orders(records, client=client, max_workers=options.workers):
+            now = time.perf_counter()
+            latencies.append(now - last)
+            last = now
+        # Latency here is the gap between completed records, as enroll_orders streams results
+        return summarize('batch_enroll', latencies, time.perf_counter() - start, calls_per_item=2)
+
+
+def bench_sharded(options, client_kwargs):
+    settings = dict(client_kwargs, transport=options.transport)
+    records = (order_record(index) for index in range(options.calls // 2))
+    latencies = []
+    start = time.perf_counter()
+    last = start
+    for _ in acc.run_sharded(records, processes=options.processes, max_workers=options.workers,
+                             chunk_size=max(1, options.workers * 4), client_settings=settings):
+        now = time.perf_counter()
+        latencies.append(now - last)
+        last = now
+    # Includes starting the worker processes; latency is the gap between results, as for batch_enroll
+    return summarize('sharded_enroll_{0}p'.format(options.processes), latencies, time.perf_counter() - start,
+                     calls_per_item=2)
+
+
+def bench_parse(options, client_kwargs):
+    request = json.loads(json.dumps(acc.lookup_post_data(SHIP_TO, '', 'C02BENCH0001', '')))
+    body = json.dumps(mock_acc_server.success_body('get-order', request, options.lookup_devices))
+    latencies = [timed(acc.parse_response, body) for _ in range(options.calls * 10)]
+    return summarize('parse_lookup_{0}_devices'.format(options.lookup_devices), latencies, sum(latencies))
+
+
+SCENARIOS = dict(
+    sequential_new_client=bench_sequential_new_client, sequential=bench_sequential, threaded=bench_threaded,
+    async_=bench_async, batch=bench_batch, sharded=bench_sharded, parse=bench_parse
+)
+
+
+def start_mock_server(options):
+    """
+    :return: (mock server process, base_url)
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=mock_acc_server.serve_in_process, args=(CERT_DIR, ready),
+        kwargs=dict(latency=options.latency, error_rate=options.error_rate, lookup_devices=options.lookup_devices),
+        daemon=True
+    )
+    process.start()
+    return process, ready.get(timeout=60)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark acc.py against a local mock ACC server')
+    parser.add_argument('--calls', type=int, default=500, help='API calls per scenario (Default: 500)')
+    parser.add_argument('--workers', type=int, default=16, help='Concurrency for threaded/async/batch (Default: 16)')
+    parser.add_argument('--latency', type=float, default=0.005, help='Mock server latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Mock server error injection rate')
+    parser.add_argument('--lookup-devices', type=int, default=50, help='Device records per get-order response')
+    parser.add_argument('--scenarios', default=','.join(name.rstrip('_') for name in SCENARIOS))
+    parser.add_argument('--processes', type=int, default=4, help='Worker processes for sharded (Default: 4)')
+    parser.add_argument('--transport', default='requests',
+                        help="Comma separated acc.py transports to run the scenarios with (Default: requests)")
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    options = parser.parse_args(argv)
+
+    certs = mock_acc_server.make_certs(CERT_DIR)
+    process, base_url = start_mock_server(options)
+    client_kwargs = dict(
+        ship_to=SHIP_TO, env='UAT', cert=certs['client_cert'], private_key=certs['client_key'],
+        base_url=base_url, verify=certs['ca_cert']
+    )
+
+    results = []
+    try:
+        print('{0:<28} {1:>9} {2:>7} {3:>10} {4:>9} {5:>9}'.format(
+            'scenario', 'transport', 'calls', 'calls/s', 'p50 ms', 'p99 ms'))
+        transports = options.transport.split(',')
+        for transport in transports:
+            options.transport = transport
+            for name in options.scenarios.split(','):
+                if name == 'parse' and transport != transports[0]:
+                    continue  # No network involved
+                scenario = SCENARIOS.get(name) or SCENARIOS[name + '_']
+                result = scenario(options, client_kwargs)
+                if result is None:
+                    print('{0:<28} {1:>9} skipped'.format(name, transport))
+                    continue
+                result['transport'] = transport
+                results.append(result)
+                print('{scenario:<28} {transport:>9} {calls:>7} {calls_per_second:>10} {p50_ms:>9} {p99_ms:>9}'.format(
+                    **result))
+    finally:
+        process.terminate()
+
+    if options.json:
+        with open(options.json, 'w') as output:
+            json.dump(results, output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
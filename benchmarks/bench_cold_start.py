@@ -0,0 +1,124 @@
+#######################################################################################################################
+#
+#  acc.py Cold Start Benchmark
+#
+# Overview
+# Measures what a short-lived process (cron job, POS hook, serverless handler) pays to make its first ACC call: the
+# time to import acc.py, and the time from there to the first three_sixty_lookup answer, which includes building the
+# client, the mutual-TLS handshake and the call itself. Every run is a fresh Python process talking to a local mock ACC
+# server (mock_acc_server.py) in another process. The import time and first call latency of the --check transport
+# are compared with targets, and the exit code is 1 if a median misses its target.
+#
+# Usage
+# python benchmarks/bench_cold_start.py --runs 20
+# python benchmarks/bench_cold_start.py --transports stdlib --max-import-ms 30 --max-first-call-ms 60
+#######################################################################################################################
+
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mock_acc_server  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CERT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.certs')
+SHIP_TO = '0000123456'
+
+# Run in each fresh process; prints the timings as JSON
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import acc
+imported = time.perf_counter()
+client = acc.AccClient({ship_to!r}, 'UAT', {cert!r}, {key!r}, base_url={base_url!r}, verify={ca!r},
+                       transport={transport!r})
+client.three_sixty_lookup('', 'C02BENCH0001', '', suppress_print=True)
+first = time.perf_counter()
+client.three_sixty_lookup('', 'C02BENCH0002', '', suppress_print=True)
+warm = time.perf_counter()
+print(json.dumps(dict(import_ms=(imported - start) * 1000, first_call_ms=(first - imported) * 1000,
+                      warm_call_ms=(warm - first) * 1000)))
+'''
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def run_once(transport, base_url, certs):
+    """
+    :return: Dict of import_ms, first_call_ms, warm_call_ms and process_ms (whole process, interpreter start included)
+    """
+    code = CHILD.format(
+        root=ROOT, ship_to=SHIP_TO, cert=certs['client_cert'], key=certs['client_key'], base_url=base_url,
+        ca=certs['ca_cert'], transport=transport
+    )
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE).stdout
+    result = json.loads(output)
+    result['process_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure acc.py import time and first call latency in new processes')
+    parser.add_argument('--runs', type=int, default=10, help='Processes per transport (Default: 10)')
+    parser.add_argument('--transports', default='stdlib,requests', help='Comma separated acc.py transports')
+    parser.add_argument('--latency', type=float, default=0.0, help='Mock server latency in seconds (Default: 0)')
+    parser.add_argument('--check', default='stdlib', help='Transport checked against the targets (Default: stdlib)')
+    parser.add_argument('--max-import-ms', type=float, default=50.0, help='Target median import time (Default: 50)')
+    parser.add_argument('--max-first-call-ms', type=float, default=100.0,
+                        help='Target median first call latency, after import (Default: 100)')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    options = parser.parse_args(argv)
+
+    certs = mock_acc_server.make_certs(CERT_DIR)
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=mock_acc_server.serve_in_process, args=(CERT_DIR, ready), kwargs=dict(latency=options.latency),
+        daemon=True
+    )
+    process.start()
+    base_url = ready.get(timeout=60)
+
+    results = []
+    try:
+        print('{0:<10} {1:>11} {2:>15} {3:>14} {4:>12}'.format(
+            'transport', 'import ms', 'first call ms', 'warm call ms', 'process ms'))
+        for transport in options.transports.split(','):
+            runs = [run_once(transport, base_url, certs) for _ in range(options.runs)]
+            result = dict(transport=transport, runs=len(runs))
+            for name in ('import_ms', 'first_call_ms', 'warm_call_ms', 'process_ms'):
+                result[name] = round(median([run[name] for run in runs]), 2)
+            results.append(result)
+            print('{transport:<10} {import_ms:>11} {first_call_ms:>15} {warm_call_ms:>14} {process_ms:>12}'.format(
+                **result))
+    finally:
+        process.terminate()
+
+    if options.json:
+        with open(options.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    failed = False
+    for result in results:
+        if result['transport'] != options.check:
+            continue
+        for name, target in (('import_ms', options.max_import_ms), ('first_call_ms', options.max_first_call_ms)):
+            status = 'ok' if result[name] <= target else 'MISSED'
+            failed = failed or status != 'ok'
+            print('target {0} {1} <= {2}: {3} ({4})'.format(options.check, name, target, status, result[name]))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
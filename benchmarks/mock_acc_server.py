@@ -0,0 +1,439 @@
+#######################################################################################################################
+#
+#  Mock AppleCare Connect Server
+#
+# Overview
+# A local HTTPS stand-in for the ACC order-service endpoints (verify-order, create-order, cancel-order, get-order,
+# get-poc-content, consolidated-poc), used by the benchmarks to measure acc.py without touching Apple's UAT. Clients
+# must present a certificate signed by the mock CA (mutual TLS), like the real service. Latency, jitter and error
+# injection are configurable, and every error envelope handled by acc.response_handler has a canned response. HTTP/2 is
+# offered as well when the 'h2' module is installed, so the acc.py 'http2' transport can be measured against the default
+# one.
+#
+# Usage
+# python benchmarks/mock_acc_server.py --port 8443 --latency 0.02 --error-rate 0.05
+#
+# A specific response can be forced per request with the 'X-Mock-Error' header, set to one of ERROR_KINDS.
+#######################################################################################################################
+
+import argparse
+import base64
+import json
+import os
+import random
+import socket
+import ssl
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    h2 = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import acc  # noqa: E402
+
+BASE_PATH = '/order-service/1.0'
+ENDPOINTS = ('verify-order', 'create-order', 'cancel-order', 'get-order', 'get-poc-content', 'consolidated-poc')
+
+
+def _error_body(path, name):
+    """
+    :param path: Key path of the error envelope, from acc.ERROR_ENVELOPES
+    :param name: Envelope name
+    :return: Response body with a single error at path
+    """
+    error = {'errorCode': 'MOCK_{0}'.format(name), 'errorMessage': 'Mock {0}'.format(name)}
+    if not path:
+        return error
+    body = error
+    for key in reversed(path):
+        body = {key: body}
+    return body
+
+
+# Canned error responses as name -> (HTTP status, extra headers, body text). Covers every acc.ERROR_ENVELOPES branch,
+# plus non-JSON bodies and throttling/server errors.
+CANNED_ERRORS = dict(
+    (name, (200, {}, json.dumps(_error_body(path, name)))) for name, path in acc.ERROR_ENVELOPES
+)
+CANNED_ERRORS['invalidJson'] = (200, {}, '<html><body>Service Unavailable</body></html>')
+CANNED_ERRORS['http429'] = (429, {'Retry-After': '0'}, '<html><body>Too Many Requests</body></html>')
+CANNED_ERRORS['http503'] = (503, {}, '<html><body>Service Unavailable</body></html>')
+ERROR_KINDS = tuple(sorted(CANNED_ERRORS))
+
+
+def poc_document(size):
+    """
+    :param size: Document size in bytes
+    :return: Fake PDF document of the given size
+    """
+    header = b'%PDF-1.4\n% Mock ACC proof of coverage\n'
+    body = bytes(range(256)) * (size // 256 + 1)
+    return (header + body)[:max(size, len(header))]
+
+
+def success_body(endpoint, request, lookup_devices=1, poc_size=65536):
+    """
+    :param endpoint: ACC order-service endpoint name
+    :param request: Decoded request body
+    :param lookup_devices: Number of device records in get-order responses
+    :param poc_size: Size in bytes of the (base64 encoded) document in POC responses
+    :return: Successful response body for the endpoint
+    """
+    device_id = request.get('deviceId') or request.get('deviceRequest', {}).get('deviceId') or 'C02MOCK0001'
+    purchase_order = request.get('purchaseOrderNumber') or 'MOCK-PO-0001'
+    if endpoint in ('get-poc-content', 'consolidated-poc'):
+        return {
+            'pocResponse': {
+                'deviceId': device_id if endpoint == 'get-poc-content' else '', 'purchaseOrderNumber': purchase_order,
+                'pocLanguage': request.get('pocLanguage') or 'ENG',
+                acc.POC_CONTENT_KEY: base64.b64encode(poc_document(poc_size)).decode()
+            }
+        }
+    if endpoint == 'get-order':
+        return {
+            'customerDetails': {
+                'customerFirstName': 'Mock', 'customerLastName': 'Customer',
+                'customerEmailId': request.get('customerEmailId') or 'mock@example.com'
+            },
+            'orderDetailsResponses': [
+                {
+                    'deviceId': device_id if index == 0 else '{0}{1:04d}'.format(device_id[:8], index),
+                    'purchaseOrderNumber': purchase_order,
+                    'agreementNumber': '{0:010d}'.format(index + 1),
+                    'coverageStatus': 'ACTIVE', 'enrollmentDate': '01/02/20', 'coverageEndDate': '01/02/23',
+                    'productDescription': 'AppleCare+ for MacBook Pro', 'pocLanguage': 'ENG'
+                } for index in range(lookup_devices)
+            ]
+        }
+    return {
+        'orderConfirmation': {
+            'deviceId': device_id, 'purchaseOrderNumber': purchase_order, 'agreementNumber': '0000000001',
+            'orderStatusCode': 'ORS', 'orderStatus': 'Order successful for {0}'.format(endpoint)
+        }
+    }
+
+
+class MockConfig(object):
+    """
+    :usage: Behaviour of the mock server
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_kinds=ERROR_KINDS, lookup_devices=1,
+                 poc_size=65536):
+        """
+        :param latency: Seconds added to every response (Default: 0.0)
+        :param jitter: Random extra seconds, uniformly up to this value (Default: 0.0)
+        :param error_rate: Fraction of requests answered with a random error from error_kinds (Default: 0.0)
+        :param error_kinds: Names from ERROR_KINDS used for injected errors (Default: all)
+        :param lookup_devices: Number of device records in get-order responses (Default: 1)
+        :param poc_size: Size in bytes of the document in POC responses (Default: 65536)
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_kinds = tuple(error_kinds)
+        self.lookup_devices = lookup_devices
+        self.poc_size = poc_size
+
+
+def dispatch(handler, path, error, raw_request):
+    """
+    :usage: Answers one request, over HTTP/1.1 or HTTP/2, applying the configured latency and error injection before
+            calling the endpoint handler
+    :param handler: MockAccHandler or MockH2Stream to answer with
+    :param path: Request path
+    :param error: Value of the X-Mock-Error header, if any
+    :param raw_request: Request body
+    """
+    server = handler.server
+    config = server.config
+    endpoint = path.rstrip('/').rsplit('/', 1)[-1]
+    if not path.startswith(BASE_PATH) or endpoint not in server.endpoints:
+        handler._send(404, {}, json.dumps({'errorCode': 'MOCK_404', 'errorMessage': 'Unknown endpoint'}))
+        return
+
+    delay = config.latency + (random.uniform(0, config.jitter) if config.jitter else 0.0)
+    if delay:
+        time.sleep(delay)
+
+    if error is None and config.error_rate and random.random() < config.error_rate:
+        error = random.choice(config.error_kinds)
+    if error:
+        status, headers, body = CANNED_ERRORS[error]
+        handler._send(status, headers, body)
+        return
+
+    try:
+        request = json.loads(raw_request or b'{}')
+    except ValueError:
+        request = {}
+    server.endpoints[endpoint](handler, endpoint, request)
+
+
+class MockAccHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # Headers and body are written separately; avoid the Nagle/delayed-ACK stall between them
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_request = self.rfile.read(length)
+        dispatch(self, self.path, self.headers.get('X-Mock-Error'), raw_request)
+
+    def send_success(self, endpoint, request):
+        """
+        :usage: Default endpoint handler, answering with success_body()
+        """
+        config = self.server.config
+        self._send(200, {}, json.dumps(success_body(endpoint, request, config.lookup_devices, config.poc_size)))
+
+    def _send(self, status, headers, body):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockH2Stream(object):
+    """
+    :usage: One HTTP/2 request, answered on its own thread with the same endpoint handlers as MockAccHandler
+    """
+    send_success = MockAccHandler.send_success
+
+    def __init__(self, connection, stream_id, headers):
+        self.connection = connection
+        self.server = connection.server
+        self.stream_id = stream_id
+        self.headers = headers
+        self.body = bytearray()
+
+    def respond(self):
+        dispatch(self, self.headers.get(':path', ''), self.headers.get('x-mock-error'), bytes(self.body))
+
+    def _send(self, status, headers, body):
+        body = body.encode() if isinstance(body, str) else body
+        response_headers = [
+            (':status', str(status)), ('content-type', 'application/json;charset=utf-8'),
+            ('content-length', str(len(body)))
+        ] + [(name.lower(), value) for name, value in headers.items()]
+        self.connection.send(self.stream_id, response_headers, body)
+
+
+class MockH2Connection(object):
+    """
+    :usage: Serves one HTTP/2 connection: reads frames on the connection's thread and answers every request stream
+            concurrently, so many in-flight calls share the connection like they do with ACC behind an HTTP/2 proxy
+    """
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        self.condition = threading.Condition()  # Guards conn; notified when the peer opens its flow control window
+        self.streams = {}
+
+    def serve(self):
+        with self.condition:
+            self.conn.initiate_connection()
+            self.sock.sendall(self.conn.data_to_send())
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            with self.condition:
+                events = self.conn.receive_data(data)
+                for event in events:
+                    if isinstance(event, h2.events.RequestReceived):
+                        headers = dict((name.decode(), value.decode()) for name, value in event.headers)
+                        self.streams[event.stream_id] = MockH2Stream(self, event.stream_id, headers)
+                    elif isinstance(event, h2.events.DataReceived):
+                        self.streams[event.stream_id].body += event.data
+                        self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        stream = self.streams.pop(event.stream_id)
+                        threading.Thread(target=stream.respond, daemon=True).start()
+                    elif isinstance(event, h2.events.WindowUpdated):
+                        self.condition.notify_all()
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        return
+                self.sock.sendall(self.conn.data_to_send())
+
+    def send(self, stream_id, headers, body):
+        """
+        :usage: Sends a response, waiting for flow control window as needed
+        """
+        body = memoryview(body)
+        with self.condition:
+            self.conn.send_headers(stream_id, headers, end_stream=not body)
+            self.sock.sendall(self.conn.data_to_send())
+            while body:
+                window = min(self.conn.local_flow_control_window(stream_id), len(body))
+                if window <= 0:
+                    self.condition.wait(1.0)
+                    continue
+                # Queue as many frames as the window allows, then write them at once
+                while window > 0:
+                    size = min(window, self.conn.max_outbound_frame_size)
+                    self.conn.send_data(stream_id, body[:size].tobytes(), end_stream=size == len(body))
+                    body = body[size:]
+                    window -= size
+                self.sock.sendall(self.conn.data_to_send())
+
+
+class MockAccServer(ThreadingHTTPServer):
+    """
+    :usage: Threaded HTTPS server requiring client certificates signed by the mock CA. The TLS handshake runs in each
+            connection's own thread so concurrent handshakes are not serialized behind accept(). Clients negotiating
+            HTTP/2 through ALPN are served by MockH2Connection.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, certs, host='127.0.0.1', port=0, config=None):
+        """
+        :param certs: Dict from make_certs()
+        :param host: Interface to listen on (Default: 127.0.0.1)
+        :param port: Port to listen on (Default: 0, any free port)
+        :param config: MockConfig (Default: MockConfig())
+        """
+        ThreadingHTTPServer.__init__(self, (host, port), MockAccHandler)
+        self.config = config or MockConfig()
+        self.endpoints = dict((endpoint, MockAccHandler.send_success) for endpoint in ENDPOINTS)
+        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ssl_context.load_cert_chain(certs['server_cert'], certs['server_key'])
+        self.ssl_context.load_verify_locations(certs['ca_cert'])
+        self.ssl_context.verify_mode = ssl.CERT_REQUIRED
+        self.ssl_context.set_alpn_protocols(['h2', 'http/1.1'] if h2 is not None else ['http/1.1'])
+
+    @property
+    def base_url(self):
+        return 'https://localhost:{0}{1}'.format(self.server_address[1], BASE_PATH)
+
+    def finish_request(self, request, client_address):
+        try:
+            request = self.ssl_context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            request.close()
+            return
+        if request.selected_alpn_protocol() == 'h2':
+            request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            MockH2Connection(self, request).serve()
+            return
+        ThreadingHTTPServer.finish_request(self, request, client_address)
+
+    def start(self):
+        """
+        :usage: Serves requests on a background thread
+        :return: The server
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def _openssl(*args):
+    subprocess.run(('openssl',) + args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_certs(directory):
+    """
+    :usage: Creates a self-signed CA plus a server cert (localhost/127.0.0.1) and client cert signed by it, unless
+            they already exist. Requires the 'openssl' command.
+    :param directory: Directory to write the .pem files to
+    :return: Dict of ca_cert, server_cert, server_key, client_cert and client_key paths
+    """
+    os.makedirs(directory, exist_ok=True)
+    certs = dict(
+        ca_cert=os.path.join(directory, 'ca.pem'), ca_key=os.path.join(directory, 'ca_key.pem'),
+        server_cert=os.path.join(directory, 'server.pem'), server_key=os.path.join(directory, 'server_key.pem'),
+        client_cert=os.path.join(directory, 'client.pem'), client_key=os.path.join(directory, 'client_key.pem')
+    )
+    if all(os.path.exists(path) for path in certs.values()):
+        return certs
+
+    _openssl(
+        'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '30', '-subj', '/CN=Mock ACC CA',
+        '-keyout', certs['ca_key'], '-out', certs['ca_cert'],
+        '-addext', 'basicConstraints=critical,CA:TRUE', '-addext', 'keyUsage=critical,keyCertSign,cRLSign'
+    )
+    for name, common_name, extensions in (
+            ('server', 'localhost', 'subjectAltName=DNS:localhost,IP:127.0.0.1\nextendedKeyUsage=serverAuth'),
+            ('client', 'Mock ACC Client', 'extendedKeyUsage=clientAuth')):
+        csr = os.path.join(directory, name + '.csr')
+        extfile = os.path.join(directory, name + '.ext')
+        with open(extfile, 'w') as ext:
+            ext.write('basicConstraints=CA:FALSE\nkeyUsage=critical,digitalSignature,keyEncipherment\n'
+                      'subjectKeyIdentifier=hash\nauthorityKeyIdentifier=keyid,issuer\n' + extensions + '\n')
+        _openssl('req', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=' + common_name,
+                 '-keyout', certs[name + '_key'], '-out', csr)
+        _openssl('x509', '-req', '-in', csr, '-CA', certs['ca_cert'], '-CAkey', certs['ca_key'], '-CAcreateserial',
+                 '-days', '30', '-extfile', extfile, '-out', certs[name + '_cert'])
+        os.remove(csr)
+        os.remove(extfile)
+    return certs
+
+
+def serve_in_process(cert_dir, ready_queue, **config):
+    """
+    :usage: multiprocessing target running a mock server until the process is terminated
+    :param cert_dir: Directory passed to make_certs()
+    :param ready_queue: Queue that receives the server base_url once it is listening
+    :param config: MockConfig keyword arguments
+    """
+    server = MockAccServer(make_certs(cert_dir), config=MockConfig(**config))
+    ready_queue.put(server.base_url)
+    server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local mock of the AppleCare Connect order-service endpoints')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--cert-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '.certs'))
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random extra seconds, up to this value')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with an error')
+    parser.add_argument('--error-kinds', default=','.join(ERROR_KINDS), help='Comma separated ERROR_KINDS to inject')
+    parser.add_argument('--lookup-devices', type=int, default=1, help='Device records per get-order response')
+    parser.add_argument('--poc-size', type=int, default=65536, help='POC document size in bytes')
+    args = parser.parse_args(argv)
+
+    certs = make_certs(args.cert_dir)
+    config = MockConfig(
+        args.latency, args.jitter, args.error_rate, args.error_kinds.split(','), args.lookup_devices, args.poc_size
+    )
+    server = MockAccServer(certs, args.host, args.port, config)
+    print('Mock ACC listening on {0}'.format(server.base_url))
+    print('Client cert: {0}\nClient key: {1}\nCA bundle: {2}'.format(
+        certs['client_cert'], certs['client_key'], certs['ca_cert']))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
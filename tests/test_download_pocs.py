@@ -0,0 +1,66 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import acc  # noqa: E402
+
+
+class FakeClient(object):
+    """
+    :usage: Stands in for AccClient, writing a small document to each poc_content sink
+    """
+
+    def __init__(self):
+        self.device_ids = []
+        self._lock = threading.Lock()
+
+    def poc_content(self, device_id, poc_language="ENG", sink=None, suppress_print=True):
+        with self._lock:
+            self.device_ids.append(device_id)
+        with open(sink, 'wb') as output:
+            output.write(b'%PDF-1.4')
+        return acc.AccResult({}, {}, [], [], 'poc_content')
+
+
+class DownloadPocsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.directory = os.path.join(self.root, 'pocs')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def download(self, device_ids):
+        client = FakeClient()
+        results = {result.device_id: result for result in acc.download_pocs(device_ids, self.directory, client=client)}
+        return results, client.device_ids
+
+    def test_downloads_each_device(self):
+        results, downloaded = self.download(['C02ABC123456', 'c02def123456', '356938035643809'])
+        self.assertEqual(sorted(downloaded), ['356938035643809', 'C02ABC123456', 'c02def123456'])
+        self.assertEqual(results['c02def123456'].path, os.path.join(self.directory, 'C02DEF123456.pdf'))
+        self.assertTrue(all(result.bytes == 8 and not result.error_code for result in results.values()))
+
+    def test_rejects_paths(self):
+        results, downloaded = self.download(['../x', 'pocs/C02ABC123456', '', 'C02ABC123456'])
+        self.assertEqual(downloaded, ['C02ABC123456'])
+        for device_id in ('../x', 'pocs/C02ABC123456', ''):
+            self.assertEqual(results[device_id].error_code, [acc.PREFLIGHT_ERROR_CODE])
+            self.assertIsNone(results[device_id].path)
+        self.assertEqual(os.listdir(self.root), ['pocs'])
+
+    def test_rejects_duplicates(self):
+        device_ids = ['C02ABC123456', 'c02abc123456', 'C02ABC123456']
+        results = list(acc.download_pocs(device_ids, self.directory, client=FakeClient()))
+        self.assertEqual(sorted(bool(result.error_code) for result in results), [False, True, True])
+        self.assertEqual(os.listdir(self.directory), ['C02ABC123456.pdf'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import acc  # noqa: E402
+
+RECORD = dict(
+    invoice_number='INV-1001', first_name='Jane', last_name='Appleseed', company_name='',
+    email_address='jane@example.com', address_line1='1 Infinite Loop', address_line2='', city='Cupertino', state='CA',
+    zip_code='95014', device_id='C02ABC123456', secondary_serial='', purchase_date='10/01/26'
+)
+ORDER_BODY = '{"orderConfirmation": {"purchaseOrderNumber": "INV-1001"}}'
+LOOKUP_FOUND = '{"customerDetails": {}, "orderDetails": [{"purchaseOrderNumber": "INV-1001"}]}'
+LOOKUP_OTHER_ORDER = '{"customerDetails": {}, "orderDetails": [{"purchaseOrderNumber": "INV-0999"}]}'
+LOOKUP_NOT_FOUND = '{"lookupErrorResponse": {"errorCode": "LKP_NOT_FOUND", "errorMessage": "No order found"}}'
+LOOKUP_THROTTLED = '{"lookupErrorResponse": {"errorCode": "LKP_THROTTLED", "errorMessage": "Too many requests"}}'
+SERVICE_UNAVAILABLE = '<html><body>503 Service Unavailable</body></html>'
+
+
+class FakeClient(object):
+    """
+    :usage: Stands in for AccClient, answering each endpoint with a canned body parsed like a real response
+    """
+
+    def __init__(self, lookup_body):
+        self.lookup_body = lookup_body
+        self.calls = []
+
+    def _answer(self, endpoint, call_type, body):
+        self.calls.append(endpoint)
+        if isinstance(body, Exception):
+            raise body
+        full_response, error_code, error_message = acc.response_handler(body, True)
+        return acc.AccResult({}, full_response, error_code, error_message, call_type)
+
+    def three_sixty_lookup(self, invoice_number, device_id, email_address, suppress_print=True):
+        return self._answer('get-order', 'three_sixty_lookup', self.lookup_body)
+
+    def verify_order(self, suppress_print=True, **kwargs):
+        return self._answer('verify-order', 'verify_order', ORDER_BODY)
+
+    def create_order(self, suppress_print=True, **kwargs):
+        return self._answer('create-order', 'create_order', ORDER_BODY)
+
+
+class EnrollmentJournalResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal = acc.EnrollmentJournal(os.path.join(self.directory, 'enroll.db'))
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.directory)
+
+    def enroll(self, lookup_body, state):
+        """
+        :return: (EnrollmentResult, endpoints called) of resuming RECORD journaled in state
+        """
+        if state is not None:
+            self.journal.record(RECORD, state, 0)
+        client = FakeClient(lookup_body)
+        return acc.enroll_order(client, RECORD, 0, journal=self.journal), client.calls
+
+    def assertStillInDoubt(self, lookup_body):
+        result, calls = self.enroll(lookup_body, 'create_sent')
+        self.assertEqual(calls, ['get-order'])
+        self.assertEqual(result.status, 'create_failed')
+        self.assertEqual(self.journal.state(RECORD), 'create_sent')
+
+    def test_new_record_is_created(self):
+        result, calls = self.enroll(LOOKUP_FOUND, None)
+        self.assertEqual(calls, ['verify-order', 'create-order'])
+        self.assertEqual(result.status, 'ok')
+        self.assertEqual(self.journal.state(RECORD), 'created')
+
+    def test_created_record_is_skipped(self):
+        result, calls = self.enroll(LOOKUP_FOUND, 'created')
+        self.assertIsNone(result)
+        self.assertEqual(calls, [])
+
+    def test_in_doubt_record_confirmed(self):
+        result, calls = self.enroll(LOOKUP_FOUND, 'create_sent')
+        self.assertEqual(calls, ['get-order'])
+        self.assertEqual(result.status, 'ok')
+        self.assertEqual(self.journal.state(RECORD), 'created')
+
+    def test_in_doubt_record_not_found(self):
+        result, calls = self.enroll(LOOKUP_OTHER_ORDER, 'create_sent')
+        self.assertEqual(calls, ['get-order', 'verify-order', 'create-order'])
+        self.assertEqual(result.status, 'ok')
+        self.assertEqual(self.journal.state(RECORD), 'created')
+
+    def test_in_doubt_record_not_found_error_code(self):
+        acc.LOOKUP_NOT_FOUND_CODES.add('LKP_NOT_FOUND')
+        try:
+            result, calls = self.enroll(LOOKUP_NOT_FOUND, 'create_sent')
+        finally:
+            acc.LOOKUP_NOT_FOUND_CODES.discard('LKP_NOT_FOUND')
+        self.assertEqual(calls, ['get-order', 'verify-order', 'create-order'])
+        self.assertEqual(result.status, 'ok')
+
+    def test_unlisted_lookup_error_keeps_record_in_doubt(self):
+        self.assertStillInDoubt(LOOKUP_NOT_FOUND)
+
+    def test_lookup_throttled_keeps_record_in_doubt(self):
+        self.assertStillInDoubt(LOOKUP_THROTTLED)
+
+    def test_lookup_invalid_json_keeps_record_in_doubt(self):
+        self.assertStillInDoubt(SERVICE_UNAVAILABLE)
+
+    def test_lookup_exception_keeps_record_in_doubt(self):
+        acc._define_requests_classes()
+        self.assertStillInDoubt(acc.requests.exceptions.ReadTimeout('read timed out'))
+
+
+if __name__ == '__main__':
+    unittest.main()
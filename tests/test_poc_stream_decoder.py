@@ -0,0 +1,95 @@
+import base64
+import io
+import json
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import acc  # noqa: E402
+
+# 1001 bytes: the base64 has a '+' (from the leading 0xfb bytes), a '/' and one '=' of padding
+DOCUMENT = b'\xfb\xef\xbe\xff' + bytes(random.Random(1).randrange(256) for _ in range(997))
+ENCODED = base64.b64encode(DOCUMENT).decode('ascii')
+CHUNK_SIZES = (1, 2, 3, 4, 5, 7, 13, 64, 100000)
+
+
+def response(content):
+    """
+    :param content: JSON string body of the pocContent value, escapes included
+    :return: Response bytes with the document between two other keys
+    """
+    return ('{"pocResponse": {"deviceId": "C02ABC123456", "pocContent": "' + content + '", "pocLanguage": "ENG"}}'
+            ).encode('ascii')
+
+
+def decode(body, chunk_size):
+    """
+    :return: (decoded document, response without the document) from feeding body in chunk_size chunks
+    """
+    sink = io.BytesIO()
+    decoder = acc.PocStreamDecoder(sink)
+    for position in range(0, len(body), chunk_size):
+        decoder.feed(body[position:position + chunk_size])
+    return sink.getvalue(), decoder.close()
+
+
+class PocStreamDecoderTest(unittest.TestCase):
+
+    def assertDecodes(self, content):
+        for chunk_size in CHUNK_SIZES:
+            document, skeleton = decode(response(content), chunk_size)
+            self.assertEqual(document, DOCUMENT, 'chunk size {0}'.format(chunk_size))
+            self.assertEqual(json.loads(skeleton)['pocResponse'], dict(
+                deviceId='C02ABC123456', pocContent='', pocLanguage='ENG'
+            ))
+
+    def test_document_is_base64(self):
+        self.assertIn('+', ENCODED)
+        self.assertIn('/', ENCODED)
+        self.assertTrue(ENCODED.endswith('=') and not ENCODED.endswith('=='))
+
+    def test_plain(self):
+        self.assertDecodes(ENCODED)
+
+    def test_escaped_slash(self):
+        self.assertDecodes(ENCODED.replace('/', '\\/'))
+
+    def test_escaped_line_breaks(self):
+        lines = [ENCODED[position:position + 76] for position in range(0, len(ENCODED), 76)]
+        self.assertDecodes('\\r\\n'.join(lines))
+        self.assertDecodes('\\u000a'.join(lines))
+
+    def test_unicode_escaped_padding(self):
+        # Gson escapes '=' as \u003d by default
+        self.assertDecodes(ENCODED.replace('=', '\\u003d'))
+        self.assertDecodes(ENCODED.replace('=', '\\u003D'))
+
+    def test_unicode_escaped_plus(self):
+        self.assertDecodes(ENCODED.replace('+', '\\u002b'))
+
+    def test_every_character_unicode_escaped(self):
+        self.assertDecodes(''.join('\\u{0:04x}'.format(ord(character)) for character in ENCODED))
+
+    def test_invalid_escapes(self):
+        for escape in ('\\"', '\\\\', '\\b', '\\f', '\\u00e9', '\\u0022', '\\u00zz', '\\u 03d', '\\x'):
+            for chunk_size in (1, 3, 100000):
+                with self.assertRaises(acc.PocDecodeError, msg='{0} chunk size {1}'.format(escape, chunk_size)):
+                    decode(response(ENCODED[:100] + escape + ENCODED[100:]), chunk_size)
+
+    def test_truncated_unicode_escape(self):
+        with self.assertRaises(acc.PocDecodeError):
+            decode(response(ENCODED + '\\u00'), 2)
+
+    def test_invalid_padding(self):
+        with self.assertRaises(acc.PocDecodeError):
+            decode(response(ENCODED[:5]), 100000)
+
+    def test_decode_error_is_value_error(self):
+        self.assertTrue(issubclass(acc.PocDecodeError, ValueError))
+
+
+if __name__ == '__main__':
+    unittest.main()
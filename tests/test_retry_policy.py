@@ -0,0 +1,129 @@
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import acc  # noqa: E402
+
+acc._define_requests_classes()
+requests = acc.requests
+urllib3 = acc.urllib3
+
+
+def closed_port_url():
+    """
+    :return: URL of a local port nothing listens on, so connecting to it is refused
+    """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return 'https://127.0.0.1:{0}/'.format(port)
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_idempotent(self):
+        policy = acc.RetryPolicy(max_attempts=3)
+        self.assertTrue(policy.should_retry(1, failure='connect'))
+        self.assertTrue(policy.should_retry(1, failure='transport'))
+        for status_code in acc.THROTTLE_STATUSES:
+            self.assertTrue(policy.should_retry(1, status_code=status_code))
+        for status_code in (200, 400, 404):
+            self.assertFalse(policy.should_retry(1, status_code=status_code))
+
+    def test_non_idempotent(self):
+        policy = acc.RetryPolicy(max_attempts=3, idempotent=False)
+        self.assertTrue(policy.should_retry(1, failure='connect'))
+        # The request may have reached ACC: sending it again could create the order twice
+        self.assertFalse(policy.should_retry(1, failure='transport'))
+        self.assertTrue(policy.should_retry(1, status_code=429))
+        for status_code in set(acc.THROTTLE_STATUSES) - {429} | {200, 400, 500}:
+            self.assertFalse(policy.should_retry(1, status_code=status_code), status_code)
+
+    def test_guarded_statuses(self):
+        policy = acc.RetryPolicy(idempotent=False, guarded_statuses=(429, 503))
+        self.assertTrue(policy.should_retry(1, status_code=503))
+        self.assertFalse(policy.should_retry(1, status_code=502))
+
+    def test_max_attempts(self):
+        for idempotent in (True, False):
+            policy = acc.RetryPolicy(max_attempts=2, idempotent=idempotent)
+            self.assertTrue(policy.should_retry(1, failure='connect'))
+            self.assertFalse(policy.should_retry(2, failure='connect'))
+            self.assertFalse(policy.should_retry(2, status_code=429))
+        self.assertFalse(acc.RetryPolicy(max_attempts=1).should_retry(1, failure='connect'))
+
+    def test_backoff(self):
+        policy = acc.RetryPolicy(backoff_base=0.5, backoff_max=2.0)
+        for attempt in range(1, 8):
+            self.assertLessEqual(policy.backoff(attempt), min(2.0, 0.5 * 2 ** (attempt - 1)))
+        self.assertGreaterEqual(policy.backoff(1, retry_after_seconds=1.5), 1.5)
+        self.assertLessEqual(policy.backoff(1, retry_after_seconds=60), 2.0)
+
+    def test_default_policies(self):
+        for endpoint in ('create-order', 'cancel-order'):
+            self.assertFalse(acc.DEFAULT_RETRY_POLICIES[endpoint].idempotent)
+        for endpoint in ('verify-order', 'get-order', 'get-poc-content', 'consolidated-poc'):
+            self.assertTrue(acc.DEFAULT_RETRY_POLICIES[endpoint].idempotent)
+
+
+class ConnectFailedTest(unittest.TestCase):
+
+    def test_requests_refused(self):
+        with self.assertRaises(requests.exceptions.ConnectionError) as raised:
+            requests.post(closed_port_url(), timeout=5)
+        self.assertTrue(acc._connect_failed(raised.exception))
+
+    def test_requests_exceptions(self):
+        new_connection = urllib3.exceptions.MaxRetryError(
+            None, '/', reason=urllib3.exceptions.NewConnectionError(None, 'refused')
+        )
+        protocol = urllib3.exceptions.ProtocolError('Connection aborted.', ConnectionResetError())
+        for exc, connect in ((requests.exceptions.ConnectTimeout('connect'), True),
+                             (requests.exceptions.SSLError('handshake'), True),
+                             (acc.TransportConnectError('refused'), True),
+                             (requests.exceptions.ConnectionError(new_connection), True),
+                             (requests.exceptions.ConnectionError(protocol), False),
+                             (requests.exceptions.ConnectionError(), False),
+                             (requests.exceptions.ReadTimeout('read'), False),
+                             (requests.exceptions.ChunkedEncodingError('body'), False)):
+            self.assertIs(acc._connect_failed(exc), connect, repr(exc))
+
+    def test_httpx_exceptions(self):
+        httpx = acc.httpx
+        if httpx is None:
+            self.skipTest('httpx is not installed')
+        for exc, connect in ((httpx.ConnectError('refused'), True), (httpx.ConnectTimeout('connect'), True),
+                             (httpx.PoolTimeout('pool'), True), (httpx.ReadTimeout('read'), False),
+                             (httpx.WriteTimeout('write'), False), (httpx.RemoteProtocolError('closed'), False),
+                             (httpx.ReadError('reset'), False)):
+            self.assertIs(acc._httpx_connect_failed(exc), connect, repr(exc))
+            mapped = acc.HttpxTransport._requests_exception(exc)
+            self.assertIsInstance(mapped, requests.RequestException)
+            self.assertIs(acc._connect_failed(mapped), connect, repr(exc))
+        self.assertIsInstance(acc.HttpxTransport._requests_exception(httpx.ReadTimeout('read')),
+                              requests.exceptions.ReadTimeout)
+
+    def test_httpx_refused(self):
+        httpx = acc.httpx
+        if httpx is None:
+            self.skipTest('httpx is not installed')
+        with self.assertRaises(httpx.HTTPError) as raised:
+            httpx.post(closed_port_url(), timeout=5)
+        self.assertTrue(acc._httpx_connect_failed(raised.exception))
+
+    def test_stdlib_exceptions(self):
+        mapped = acc.HTTPClientTransport._requests_exception
+        for exc, connected, connect in ((ConnectionRefusedError(), False, True), (socket.timeout(), False, True),
+                                        (OSError('handshake'), False, True), (socket.timeout(), True, False),
+                                        (ConnectionResetError(), True, False)):
+            self.assertIs(acc._connect_failed(mapped(exc, connected)), connect, (exc, connected))
+        self.assertIsInstance(mapped(socket.timeout(), False), requests.exceptions.ConnectTimeout)
+        self.assertIsInstance(mapped(socket.timeout(), True), requests.exceptions.ReadTimeout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import acc  # noqa: E402
+
+ORDER = dict(
+    invoice_number='INV-1001', first_name='Jane', last_name='Appleseed', email_address='jane@example.com',
+    device_id='C02ABC123456', purchase_date='10/01/26'
+)
+CANCELLATION = dict(device_id='C02ABC123456', cancellation_date='10/01/26', cancel_reason_code='CUS')
+
+
+class ValidationTest(unittest.TestCase):
+
+    def assertFieldErrors(self, errors, expected):
+        self.assertEqual([(error.field, error.code) for error in errors], expected)
+
+    def test_valid_order(self):
+        self.assertFieldErrors(acc.validate_order(ORDER), [])
+
+    def test_device_ids(self):
+        # Serial numbers (upper cased before matching), a 15 digit IMEI, and hex and decimal MEIDs
+        for device_id in ('c02abc123456', 'DMPHK1ABCD', '356938035643809', 'A0000012345678', '270113177609606060'):
+            self.assertFieldErrors(acc.validate_order(dict(ORDER, device_id=device_id)), [])
+        for device_id in ('C02-BAD', 'C02ABC1', '1234567890123456', '../C02ABC123456'):
+            self.assertFieldErrors(acc.validate_order(dict(ORDER, device_id=device_id)), [('device_id', 'format')])
+
+    def test_missing_fields(self):
+        self.assertFieldErrors(acc.validate_order(dict(ORDER, email_address='', purchase_date=None)), [
+            ('email_address', 'required'), ('purchase_date', 'required')
+        ])
+
+    def test_cancel_reason_codes(self):
+        validator = acc.RecordValidator(acc.CANCEL_RULES, cancel_reason_codes=('CUS',))
+        self.assertFieldErrors(validator(CANCELLATION), [])
+        self.assertFieldErrors(validator(dict(CANCELLATION, cancel_reason_code='XYZ')), [
+            ('cancel_reason_code', 'format')
+        ])
+        # Reported once, as required, rather than also as an unknown reason code
+        self.assertFieldErrors(validator(dict(CANCELLATION, cancel_reason_code='')), [
+            ('cancel_reason_code', 'required')
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()